@@ -0,0 +1,110 @@
+import argparse
+import pickle
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+import numpy as np
+from data_access.db.db import SessionLocal
+from data_access.db.repositories import ProductRepository
+from data_access.snapshot import snapshot_session_factory
+from filters.content_model import ContentModel, create_vectorizer
+from services.logger import Logger
+
+# Featurizer configurations compared by the benchmark; the first one is the current default
+CONFIGURATIONS = [
+    {"name": "tfidf (current)", "featurizer": "tfidf"},
+    {"name": "tfidf float64", "featurizer": "tfidf", "dtype": np.float64},
+    {"name": "hashing 2^18 float32", "featurizer": "hashing", "n_features": 2 ** 18, "dtype": np.float32},
+    {"name": "hashing 2^20 1-2grams float32", "featurizer": "hashing", "n_features": 2 ** 20, "ngram_range": (1, 2), "dtype": np.float32},
+]
+
+
+def benchmark_featurizer(config: Dict, product_ids: List[str], descriptions: List[str], new_descriptions: List[str]) -> Dict:
+    """
+    Fits one featurizer configuration and measures its cost.
+
+    Args:
+        config (Dict): Configuration from `CONFIGURATIONS`.
+        product_ids (List[str]): IDs of the catalog products.
+        descriptions (List[str]): Descriptions of the catalog products.
+        new_descriptions (List[str]): Descriptions transformed after fitting, as for newly added products.
+
+    Returns:
+        Dict: Timings in milliseconds and sizes in bytes.
+    """
+    options = {key: value for key, value in config.items() if key != "name"}
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    model = ContentModel(create_vectorizer(**options)).fit(product_ids, descriptions)
+    fit_ms = (time.perf_counter() - start) * 1000
+    _, fit_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    model.vectorizer.transform(new_descriptions)
+    transform_ms = (time.perf_counter() - start) * 1000
+
+    matrix = model.matrix
+    return {
+        "name": config["name"],
+        "features": matrix.shape[1],
+        "fit_ms": fit_ms,
+        "transform_ms": transform_ms,
+        "fit_peak_bytes": fit_peak,
+        "matrix_bytes": matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes,
+        "vectorizer_bytes": len(pickle.dumps(model.vectorizer, protocol=pickle.HIGHEST_PROTOCOL))
+    }
+
+
+def run(limit: int = 0, new_products: int = 1000, snapshot: Optional[str] = None) -> List[Dict]:
+    """
+    Loads the catalog and benchmarks every featurizer configuration on it.
+
+    Args:
+        limit (int): Maximum number of products to load, 0 for all.
+        new_products (int): Number of descriptions transformed after fitting.
+        snapshot (Optional[str]): Snapshot directory (or "latest") read instead of the live database.
+
+    Returns:
+        List[Dict]: One result per configuration.
+    """
+    logger = Logger()
+    session_factory = snapshot_session_factory(snapshot)
+    session = session_factory() if session_factory is not None else SessionLocal()
+    try:
+        products = ProductRepository(session).get_all()
+    finally:
+        session.close()
+    if limit:
+        products = products[:limit]
+
+    product_ids = [product.unique_id for product in products]
+    descriptions = [product.getProductDescribed() for product in products]
+    new_descriptions = descriptions[:new_products]
+    logger.info(f"Benchmarking {len(CONFIGURATIONS)} featurizers on {len(products)} products.")
+
+    results = [benchmark_featurizer(config, product_ids, descriptions, new_descriptions) for config in CONFIGURATIONS]
+
+    headers = ["Featurizer", "Features", "Fit (ms)", f"Transform {len(new_descriptions)} (ms)", "Fit peak (MB)", "Matrix (MB)", "Vectorizer (MB)"]
+    print(" | ".join(headers))
+    for result in results:
+        print(" | ".join([
+            result["name"],
+            str(result["features"]),
+            f"{result['fit_ms']:.1f}",
+            f"{result['transform_ms']:.1f}",
+            f"{result['fit_peak_bytes'] / 2 ** 20:.2f}",
+            f"{result['matrix_bytes'] / 2 ** 20:.2f}",
+            f"{result['vectorizer_bytes'] / 2 ** 20:.2f}"
+        ]))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare memory and latency of the content featurizers.")
+    parser.add_argument("--limit", type=int, default=0, help="Maximum number of products to load (0 for all).")
+    parser.add_argument("--new-products", type=int, default=1000, help="Descriptions transformed after fitting.")
+    parser.add_argument("--snapshot", help="Snapshot directory, or \"latest\", read instead of the live database.")
+    args = parser.parse_args()
+    run(args.limit, args.new_products, args.snapshot)
@@ -0,0 +1,297 @@
+import argparse
+import json
+import resource
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime
+from typing import Callable, Dict, Optional, Tuple
+from services.logger import Logger
+
+# Exit statuses, so schedulers such as cron can tell a failed job from one that had nothing to do
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_EMPTY = 3
+EXIT_INTERRUPTED = 130
+
+# Seconds between progress reports of a running job
+PROGRESS_INTERVAL = 30.0
+
+# Result of a job: number of items processed and their unit, e.g. (5000, "users")
+JobResult = Tuple[int, str]
+
+
+def peak_rss() -> Tuple[int, int]:
+    """
+    Peak resident set size, in bytes, of this process and of its largest finished child process.
+    """
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+
+def _mib(size: int) -> str:
+    return f"{size / 2 ** 20:.1f} MiB"
+
+
+class JobReport:
+    """
+    Reports a running job: a progress line every `interval` seconds, then the elapsed time, the
+    throughput and the peak memory when it finishes.
+
+    The jobs log their own progress (shards scored, users evaluated); the periodic line is what a
+    scheduler's log shows for the steps that do not, such as building a model.
+    """
+    def __init__(self, name: str, interval: float = PROGRESS_INTERVAL) -> None:
+        self.logger = Logger()
+        self.name = name
+        self.interval = interval
+        self.started = time.perf_counter()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "JobReport":
+        self.started = time.perf_counter()
+        if self.interval > 0:
+            self._thread = threading.Thread(target=self._report_progress, name=f"{self.name}-progress", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def summary(self, status: str, items: int = 0, unit: str = "items") -> Dict:
+        """
+        Logs and returns the final report of the job.
+
+        Args:
+            status (str): "ok", "empty", "failed" or "interrupted".
+            items (int): Number of items the job processed.
+            unit (str): What the items are.
+
+        Returns:
+            Dict: JSON-serializable report.
+        """
+        elapsed = self.elapsed
+        own, children = peak_rss()
+        report = {
+            "job": self.name,
+            "status": status,
+            "items": items,
+            "unit": unit,
+            "seconds": round(elapsed, 3),
+            "throughput": round(items / elapsed, 3) if elapsed > 0 else None,
+            "peak_rss_bytes": own,
+            "peak_child_rss_bytes": children,
+            "finished_at": datetime.now().isoformat()
+        }
+        message = (f"Job {self.name} {status}: {items} {unit} in {elapsed:.1f}s "
+                   f"({report['throughput'] or 0:.1f} {unit}/s), peak RSS {_mib(own)}, largest worker {_mib(children)}.")
+        if status == "ok":
+            self.logger.info(message)
+        else:
+            self.logger.error(message)
+        return report
+
+    def _report_progress(self) -> None:
+        while not self._stopped.wait(self.interval):
+            own, children = peak_rss()
+            self.logger.info(f"Job {self.name} running for {self.elapsed:.0f}s, peak RSS {_mib(own)}, largest worker {_mib(children)}.")
+
+
+# The heavy modules are imported by each command, so `--help` and commands reading a snapshot do not
+# connect to the configured database on import
+
+def build(args: argparse.Namespace) -> JobResult:
+    """
+    Builds every model and publishes them to the registry as a new version.
+    """
+    from data_access.snapshot import Snapshot, resolve_snapshot
+    from services.model_registry import ModelBundle, ModelRegistry
+
+    snapshot = resolve_snapshot(args.snapshot)
+    if snapshot is not None:
+        exported = Snapshot(snapshot)
+        # Interactions recorded after the export are applied when the version is activated
+        with exported.replica()() as session:
+            bundle = ModelBundle.build(session, built_at=exported.exported_at, snapshot=exported)
+    else:
+        from data_access.db.db import SessionFactory
+        from data_access.db.repositories import ProductFeaturesRepository
+        with SessionFactory() as session:
+            if args.features:
+                ProductFeaturesRepository(session).rebuild_all(args.chunk_size or 1000)
+            bundle = ModelBundle.build(session)
+    metadata = {"snapshot": snapshot} if snapshot is not None else None
+    version = ModelRegistry(args.root).publish(bundle, metadata, promote=not args.no_promote)
+    print(version)
+    return len(bundle.content_model.product_ids), "products"
+
+
+def precompute(args: argparse.Namespace) -> JobResult:
+    """
+    Scores every user with the registry models and writes their recommendations.
+    """
+    from data_access.config import BATCH_SHARD_SIZE, BATCH_WORKERS
+    from services.batch_scoring import score_all
+
+    written = score_all(args.output, args.workers or BATCH_WORKERS, args.chunk_size or BATCH_SHARD_SIZE, args.k,
+                        args.neighbours, args.version, args.snapshot)
+    return written, "users"
+
+
+def load_data(args: argparse.Namespace) -> JobResult:
+    """
+    Copies a snapshot into a database, then recomputes the product text features there.
+    """
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from data_access.config import SNAPSHOT_BATCH_SIZE
+    from data_access.db.repositories import ProductFeaturesRepository
+    from data_access.snapshot import Snapshot, resolve_snapshot
+
+    snapshot = resolve_snapshot(args.snapshot)
+    rows = None
+    if snapshot is not None:
+        if not args.database_url:
+            raise ValueError("--database-url is required to load a snapshot")
+        target = create_engine(args.database_url)
+        rows = sum(Snapshot(snapshot).load_into(target, args.since, args.until, args.chunk_size or SNAPSHOT_BATCH_SIZE).values())
+    elif args.database_url:
+        target = create_engine(args.database_url)
+    else:
+        from data_access.db.db import engine as target
+
+    features = 0
+    if not args.no_features:
+        with sessionmaker(bind=target)() as session:
+            features = ProductFeaturesRepository(session).rebuild_all(args.chunk_size or 1000)
+    # Copied rows and recomputed features are different units; the job counts the rows when it copied any
+    if rows is None:
+        return features, "products"
+    Logger().info(f"Recomputed the text features of {features} products.")
+    return rows, "rows"
+
+
+def benchmark(args: argparse.Namespace) -> JobResult:
+    """
+    Compares the memory and latency of the content featurizers.
+    """
+    from benchmarks.content_featurizer import run
+
+    return len(run(args.limit, args.new_products, args.snapshot)), "featurizers"
+
+
+def evaluate(args: argparse.Namespace) -> JobResult:
+    """
+    Evaluates filter configurations offline on a time-based split.
+    """
+    from evaluation.offline_evaluation import evaluate as evaluate_offline
+
+    results = evaluate_offline(args.configs, args.test_fraction, args.k, args.workers or 4, args.max_users,
+                               args.chunk_size or 200, args.snapshot)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2, default=str)
+    return results[0]["users"] if results else 0, "users"
+
+
+# Command name -> (function, options of the shared set it uses)
+COMMANDS: Dict[str, Tuple[Callable[[argparse.Namespace], JobResult], Tuple[str, ...]]] = {
+    "build": (build, ("chunk_size", "snapshot")),
+    "precompute": (precompute, ("workers", "chunk_size", "snapshot")),
+    "load-data": (load_data, ("chunk_size", "snapshot")),
+    "benchmark": (benchmark, ("snapshot",)),
+    "evaluate": (evaluate, ("workers", "chunk_size", "snapshot"))
+}
+
+
+def create_parser() -> argparse.ArgumentParser:
+    # Options shared by every command; a command that has no use for one says so and ignores it
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--workers", type=int, help="Worker processes (the job's default when omitted).")
+    common.add_argument("--chunk-size", type=int, help="Users or rows handled at once (the job's default when omitted).")
+    common.add_argument("--snapshot", help="Snapshot directory, or \"latest\", read instead of the live database.")
+    common.add_argument("--progress-interval", type=float, default=PROGRESS_INTERVAL, help="Seconds between progress lines (0 to disable).")
+    common.add_argument("--report", help="Append the final JSON report of the job to this file.")
+
+    parser = argparse.ArgumentParser(description="Run the batch jobs of the recommender from the command line or a scheduler.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("build", parents=[common], help="Build or refit every model and publish a registry version.")
+    command.add_argument("--root", default=None, help="Registry directory.")
+    command.add_argument("--no-promote", action="store_true", help="Publish without pointing LATEST at it.")
+    command.add_argument("--features", action="store_true", help="Recompute the product text features first (live database only).")
+
+    command = commands.add_parser("precompute", parents=[common], help="Precompute the recommendations of every user.")
+    command.add_argument("--output", required=True, help="JSON lines file written with one line per user.")
+    command.add_argument("-k", type=int, default=50, help="Products kept per user and filter.")
+    command.add_argument("--neighbours", type=int, help="Most similar users used by the collaborative scores (all by default).")
+    command.add_argument("--version", help="Registry version to score with (the latest by default).")
+
+    command = commands.add_parser("load-data", parents=[common], help="Load a snapshot into a database and recompute the product text features.")
+    command.add_argument("--database-url", help="SQLAlchemy URL of the target database (the configured one by default).")
+    command.add_argument("--since", type=datetime.fromisoformat, help="Only interactions at or after this time.")
+    command.add_argument("--until", type=datetime.fromisoformat, help="Only interactions before this time.")
+    command.add_argument("--no-features", action="store_true", help="Do not recompute the product text features.")
+
+    command = commands.add_parser("benchmark", parents=[common], help="Compare memory and latency of the content featurizers.")
+    command.add_argument("--limit", type=int, default=0, help="Maximum number of products to load (0 for all).")
+    command.add_argument("--new-products", type=int, default=1000, help="Descriptions transformed after fitting.")
+
+    command = commands.add_parser("evaluate", parents=[common], help="Evaluate filter configurations offline.")
+    command.add_argument("--configs", nargs="+", help="Configurations to evaluate (all by default).")
+    command.add_argument("--test-fraction", type=float, default=0.2, help="Fraction of the latest interactions held out.")
+    command.add_argument("-k", type=int, default=10, help="Cut-off of the ranking metrics.")
+    command.add_argument("--max-users", type=int, default=0, help="Maximum number of test users (0 for all).")
+    command.add_argument("--output", help="Write the metrics to this JSON file.")
+    return parser
+
+
+def main(argv: Optional[list] = None) -> int:
+    """
+    Runs one command and returns the process exit status.
+
+    Returns:
+        int: `EXIT_OK`, `EXIT_EMPTY` when the job had nothing to process, `EXIT_FAILED` when it raised,
+             `EXIT_INTERRUPTED` on Ctrl-C or SIGINT, and `EXIT_USAGE` (from argparse) for invalid arguments.
+    """
+    args = create_parser().parse_args(argv)
+    logger = Logger()
+    function, used = COMMANDS[args.command]
+    for option in ("workers", "chunk_size", "snapshot"):
+        if getattr(args, option) is not None and option not in used:
+            logger.warn(f"{args.command} does not use --{option.replace('_', '-')}; ignoring it.")
+    if args.command == "build" and args.root is None:
+        from data_access.config import MODEL_REGISTRY_DIR
+        args.root = MODEL_REGISTRY_DIR
+
+    items, unit, status, code = 0, "items", "ok", EXIT_OK
+    with JobReport(args.command, args.progress_interval) as job:
+        try:
+            items, unit = function(args)
+            if items == 0:
+                status, code = "empty", EXIT_EMPTY
+        except KeyboardInterrupt:
+            status, code = "interrupted", EXIT_INTERRUPTED
+        except Exception as e:
+            logger.error(f"Job {args.command} failed: {type(e).__name__}: {str(e)}\n{traceback.format_exc()}")
+            status, code = "failed", EXIT_FAILED
+    report = job.summary(status, items, unit)
+    if args.report:
+        with open(args.report, "a") as file:
+            file.write(json.dumps(report) + "\n")
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,45 @@
+import threading
+from typing import Optional
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, scoped_session
 from .models import Base
-from data_access.config import DATABASE_URL
+from data_access.config import DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW
 
-engine = create_engine(DATABASE_URL)
+# The engine is created, and the tables with it, by the first session rather than on import, so jobs
+# reading a snapshot never connect to the configured database
+_engine: Optional[Engine] = None
+_engine_lock = threading.Lock()
 
-Base.metadata.create_all(engine)
 
-SessionLocal = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine))
+def get_engine() -> Engine:
+    """
+    Returns the engine of `DATABASE_URL`, creating it and any missing tables on first use.
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            engine = create_engine(DATABASE_URL, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_pre_ping=True)
+            Base.metadata.create_all(engine)
+            SessionFactory.configure(bind=engine)
+            _engine = engine
+        return _engine
+
+
+class _LazySessionMaker(sessionmaker):
+    def __call__(self, **local_kw):
+        get_engine()
+        return super().__call__(**local_kw)
+
+
+def __getattr__(name: str):
+    # `engine` stays importable as before, created when first imported
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Plain factory for callers that manage their own session lifetime (one session per request)
+SessionFactory = _LazySessionMaker(autocommit=False, autoflush=False)
+
+SessionLocal = scoped_session(SessionFactory)
@@ -0,0 +1,84 @@
+from collections import defaultdict
+from datetime import datetime
+from threading import Lock
+from typing import Callable, Dict, List, NamedTuple, Optional
+from services.logger import Logger
+
+# Event names published by the repositories
+INTERACTION_CREATED = "interaction_created"
+
+
+class InteractionEvent(NamedTuple):
+    """
+    Plain snapshot of a stored interaction, safe to hand to other threads after the session commits.
+
+    Attributes:
+        user_id (int): ID of the customer.
+        product_id (str): ID of the product.
+        interaction_type (str): Type of interaction (e.g., view, like, purchase).
+        time_stamp (datetime): When the interaction was recorded.
+        description (Optional[str]): Optional description of the interaction.
+    """
+    user_id: int
+    product_id: str
+    interaction_type: str
+    time_stamp: datetime
+    description: Optional[str] = None
+
+
+class RepositoryEvents:
+    """
+    Minimal publish/subscribe hub used by the repositories to notify in-memory models about writes.
+
+    Subscribers run synchronously in the writer's thread, after the transaction commits. A failing
+    subscriber is logged and never breaks the write or the other subscribers.
+    """
+    def __init__(self) -> None:
+        self.logger = Logger()
+        self._subscribers: Dict[str, List[Callable]] = defaultdict(list)
+        self._lock = Lock()
+
+    def subscribe(self, event: str, callback: Callable) -> None:
+        """
+        Registers a callback for an event.
+
+        Args:
+            event (str): Event name, e.g. `INTERACTION_CREATED`.
+            callback (Callable): Function called with the event payload.
+        """
+        with self._lock:
+            if callback not in self._subscribers[event]:
+                self._subscribers[event].append(callback)
+
+    def unsubscribe(self, event: str, callback: Callable) -> None:
+        """
+        Removes a previously registered callback. Unknown callbacks are ignored.
+
+        Args:
+            event (str): Event name.
+            callback (Callable): The callback to remove.
+        """
+        with self._lock:
+            if callback in self._subscribers[event]:
+                self._subscribers[event].remove(callback)
+
+    def publish(self, event: str, payload: object) -> None:
+        """
+        Calls every subscriber of an event with the given payload.
+
+        Args:
+            event (str): Event name.
+            payload (object): Value passed to each subscriber.
+        """
+        with self._lock:
+            subscribers = list(self._subscribers[event])
+
+        for callback in subscribers:
+            try:
+                callback(payload)
+            except Exception as e:
+                self.logger.error(f"Subscriber {getattr(callback, '__qualname__', callback)} failed on {event}: {str(e)}")
+
+
+# Process-wide hub shared by all repositories
+repository_events = RepositoryEvents()
@@ -1,6 +1,6 @@
 # app/models.py
 
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Boolean, JSON, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -94,6 +94,7 @@ class Product(Base):
 
     Relationships:
         interactions (relationship): Link to the interactions related to the product.
+        features (relationship): Link to the precomputed text features of the product.
     """
     __tablename__ = 'products'
     
@@ -127,6 +128,7 @@ class Product(Base):
     product_description = Column(Text)
 
     interactions = relationship('Interaction', back_populates='product')
+    features = relationship('ProductFeatures', back_populates='product', uselist=False)
 
     def getProductDescribed(self):
         """
@@ -154,7 +156,13 @@ class Interaction(Base):
         product (relationship): Link to the product involved in the interaction.
     """
     __tablename__ = 'interactions'
-    
+    # Same indexes as init.sql, so tables created from the metadata are queried the same way
+    __table_args__ = (
+        Index('interactions_user_time_idx', 'user_id', 'time_stamp'),
+        Index('interactions_product_user_idx', 'product_id', 'user_id'),
+        Index('interactions_time_idx', 'time_stamp'),
+    )
+
     user_id = Column(Integer, ForeignKey('customers.customer_id'), primary_key=True)
     product_id = Column(String, ForeignKey('products.unique_id'), primary_key=True)
     interaction_type = Column(Text)
@@ -163,3 +171,28 @@ class Interaction(Base):
 
     customer = relationship('Customer', back_populates='interactions')
     product = relationship('Product', back_populates='interactions')
+
+
+class ProductFeatures(Base):
+    """
+    Precomputed text features of a product, derived from `Product.getProductDescribed`.
+
+    Attributes:
+        product_id (str): ID of the product.
+        normalized_text (str): Lower-cased description with collapsed whitespace.
+        tokens (str): Space-separated tokens, as extracted by the content model's vectorizer.
+        token_hashes (list): Signed 32-bit MurmurHash3 of each token, as used by the hashing featurizer.
+        updated_at (datetime): When the features were computed.
+
+    Relationships:
+        product (relationship): Link to the product.
+    """
+    __tablename__ = 'product_features'
+
+    product_id = Column(String, ForeignKey('products.unique_id'), primary_key=True)
+    normalized_text = Column(Text)
+    tokens = Column(Text)
+    token_hashes = Column(JSON)
+    updated_at = Column(DateTime)
+
+    product = relationship('Product', back_populates='features')
@@ -1,8 +1,148 @@
-from typing import List, Optional
-from sqlalchemy.orm import Session
+import functools
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session, aliased, load_only
 from datetime import datetime
+from data_access.config import REPOSITORY_CACHE_SIZE
 from services.logger import Logger
-from .models import Customer, Product, Interaction
+from services.text_features import hash_tokens, normalize_text, tokenize
+from .events import INTERACTION_CREATED, InteractionEvent, repository_events
+from .models import Customer, Product, ProductFeatures, Interaction
+
+# Key of the read cache in `Session.info`
+CACHE_KEY = "repository_cache"
+
+# Version of every entity type, bumped by each write so cached reads of any session go stale
+_versions: Dict[type, int] = {}
+_versions_lock = threading.Lock()
+
+
+def invalidate(*entity_types: type) -> None:
+    """
+    Marks every cached read depending on the given entity types as stale, in all sessions.
+
+    Args:
+        *entity_types (type): Mapped classes whose rows changed.
+    """
+    with _versions_lock:
+        for entity_type in entity_types:
+            _versions[entity_type] = _versions.get(entity_type, 0) + 1
+
+
+class RepositoryCache:
+    """
+    Bounded LRU cache of repository reads, scoped to one session.
+
+    Each entry remembers the versions of the entity types it depends on and is ignored once any of
+    them is bumped by `invalidate`. The cache lives in `Session.info` and is dropped when the session's
+    transaction ends (commit, rollback or close), since the entities it holds are then expired or detached.
+    """
+    def __init__(self, max_size: int = REPOSITORY_CACHE_SIZE) -> None:
+        """
+        Initializes an empty cache.
+
+        Args:
+            max_size (int): Maximum number of cached reads.
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, Tuple[Tuple[int, ...], Any]]" = OrderedDict()
+
+    @classmethod
+    def for_session(cls, session: Session) -> "RepositoryCache":
+        """
+        Returns the cache of a session, creating it on first use.
+
+        Args:
+            session (Session): SQLAlchemy session.
+
+        Returns:
+            RepositoryCache: The session's cache.
+        """
+        cache = session.info.get(CACHE_KEY)
+        if cache is None:
+            cache = session.info[CACHE_KEY] = cls()
+        return cache
+
+    def get(self, key: Hashable, versions: Tuple[int, ...]) -> Tuple[bool, Any]:
+        """
+        Looks up a read.
+
+        Args:
+            key (Hashable): Identifies the repository method and its arguments.
+            versions (Tuple[int, ...]): Current versions of the entity types the read depends on.
+
+        Returns:
+            Tuple[bool, Any]: Whether a fresh entry was found, and its value.
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != versions:
+            self.misses += 1
+            return False, None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True, entry[1]
+
+    def put(self, key: Hashable, versions: Tuple[int, ...], value: Any) -> None:
+        """
+        Stores a read, evicting the least recently used one when full.
+
+        Args:
+            key (Hashable): Identifies the repository method and its arguments.
+            versions (Tuple[int, ...]): Versions of the entity types the read depends on.
+            value (Any): Result of the read.
+        """
+        self._entries[key] = (versions, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _drop_session_cache(session: Session, transaction) -> None:
+    # Committed entities are expired and closed ones detached, so cached results must not outlive the transaction
+    if transaction.parent is None:
+        session.info.pop(CACHE_KEY, None)
+
+
+def cached(*entity_types: type) -> Callable:
+    """
+    Caches a repository read in the session's `RepositoryCache`.
+
+    List arguments are part of the key as tuples, and list results are returned as copies so callers
+    cannot alter the cached value.
+
+    Args:
+        *entity_types (type): Mapped classes the read depends on.
+
+    Returns:
+        Callable: The decorator.
+    """
+    def decorator(method: Callable) -> Callable:
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            key = (type(self).__name__, method.__name__) + tuple(
+                tuple(arg) if isinstance(arg, list) else arg for arg in args
+            ) + tuple(sorted(kwargs.items()))
+            versions = tuple(_versions.get(entity_type, 0) for entity_type in entity_types)
+            cache = RepositoryCache.for_session(self.session)
+            hit, value = cache.get(key, versions)
+            if not hit:
+                value = method(self, *args, **kwargs)
+                cache.put(key, versions, value)
+            return list(value) if isinstance(value, list) else value
+        return wrapper
+    return decorator
+
 
 class BaseRepository:
     """
@@ -31,6 +171,7 @@ class BaseRepository:
         """
         self.session.add(entity)
         self.session.commit()
+        invalidate(type(entity))
 
     def remove(self, entity: object) -> None:
         """
@@ -41,12 +182,16 @@ class BaseRepository:
         """
         self.session.delete(entity)
         self.session.commit()
+        invalidate(type(entity))
 
     def update(self) -> None:
         """
         Commits the transaction to update the session.
+
+        The changed entity types are not known here, so every cached read is invalidated.
         """
         self.session.commit()
+        invalidate(Customer, Product, ProductFeatures, Interaction)
 
     def get_all(self) -> List[object]:
         """
@@ -80,6 +225,7 @@ class CustomerRepository(BaseRepository):
     """
     Repository class for managing `Customer` entities.
     """
+    @cached(Customer)
     def get_all(self) -> List[Customer]:
         """
         Retrieves all customers from the database.
@@ -89,6 +235,17 @@ class CustomerRepository(BaseRepository):
         """
         return self.session.query(Customer).all()
 
+    @cached(Customer)
+    def get_all_ids(self) -> List[int]:
+        """
+        Retrieves the IDs of all customers, ordered by ID, without loading the entities.
+
+        Returns:
+            List[int]: List of customer IDs.
+        """
+        return [row[0] for row in self.session.query(Customer.customer_id).order_by(Customer.customer_id)]
+
+    @cached(Customer)
     def get_by_id(self, customer_id: int) -> Optional[Customer]:
         """
         Retrieves a customer by its ID from the database.
@@ -106,6 +263,18 @@ class ProductRepository(BaseRepository):
     """
     Repository class for managing `Product` entities.
     """
+    def add(self, entity: Product) -> None:
+        """
+        Adds a product together with its precomputed text features and commits the transaction.
+
+        Args:
+            entity (Product): Product to be added to the session.
+        """
+        entity.features = ProductFeatures(**ProductFeaturesRepository.compute(entity))
+        super().add(entity)
+        invalidate(ProductFeatures)
+
+    @cached(Product)
     def get_all_paginated(self, page: int = 1, page_size: int = 10) -> List[Product]:
         """
         Retrieves a paginated list of products from the database.
@@ -120,6 +289,7 @@ class ProductRepository(BaseRepository):
         offset = (page - 1) * page_size
         return self.session.query(Product).offset(offset).limit(page_size).all()
     
+    @cached(Product)
     def get_all(self) -> List[Product]:
         """
         Retrieves all products from the database.
@@ -129,6 +299,27 @@ class ProductRepository(BaseRepository):
         """
         return self.session.query(Product).all()
 
+    @cached(Product)
+    def get_all_ids(self) -> List[str]:
+        """
+        Retrieves the unique IDs of all products, ordered by ID, without loading the entities.
+
+        Returns:
+            List[str]: List of product IDs.
+        """
+        return [row[0] for row in self.session.query(Product.unique_id).order_by(Product.unique_id)]
+
+    @cached(Product)
+    def get_attributes(self) -> List[Tuple[str, Optional[str], Optional[str]]]:
+        """
+        Retrieves the brand and category of every product without loading the entities.
+
+        Returns:
+            List[Tuple[str, Optional[str], Optional[str]]]: `(unique_id, brand_name, category)` tuples.
+        """
+        return [tuple(row) for row in self.session.query(Product.unique_id, Product.brand_name, Product.category)]
+
+    @cached(Product)
     def get_by_id(self, unique_id: str) -> Optional[Product]:
         """
         Retrieves a product by its unique ID from the database.
@@ -141,11 +332,146 @@ class ProductRepository(BaseRepository):
         """
         return self.session.query(Product).filter(Product.unique_id == unique_id).first()
 
+    @cached(Product)
+    def get_by_ids(self, unique_ids: List[str]) -> List[Product]:
+        """
+        Retrieves several products with a single query, preserving the order of the given IDs.
+
+        Args:
+            unique_ids (List[str]): Unique IDs of the products to be retrieved.
+
+        Returns:
+            List[Product]: The products found; unknown IDs are skipped.
+        """
+        if not unique_ids:
+            return []
+        products = self.session.query(Product).filter(Product.unique_id.in_(unique_ids)).all()
+        by_id = {product.unique_id: product for product in products}
+        return [by_id[unique_id] for unique_id in unique_ids if unique_id in by_id]
+
+    @cached(Product, Interaction)
+    def get_popular_ids_by_category(self, category: str, limit: int) -> List[str]:
+        """
+        Retrieves the IDs of the most interacted products of a category.
+
+        Args:
+            category (str): The product category.
+            limit (int): Maximum number of IDs to return.
+
+        Returns:
+            List[str]: Product IDs ordered by number of interactions, descending.
+        """
+        return [
+            row[0] for row in
+            self.session.query(Product.unique_id)
+            .outerjoin(Interaction, Interaction.product_id == Product.unique_id)
+            .filter(Product.category == category)
+            .group_by(Product.unique_id)
+            .order_by(func.count(Interaction.product_id).desc(), Product.unique_id)
+            .limit(limit)
+        ]
+
+
+class ProductFeaturesRepository(BaseRepository):
+    """
+    Repository class for managing `ProductFeatures` entities, the precomputed text features of products.
+    """
+    # Columns read from `products` to build the description
+    DESCRIPTION_COLUMNS = (
+        Product.unique_id, Product.product_name, Product.about_product,
+        Product.category, Product.brand_name, Product.product_specification
+    )
+
+    @staticmethod
+    def compute(product: Product) -> dict:
+        """
+        Computes the text features of a product.
+
+        Args:
+            product (Product): The product.
+
+        Returns:
+            dict: Column values of the `ProductFeatures` row.
+        """
+        normalized_text = normalize_text(product.getProductDescribed())
+        tokens = tokenize(normalized_text)
+        return {
+            "product_id": product.unique_id,
+            "normalized_text": normalized_text,
+            "tokens": " ".join(tokens),
+            "token_hashes": hash_tokens(tokens),
+            "updated_at": datetime.now()
+        }
+
+    def get_all(self) -> List[ProductFeatures]:
+        """
+        Retrieves the features of all products, ordered by product ID.
+
+        Returns:
+            List[ProductFeatures]: List of all ProductFeatures entities.
+        """
+        return self.session.query(ProductFeatures).order_by(ProductFeatures.product_id).all()
+
+    @cached(ProductFeatures)
+    def get_by_id(self, product_id: str) -> Optional[ProductFeatures]:
+        """
+        Retrieves the features of a product.
+
+        Args:
+            product_id (str): Unique ID of the product.
+
+        Returns:
+            Optional[ProductFeatures]: The features if computed, otherwise None.
+        """
+        return self.session.query(ProductFeatures).filter(ProductFeatures.product_id == product_id).first()
+
+    @cached(ProductFeatures)
+    def count(self) -> int:
+        """
+        Counts the products with computed features.
+
+        Returns:
+            int: Number of ProductFeatures rows.
+        """
+        return self.session.query(func.count(ProductFeatures.product_id)).scalar()
+
+    def rebuild_all(self, batch_size: int = 1000) -> int:
+        """
+        Recomputes the features of the whole catalog in bulk.
+
+        Products are streamed with only the description columns loaded and features are inserted in
+        batches; the table is replaced in a single transaction.
+
+        Args:
+            batch_size (int): Number of products read and inserted per batch.
+
+        Returns:
+            int: Number of products processed.
+        """
+        self.session.query(ProductFeatures).delete()
+        batch = []
+        count = 0
+        products = self.session.query(Product).options(load_only(*self.DESCRIPTION_COLUMNS)).yield_per(batch_size)
+        for product in products:
+            batch.append(self.compute(product))
+            if len(batch) >= batch_size:
+                self.session.bulk_insert_mappings(ProductFeatures, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            self.session.bulk_insert_mappings(ProductFeatures, batch)
+            count += len(batch)
+        self.session.commit()
+        invalidate(ProductFeatures)
+        self.logger.info(f"Rebuilt text features of {count} products.")
+        return count
+
 
 class InteractionRepository(BaseRepository):
     """
     Repository class for managing `Interaction` entities.
     """
+    @cached(Interaction)
     def get_all(self) -> List[Interaction]:
         """
         Retrieves all interactions from the database.
@@ -155,6 +481,106 @@ class InteractionRepository(BaseRepository):
         """
         return self.session.query(Interaction).all()
 
+    def get_interaction_triples(self, since: Optional[datetime] = None, until: Optional[datetime] = None) -> List[Tuple[int, str, str]]:
+        """
+        Retrieves every interaction as a lightweight `(user_id, product_id, interaction_type)` tuple.
+
+        Args:
+            since (Optional[datetime]): Only interactions strictly after this time.
+            until (Optional[datetime]): Only interactions at or before this time.
+
+        Returns:
+            List[Tuple[int, str, str]]: One tuple per interaction, in chronological order, so a model keeping
+                                        the last interaction of a repeated pair keeps the latest one.
+        """
+        query = self.session.query(Interaction.user_id, Interaction.product_id, Interaction.interaction_type)
+        if since is not None:
+            query = query.filter(Interaction.time_stamp > since)
+        if until is not None:
+            query = query.filter(Interaction.time_stamp <= until)
+        return [tuple(row) for row in query.order_by(Interaction.time_stamp)]
+
+    def get_interaction_stream(self, since: Optional[datetime] = None, batch_size: int = 10000,
+                               until: Optional[datetime] = None) -> Iterator[Tuple[int, str, str, datetime]]:
+        """
+        Streams every interaction as a `(user_id, product_id, interaction_type, time_stamp)` tuple in
+        chronological order, fetching `batch_size` rows at a time instead of loading the whole table.
+
+        Args:
+            since (Optional[datetime]): Only interactions strictly after this time.
+            batch_size (int): Number of rows fetched per round trip.
+            until (Optional[datetime]): Only interactions at or before this time.
+
+        Returns:
+            Iterator[Tuple[int, str, str, datetime]]: One tuple per interaction, oldest first.
+        """
+        query = self.session.query(Interaction.user_id, Interaction.product_id, Interaction.interaction_type, Interaction.time_stamp)
+        if since is not None:
+            query = query.filter(Interaction.time_stamp > since)
+        if until is not None:
+            query = query.filter(Interaction.time_stamp <= until)
+        for row in query.order_by(Interaction.time_stamp).yield_per(batch_size):
+            yield tuple(row)
+
+    def count(self) -> int:
+        """
+        Counts the interactions.
+
+        Returns:
+            int: Number of Interaction rows.
+        """
+        return self.session.query(func.count(Interaction.user_id)).scalar()
+
+    def get_time_split_cutoff(self, test_fraction: float) -> Optional[datetime]:
+        """
+        Finds the timestamp that leaves the latest `test_fraction` of the interactions after it.
+
+        Args:
+            test_fraction (float): Fraction of the interactions to hold out, between 0 and 1.
+
+        Returns:
+            Optional[datetime]: The first held-out timestamp, or None if there are no interactions.
+        """
+        total = self.session.query(func.count(Interaction.user_id)).scalar()
+        if not total:
+            return None
+        offset = min(int(total * (1 - test_fraction)), total - 1)
+        return self.session.query(Interaction.time_stamp).order_by(Interaction.time_stamp).offset(offset).limit(1).scalar()
+
+    def get_interaction_pairs(self, since: Optional[datetime] = None, before: Optional[datetime] = None) -> List[Tuple[int, str]]:
+        """
+        Retrieves `(user_id, product_id)` pairs, optionally restricted to a time window.
+
+        Args:
+            since (Optional[datetime]): Only interactions at or after this time.
+            before (Optional[datetime]): Only interactions strictly before this time.
+
+        Returns:
+            List[Tuple[int, str]]: One pair per interaction.
+        """
+        query = self.session.query(Interaction.user_id, Interaction.product_id)
+        if since is not None:
+            query = query.filter(Interaction.time_stamp >= since)
+        if before is not None:
+            query = query.filter(Interaction.time_stamp < before)
+        return [tuple(row) for row in query]
+
+    def get_interactions_with_customer_attributes(self) -> List[Tuple]:
+        """
+        Retrieves every interaction joined with the demographic attributes of its customer.
+
+        Returns:
+            List[Tuple]: `(product_id, interaction_type, time_stamp, age, gender, location, category)` tuples.
+        """
+        return [
+            tuple(row) for row in
+            self.session.query(
+                Interaction.product_id, Interaction.interaction_type, Interaction.time_stamp,
+                Customer.age, Customer.gender, Customer.location, Customer.category
+            ).join(Customer, Customer.customer_id == Interaction.user_id)
+        ]
+
+    @cached(Interaction)
     def get_by_user_and_product(self, user_id: int, product_id: str) -> Optional[Interaction]:
         """
         Retrieves an interaction by user ID and product ID from the database.
@@ -171,6 +597,7 @@ class InteractionRepository(BaseRepository):
             Interaction.product_id == product_id
         ).first()
     
+    @cached(Interaction)
     def get_interactions_by_user(self, user_id: int) -> List[Interaction]:
         """
         Retrieves all interactions for a specific user from the database.
@@ -185,21 +612,118 @@ class InteractionRepository(BaseRepository):
             Interaction.user_id == user_id
         ).all()
 
+    @cached(Interaction)
+    def get_recent_product_ids(self, user_id: int, limit: int) -> List[str]:
+        """
+        Retrieves the products a user interacted with most recently.
+
+        Args:
+            user_id (int): ID of the user.
+            limit (int): Maximum number of IDs to return.
+
+        Returns:
+            List[str]: Distinct product IDs ordered by their latest interaction, most recent first.
+        """
+        return [
+            row[0] for row in
+            self.session.query(Interaction.product_id)
+            .filter(Interaction.user_id == user_id)
+            .group_by(Interaction.product_id)
+            .order_by(func.max(Interaction.time_stamp).desc(), Interaction.product_id)
+            .limit(limit)
+        ]
+
+    @cached(Interaction, Product)
+    def get_user_category_counts(self, user_id: int) -> List[Tuple[str, int]]:
+        """
+        Counts a user's interactions per product category.
+
+        Args:
+            user_id (int): ID of the user.
+
+        Returns:
+            List[Tuple[str, int]]: `(category, count)` pairs ordered by count, descending.
+        """
+        return [
+            tuple(row) for row in
+            self.session.query(Product.category, func.count(Interaction.product_id))
+            .join(Product, Product.unique_id == Interaction.product_id)
+            .filter(Interaction.user_id == user_id, Product.category.isnot(None))
+            .group_by(Product.category)
+            .order_by(func.count(Interaction.product_id).desc())
+        ]
+
+    @cached(Interaction)
+    def get_co_interacted_product_ids(self, user_id: int, limit: int) -> List[str]:
+        """
+        Retrieves products that other users interacted with alongside the products of the given user.
+
+        Args:
+            user_id (int): ID of the user.
+            limit (int): Maximum number of IDs to return.
+
+        Returns:
+            List[str]: Product IDs ordered by number of co-interactions, descending.
+        """
+        own = aliased(Interaction)
+        neighbour = aliased(Interaction)
+        other = aliased(Interaction)
+        return [
+            row[0] for row in
+            self.session.query(other.product_id)
+            .select_from(own)
+            .join(neighbour, (neighbour.product_id == own.product_id) & (neighbour.user_id != own.user_id))
+            .join(other, other.user_id == neighbour.user_id)
+            .filter(own.user_id == user_id)
+            .group_by(other.product_id)
+            .order_by(func.count().desc(), other.product_id)
+            .limit(limit)
+        ]
+
+    @cached(Interaction)
+    def get_popular_product_ids(self, limit: int) -> List[str]:
+        """
+        Retrieves the most interacted products.
+
+        Args:
+            limit (int): Maximum number of IDs to return.
+
+        Returns:
+            List[str]: Product IDs ordered by number of interactions, descending.
+        """
+        return [
+            row[0] for row in
+            self.session.query(Interaction.product_id)
+            .group_by(Interaction.product_id)
+            .order_by(func.count().desc(), Interaction.product_id)
+            .limit(limit)
+        ]
+
     def create_interaction(self, user_id: int, product_id: str, interaction_type: str, description: Optional[str] = None) -> None:
         """
         Creates a new interaction and adds it to the session.
 
+        Once committed, an `INTERACTION_CREATED` event is published so in-memory models can update in place.
+
         Args:
             user_id (int): ID of the user.
             product_id (str): ID of the product.
             interaction_type (str): Type of interaction.
             description (Optional[str]): Optional description of the interaction.
         """
+        time_stamp = datetime.now()
         new_interaction = Interaction(
             user_id=user_id,
             product_id=product_id,
             interaction_type=interaction_type,
-            time_stamp=datetime.now(),
+            time_stamp=time_stamp,
             description=description
         )
         self.add(new_interaction)
+        repository_events.publish(INTERACTION_CREATED, InteractionEvent(
+            user_id=user_id,
+            product_id=product_id,
+            interaction_type=interaction_type,
+            time_stamp=time_stamp,
+            description=description
+        ))
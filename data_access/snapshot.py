@@ -0,0 +1,432 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import Boolean, Column, DateTime, Index, Integer, MetaData, Table, create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+from data_access.config import SNAPSHOT_BATCH_SIZE, SNAPSHOT_COMPRESSION, SNAPSHOT_DIR
+from data_access.db.models import Base, Customer, Interaction, Product
+from services.logger import Logger
+
+# pyarrow is only needed by snapshots; the application runs without it
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = ds = None
+
+MANIFEST_FILE = "manifest.json"
+REPLICA_FILE = "replica.sqlite"
+
+# Tables of a snapshot; interactions are partitioned by the date of their time stamp
+TABLES = {
+    "customers": Customer,
+    "products": Product,
+    "interactions": Interaction
+}
+PARTITION_COLUMN = "date"
+
+# Session factories of the replicas opened by this process, keyed by file
+_replicas: Dict[str, sessionmaker] = {}
+_replicas_lock = threading.Lock()
+
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise RuntimeError("Snapshots need pyarrow; install it with `pip install pyarrow`.")
+
+
+def _arrow_schema(model) -> "pa.Schema":
+    """
+    Arrow schema of a mapped table, one field per column.
+    """
+    fields = []
+    for column in model.__table__.columns:
+        if isinstance(column.type, Boolean):
+            arrow_type = pa.bool_()
+        elif isinstance(column.type, Integer):
+            arrow_type = pa.int64()
+        elif isinstance(column.type, DateTime):
+            arrow_type = pa.timestamp("us")
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(column.name, arrow_type))
+    return pa.schema(fields)
+
+
+def _keyless(table: Table) -> Table:
+    """
+    Copy of a mapped table without its primary key, foreign keys or constraints, keeping the indexes.
+    """
+    return Table(table.name, MetaData(), *[Column(column.name, column.type) for column in table.columns],
+                 *[Index(index.name, *[column.name for column in index.columns]) for index in table.indexes])
+
+
+def _partitioning() -> "ds.Partitioning":
+    return ds.partitioning(pa.schema([(PARTITION_COLUMN, pa.date32())]), flavor="hive")
+
+
+def export_snapshot(session: Session, directory: str = SNAPSHOT_DIR, batch_size: int = SNAPSHOT_BATCH_SIZE,
+                    compression: str = SNAPSHOT_COMPRESSION) -> str:
+    """
+    Writes the customers, products and interactions tables to compressed Parquet files.
+
+    Rows are streamed from the database in batches of `batch_size`, so memory does not grow with the
+    table size. Interactions are written in one directory per day (`date=YYYY-MM-DD`), letting readers
+    skip whole days; they are exported in chronological order. The snapshot is written to a temporary directory and renamed into place, so
+    readers never see a partial snapshot.
+
+    Args:
+        session (Session): Session over the source database.
+        directory (str): Parent directory; the snapshot is a new subdirectory named after its export time.
+        batch_size (int): Rows read from the database and written at once.
+        compression (str): Parquet codec, e.g. "zstd" or "snappy".
+
+    Returns:
+        str: Path of the snapshot.
+    """
+    _require_pyarrow()
+    logger = Logger()
+    exported_at = datetime.now()
+    name = f"{exported_at.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    staging = os.path.join(directory, f".staging-{name}")
+    os.makedirs(staging)
+
+    rows = {}
+    file_options = ds.ParquetFileFormat().make_write_options(compression=compression)
+    for table, model in TABLES.items():
+        schema = _arrow_schema(model)
+        partitioned = model is Interaction
+        if partitioned:
+            schema = schema.append(pa.field(PARTITION_COLUMN, pa.date32()))
+        count = [0]
+
+        def batches() -> Iterator["pa.RecordBatch"]:
+            columns = [getattr(model, field.name) for field in schema if field.name != PARTITION_COLUMN]
+            query = session.query(*columns)
+            if partitioned:
+                # Chronological files let readers replay the interactions in order, day by day
+                query = query.order_by(Interaction.time_stamp)
+            query = query.yield_per(batch_size)
+            chunk = []
+            for row in query:
+                chunk.append(row)
+                if len(chunk) == batch_size:
+                    yield _record_batch(schema, chunk, partitioned)
+                    count[0] += len(chunk)
+                    chunk = []
+            if chunk:
+                yield _record_batch(schema, chunk, partitioned)
+                count[0] += len(chunk)
+
+        ds.write_dataset(
+            batches(), os.path.join(staging, table), schema=schema, format="parquet", file_options=file_options,
+            partitioning=_partitioning() if partitioned else None, basename_template="part-{i}.parquet",
+            max_rows_per_group=batch_size
+        )
+        rows[table] = count[0]
+        logger.info(f"Exported {count[0]} {table}.")
+
+    manifest = {
+        "exported_at": exported_at.isoformat(),
+        "compression": compression,
+        "rows": rows,
+        "tables": {table: [column.name for column in model.__table__.columns] for table, model in TABLES.items()}
+    }
+    with open(os.path.join(staging, MANIFEST_FILE), "w") as file:
+        json.dump(manifest, file, indent=2)
+    path = os.path.join(directory, name)
+    os.rename(staging, path)
+    logger.info(f"Snapshot written to {path}.")
+    return path
+
+
+def _record_batch(schema: "pa.Schema", rows: List[Tuple], partitioned: bool) -> "pa.RecordBatch":
+    columns = [list(values) for values in zip(*rows)]
+    if partitioned:
+        time_stamps = columns[[field.name for field in schema].index("time_stamp")]
+        columns.append([time_stamp.date() if time_stamp is not None else None for time_stamp in time_stamps])
+    return pa.RecordBatch.from_arrays([pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema)
+
+
+def latest_snapshot(directory: str = SNAPSHOT_DIR) -> Optional[str]:
+    """
+    Returns the path of the most recent snapshot in a directory, or None if there is none.
+    """
+    if not os.path.isdir(directory):
+        return None
+    names = sorted(name for name in os.listdir(directory)
+                   if not name.startswith(".") and os.path.exists(os.path.join(directory, name, MANIFEST_FILE)))
+    return os.path.join(directory, names[-1]) if names else None
+
+
+class Snapshot:
+    """
+    Read access to a snapshot written by `export_snapshot`.
+
+    `read` loads only the requested columns and pushes filters down to the files: days outside a time
+    range are skipped by their partition directory, and row groups by their min/max statistics. Model
+    builds and the evaluation split read the interactions this way, through `interaction_triples`,
+    `interaction_pairs` and `time_split_cutoff`. `load_into` and `replica` copy the snapshot into a SQL
+    database, optionally only a time range of it. This lets code written against sessions and
+    repositories, such as the filters, evaluation workers and batch scoring, run from a snapshot
+    without querying the live database.
+    """
+    def __init__(self, path: str) -> None:
+        """
+        Opens a snapshot.
+
+        Args:
+            path (str): Directory of the snapshot.
+
+        Raises:
+            FileNotFoundError: If the directory holds no snapshot manifest.
+        """
+        _require_pyarrow()
+        self.logger = Logger()
+        self.path = path
+        with open(os.path.join(path, MANIFEST_FILE)) as file:
+            self.manifest = json.load(file)
+
+    @property
+    def exported_at(self) -> datetime:
+        return datetime.fromisoformat(self.manifest["exported_at"])
+
+    def dataset(self, table: str) -> "ds.Dataset":
+        """
+        Dataset of a table; empty, with the table's schema, when the table had no rows to export.
+        """
+        partitioned = TABLES[table] is Interaction
+        directory = os.path.join(self.path, table)
+        # write_dataset creates no directory for a table without rows
+        if not os.path.isdir(directory):
+            schema = _arrow_schema(TABLES[table])
+            if partitioned:
+                schema = schema.append(pa.field(PARTITION_COLUMN, pa.date32()))
+            return ds.dataset([], schema=schema, format="parquet")
+        return ds.dataset(directory, format="parquet", partitioning=_partitioning() if partitioned else None)
+
+    def read(self, table: str, columns: Optional[List[str]] = None, filter: Optional["ds.Expression"] = None) -> "pa.Table":
+        """
+        Reads a table, loading only `columns` and the rows matching `filter`.
+
+        Args:
+            table (str): "customers", "products" or "interactions".
+            columns (Optional[List[str]]): Columns to load; all by default.
+            filter (Optional[ds.Expression]): Row filter, e.g. `ds.field("interaction_type") == "purchase"`.
+
+        Returns:
+            pa.Table: The matching rows.
+        """
+        columns = columns or self.manifest["tables"][table]
+        return self.dataset(table).to_table(columns=columns, filter=filter)
+
+    def interactions(self, columns: Optional[List[str]] = None, since: Optional[datetime] = None,
+                     until: Optional[datetime] = None) -> "pa.Table":
+        """
+        Reads the interactions in `[since, until)`, skipping the days outside the range without opening them.
+
+        Args:
+            columns (Optional[List[str]]): Columns to load; all by default.
+            since (Optional[datetime]): Only interactions at or after this time.
+            until (Optional[datetime]): Only interactions strictly before this time.
+
+        Returns:
+            pa.Table: The matching interactions.
+        """
+        return self.read("interactions", columns, self.time_filter(since, until))
+
+    @staticmethod
+    def time_filter(since: Optional[datetime] = None, until: Optional[datetime] = None) -> Optional["ds.Expression"]:
+        """
+        Filter on the interaction time stamp, with the matching bounds on the date partition.
+        """
+        expression = None
+        if since is not None:
+            expression = (ds.field(PARTITION_COLUMN) >= since.date()) & (ds.field("time_stamp") >= pa.scalar(since, pa.timestamp("us")))
+        if until is not None:
+            upper = (ds.field(PARTITION_COLUMN) <= until.date()) & (ds.field("time_stamp") < pa.scalar(until, pa.timestamp("us")))
+            expression = upper if expression is None else expression & upper
+        return expression
+
+    def customer_ids(self) -> List[int]:
+        """
+        IDs of all customers, ordered by ID like `CustomerRepository.get_all_ids`.
+        """
+        return sorted(self.read("customers", ["customer_id"]).column("customer_id").to_pylist())
+
+    def product_ids(self) -> List[str]:
+        """
+        IDs of all products, ordered by ID like `ProductRepository.get_all_ids`.
+        """
+        return sorted(self.read("products", ["unique_id"]).column("unique_id").to_pylist())
+
+    def interaction_triples(self, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                            batch_size: int = SNAPSHOT_BATCH_SIZE) -> Iterator[Tuple[int, str, str]]:
+        """
+        Streams `(user_id, product_id, interaction_type)` tuples of the interactions in `[since, until)`,
+        reading only those three columns, `batch_size` rows at a time. The days are read in order and each
+        day was exported in chronological order, so the tuples are chronological.
+        """
+        return self._rows(["user_id", "product_id", "interaction_type"], since, until, batch_size)
+
+    def interaction_pairs(self, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                          batch_size: int = SNAPSHOT_BATCH_SIZE) -> Iterator[Tuple[int, str]]:
+        """
+        Streams `(user_id, product_id)` pairs of the interactions in `[since, until)`.
+        """
+        return self._rows(["user_id", "product_id"], since, until, batch_size)
+
+    def time_split_cutoff(self, test_fraction: float) -> Optional[datetime]:
+        """
+        Same as `InteractionRepository.get_time_split_cutoff`, reading only the time stamp column.
+
+        Args:
+            test_fraction (float): Fraction of the interactions to hold out, between 0 and 1.
+
+        Returns:
+            Optional[datetime]: The first held-out timestamp, or None if there are no interactions.
+        """
+        column = self.read("interactions", ["time_stamp"]).column("time_stamp").drop_null()
+        if not len(column):
+            return None
+        offset = min(int(len(column) * (1 - test_fraction)), len(column) - 1)
+        time_stamps = column.to_numpy()
+        return np.partition(time_stamps, offset)[offset].astype("datetime64[us]").item()
+
+    def _rows(self, columns: List[str], since: Optional[datetime], until: Optional[datetime], batch_size: int) -> Iterator[Tuple]:
+        scanner = self.dataset("interactions").scanner(columns=columns, filter=self.time_filter(since, until), batch_size=batch_size)
+        for batch in scanner.to_batches():
+            yield from zip(*(batch.column(name).to_pylist() for name in columns))
+
+    def load_into(self, engine: Engine, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                  batch_size: int = SNAPSHOT_BATCH_SIZE) -> Dict[str, int]:
+        """
+        Copies the snapshot into the tables of a database, creating them if needed.
+
+        The interactions table is created without a primary key, like the live table in init.sql, which
+        may hold several interactions of a user with the same product.
+
+        Args:
+            engine (Engine): Target database, whose tables should be empty.
+            since (Optional[datetime]): Only interactions at or after this time.
+            until (Optional[datetime]): Only interactions strictly before this time.
+            batch_size (int): Rows inserted at once.
+
+        Returns:
+            Dict[str, int]: Rows copied per table.
+        """
+        Base.metadata.create_all(engine, tables=[table for table in Base.metadata.sorted_tables if table is not Interaction.__table__])
+        interactions = _keyless(Interaction.__table__)
+        interactions.create(engine, checkfirst=True)
+        rows = {}
+        with engine.begin() as connection:
+            for table, model in TABLES.items():
+                target = interactions if model is Interaction else model.__table__
+                columns = [column.name for column in model.__table__.columns]
+                scanner = self.dataset(table).scanner(
+                    columns=columns, filter=self.time_filter(since, until) if model is Interaction else None,
+                    batch_size=batch_size
+                )
+                count = 0
+                for batch in scanner.to_batches():
+                    if batch.num_rows:
+                        connection.execute(target.insert(), batch.to_pylist())
+                        count += batch.num_rows
+                rows[table] = count
+        self.logger.info(f"Loaded snapshot {self.path}: " + ", ".join(f"{count} {table}" for table, count in rows.items()) + ".")
+        return rows
+
+    def replica(self, since: Optional[datetime] = None, until: Optional[datetime] = None) -> Callable[[], Session]:
+        """
+        Returns a session factory over a local SQLite copy of the snapshot, created on first use.
+
+        The copy is stored next to the snapshot and shared by every process that opens it, e.g. the
+        workers of an evaluation. It is built in a temporary file and renamed into place.
+
+        Args:
+            since (Optional[datetime]): Only interactions at or after this time.
+            until (Optional[datetime]): Only interactions strictly before this time.
+
+        Returns:
+            Callable[[], Session]: Factory of sessions over the copy.
+        """
+        name = REPLICA_FILE
+        if since is not None or until is not None:
+            window = f"{since.isoformat() if since else ''}/{until.isoformat() if until else ''}"
+            name = f"replica-{hashlib.sha256(window.encode()).hexdigest()[:12]}.sqlite"
+        path = os.path.abspath(os.path.join(self.path, name))
+
+        with _replicas_lock:
+            factory = _replicas.get(path)
+            if factory is not None:
+                return factory
+            if not os.path.exists(path):
+                staging = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+                engine = create_engine(f"sqlite:///{staging}")
+                try:
+                    self.load_into(engine, since, until)
+                finally:
+                    engine.dispose()
+                os.replace(staging, path)
+            factory = _replicas[path] = sessionmaker(autocommit=False, autoflush=False,
+                                                     bind=create_engine(f"sqlite:///{path}"))
+            return factory
+
+
+def resolve_snapshot(path: Optional[str]) -> Optional[str]:
+    """
+    Resolves "latest" to the newest snapshot in `SNAPSHOT_DIR`; other values are returned unchanged.
+
+    Raises:
+        FileNotFoundError: If "latest" is requested and there is no snapshot.
+    """
+    if path != "latest":
+        return path
+    latest = latest_snapshot()
+    if latest is None:
+        raise FileNotFoundError(f"No snapshot in {SNAPSHOT_DIR}")
+    return latest
+
+
+def snapshot_session_factory(path: Optional[str], until: Optional[datetime] = None) -> Optional[Callable[[], Session]]:
+    """
+    Session factory over the replica of a snapshot, or None when no snapshot is given (live database).
+
+    Args:
+        path (Optional[str]): Snapshot directory, or "latest" for the newest snapshot in `SNAPSHOT_DIR`.
+        until (Optional[datetime]): Only copy the interactions strictly before this time, skipping the later days.
+    """
+    path = resolve_snapshot(path)
+    return Snapshot(path).replica(until=until) if path is not None else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the database to Parquet snapshots, or import one into a database.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="Snapshot customers, products and interactions.")
+    export.add_argument("--output", default=SNAPSHOT_DIR, help="Directory the snapshot is created in.")
+    export.add_argument("--batch-size", type=int, default=SNAPSHOT_BATCH_SIZE, help="Rows read and written at once.")
+    export.add_argument("--compression", default=SNAPSHOT_COMPRESSION, help="Parquet codec (zstd, snappy, gzip, none).")
+    load = commands.add_parser("import", help="Copy a snapshot into a database.")
+    load.add_argument("snapshot", help="Snapshot directory.")
+    load.add_argument("--database-url", required=True, help="SQLAlchemy URL of the target database.")
+    load.add_argument("--since", type=datetime.fromisoformat, help="Only interactions at or after this time.")
+    load.add_argument("--until", type=datetime.fromisoformat, help="Only interactions before this time.")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        # Imported here so `import` does not connect to the configured database
+        from data_access.db.db import SessionFactory
+        with SessionFactory() as session:
+            print(export_snapshot(session, args.output, args.batch_size, args.compression))
+    else:
+        target = create_engine(args.database_url)
+        print(json.dumps(Snapshot(args.snapshot).load_into(target, args.since, args.until)))
+        target.dispose()
@@ -0,0 +1,95 @@
+from typing import Dict, List, Sequence, Set
+import numpy as np
+
+
+def hit_matrix(rankings: Sequence[Sequence[str]], relevant: Sequence[Set[str]], k: int) -> np.ndarray:
+    """
+    Marks which of the top-k recommended products of every user are relevant.
+
+    Args:
+        rankings (Sequence[Sequence[str]]): Ranked product IDs of each user; shorter lists are padded with misses.
+        relevant (Sequence[Set[str]]): Held-out products of each user.
+        k (int): Cut-off.
+
+    Returns:
+        np.ndarray: Boolean users x k matrix.
+    """
+    hits = np.zeros((len(rankings), k), dtype=bool)
+    for i, (ranking, items) in enumerate(zip(rankings, relevant)):
+        for j, product_id in enumerate(ranking[:k]):
+            hits[i, j] = product_id in items
+    return hits
+
+
+def precision_at_k(hits: np.ndarray) -> np.ndarray:
+    """
+    Fraction of the top-k recommendations that are relevant, per user.
+    """
+    return hits.sum(axis=1) / hits.shape[1]
+
+
+def recall_at_k(hits: np.ndarray, n_relevant: np.ndarray) -> np.ndarray:
+    """
+    Fraction of the relevant products found in the top-k, per user.
+    """
+    return hits.sum(axis=1) / np.maximum(n_relevant, 1)
+
+
+def average_precision_at_k(hits: np.ndarray, n_relevant: np.ndarray) -> np.ndarray:
+    """
+    Average of the precision at every relevant position of the top-k, per user.
+    """
+    k = hits.shape[1]
+    precision_at_rank = np.cumsum(hits, axis=1) / np.arange(1, k + 1)
+    return (precision_at_rank * hits).sum(axis=1) / np.maximum(np.minimum(n_relevant, k), 1)
+
+
+def ndcg_at_k(hits: np.ndarray, n_relevant: np.ndarray) -> np.ndarray:
+    """
+    Normalized discounted cumulative gain of the top-k with binary relevance, per user.
+    """
+    k = hits.shape[1]
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    dcg = hits @ discounts
+    ideal = np.concatenate([[0.0], np.cumsum(discounts)])[np.minimum(n_relevant, k)]
+    ndcg = np.zeros_like(dcg)
+    np.divide(dcg, ideal, out=ndcg, where=ideal > 0)
+    return ndcg
+
+
+def ranking_metrics(hits: np.ndarray, n_relevant: np.ndarray) -> Dict[str, float]:
+    """
+    Averages the ranking metrics over all users.
+
+    Args:
+        hits (np.ndarray): Boolean users x k matrix, see `hit_matrix`.
+        n_relevant (np.ndarray): Number of held-out products of each user.
+
+    Returns:
+        Dict[str, float]: "precision", "recall", "map" and "ndcg" at k.
+    """
+    if hits.shape[0] == 0:
+        return {"precision": 0.0, "recall": 0.0, "map": 0.0, "ndcg": 0.0}
+    return {
+        "precision": float(precision_at_k(hits).mean()),
+        "recall": float(recall_at_k(hits, n_relevant).mean()),
+        "map": float(average_precision_at_k(hits, n_relevant).mean()),
+        "ndcg": float(ndcg_at_k(hits, n_relevant).mean())
+    }
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    """
+    Summarizes per-user latencies.
+
+    Args:
+        latencies (List[float]): Seconds spent ranking each user.
+
+    Returns:
+        Dict[str, float]: Mean, p50, p95 and p99 in milliseconds.
+    """
+    if not len(latencies):
+        return {"mean_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0}
+    milliseconds = np.asarray(latencies) * 1000
+    p50, p95, p99 = np.percentile(milliseconds, [50, 95, 99])
+    return {"mean_ms": float(milliseconds.mean()), "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
@@ -0,0 +1,362 @@
+import argparse
+import multiprocessing
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+import numpy as np
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from data_access.config import CONTENT_FEATURIZER, HASHING_FEATURES
+from data_access.db.db import SessionFactory
+from data_access.db.models import Interaction
+from data_access.db.repositories import InteractionRepository
+from data_access.snapshot import Snapshot, resolve_snapshot, snapshot_session_factory
+from evaluation.metrics import hit_matrix, latency_summary, ranking_metrics
+from filters.candidate_generator import CandidateGenerator
+from filters.co_interaction_counter import CoInteractionCounter
+from filters.co_interaction_filter import CoInteractionFilter
+from filters.collaborative_filter import CollaborativeFilter
+from filters.content_based_filter import ContentBaseFilter
+from filters.content_model import ContentModel, create_vectorizer
+from filters.filter_pipe import FilterPipe
+from filters.interaction_matrix import InteractionMatrix
+from filters.item_neighbours import ItemNeighbours
+from filters.memory_budget import MemoryBudget
+from filters.random_walk_filter import RandomWalkFilter
+from filters.recent_interactions import RecentInteractions
+from filters.session_filter import SessionFilter
+from filters.user_profile_store import UserProfileStore
+from models.context_model import Context
+from models.filter_result_model import FilterResultModel
+from services.cold_start_service import ColdStartService
+from services.logger import Logger
+
+
+class TrainedModels(NamedTuple):
+    """
+    Models fitted on the training part of the interactions.
+    """
+    interaction_matrix: InteractionMatrix
+    content_model: ContentModel
+    profiles: UserProfileStore
+    cold_start: ColdStartService
+
+
+class PopularityBaseline:
+    """
+    Recommends the cold-start popularity list of the user's segment to everyone.
+    """
+    def __init__(self, session: Session, cold_start: ColdStartService) -> None:
+        self.session = session
+        self.cold_start = cold_start
+
+    def apply_filters(self, context: Context) -> FilterResultModel:
+        return FilterResultModel(context.userId, self.cold_start.recommend_for_user(self.session, context.userId, context.limit))
+
+
+def build_popularity(session: Session, models: TrainedModels) -> PopularityBaseline:
+    return PopularityBaseline(session, models.cold_start)
+
+
+def build_content(session: Session, models: TrainedModels) -> FilterPipe:
+    return FilterPipe([
+        ContentBaseFilter(session, cold_start=models.cold_start, model=models.content_model, profiles=models.profiles)
+    ], session=session, candidate_generator=CandidateGenerator.default(session), cold_start=models.cold_start)
+
+
+def build_collaborative(session: Session, models: TrainedModels) -> FilterPipe:
+    return FilterPipe([
+        CollaborativeFilter(session, model=models.interaction_matrix, cold_start=models.cold_start)
+    ], session=session, candidate_generator=CandidateGenerator.default(session), cold_start=models.cold_start)
+
+
+def build_random_walk(session: Session, models: TrainedModels) -> FilterPipe:
+    return FilterPipe([
+        RandomWalkFilter(session, model=models.interaction_matrix, cold_start=models.cold_start)
+    ], session=session, candidate_generator=CandidateGenerator.default(session), cold_start=models.cold_start)
+
+
+def build_co_interaction(session: Session, models: TrainedModels) -> FilterPipe:
+    return FilterPipe([
+        CoInteractionFilter(session, CoInteractionCounter().build(session), cold_start=models.cold_start)
+    ], session=session, candidate_generator=CandidateGenerator.default(session), cold_start=models.cold_start)
+
+
+def build_session(session: Session, models: TrainedModels) -> FilterPipe:
+    # Each test user's session is the last one of their training interactions
+    session_filter = SessionFilter(RecentInteractions(expire=False).build(session), ItemNeighbours.from_matrix(models.interaction_matrix))
+    return FilterPipe([session_filter], session=session, candidate_generator=CandidateGenerator.default(session, session_filter=session_filter),
+                      cold_start=models.cold_start)
+
+
+def build_pipeline(session: Session, models: TrainedModels) -> FilterPipe:
+    return FilterPipe([
+        ContentBaseFilter(session, cold_start=models.cold_start, model=models.content_model, profiles=models.profiles),
+        CollaborativeFilter(session, model=models.interaction_matrix, cold_start=models.cold_start)
+    ], session=session, candidate_generator=CandidateGenerator.default(session), cold_start=models.cold_start)
+
+
+# Configurations that can be evaluated; each builds a recommender with `apply_filters(context)`
+CONFIGURATIONS: Dict[str, Callable[[Session, TrainedModels], object]] = {
+    "popularity": build_popularity,
+    "content": build_content,
+    "collaborative": build_collaborative,
+    "random_walk": build_random_walk,
+    "co_interaction": build_co_interaction,
+    "session": build_session,
+    "pipeline": build_pipeline,
+}
+
+# Schema holding the temporary tables of a connection, per SQL dialect
+TEMPORARY_SCHEMAS = {"postgresql": "pg_temp", "sqlite": "temp"}
+
+# State of an evaluation worker process, set by `_init_worker`
+_worker: Dict = {}
+
+
+def holdout_session(cutoff: datetime, session_factory: Callable[[], Session] = SessionFactory) -> Session:
+    """
+    Opens a session in which the interactions at or after `cutoff` do not exist.
+
+    A temporary `interactions` table holding only the training interactions is created inside a
+    transaction that is never committed. Unqualified table names resolve to temporary tables first,
+    so every repository read in the session, and therefore every filter, model and candidate source
+    built on it, only sees the training period, while the real table is neither changed nor locked.
+    Committing the session raises; release it with `close_holdout_session`.
+
+    Args:
+        cutoff (datetime): First held-out timestamp.
+        session_factory (Callable[[], Session]): Factory of the database session, e.g. a snapshot replica.
+
+    Returns:
+        Session: The training-only session.
+    """
+    table = Interaction.__tablename__
+    session = session_factory()
+    event.listen(session, "before_commit", _refuse_commit)
+    session.execute(text(f"CREATE TEMPORARY TABLE {table} AS SELECT * FROM {table} WHERE time_stamp < :cutoff"), {"cutoff": cutoff})
+    session.execute(text(f"CREATE INDEX holdout_{table}_user_id ON {table} (user_id)"))
+    session.execute(text(f"CREATE INDEX holdout_{table}_product_id ON {table} (product_id)"))
+    return session
+
+
+def close_holdout_session(session: Session) -> None:
+    """
+    Rolls back a session opened by `holdout_session` and drops its temporary table.
+
+    Args:
+        session (Session): The training-only session.
+    """
+    session.rollback()
+    event.remove(session, "before_commit", _refuse_commit)
+    # Drivers that autocommit DDL (e.g. pysqlite) keep the temporary table after the rollback,
+    # and it must not shadow the real table once the connection returns to the pool
+    schema = TEMPORARY_SCHEMAS.get(session.get_bind().dialect.name)
+    if schema is not None:
+        session.execute(text(f"DROP TABLE IF EXISTS {schema}.{Interaction.__tablename__}"))
+        session.commit()
+    session.close()
+
+
+def _refuse_commit(session: Session) -> None:
+    raise RuntimeError("Evaluation sessions hide the test interactions and must never be committed.")
+
+
+def train_models(session: Session, content_dir: str) -> TrainedModels:
+    """
+    Fits every model on the training view of a holdout session.
+
+    Args:
+        session (Session): Session returned by `holdout_session`.
+        content_dir (str): Directory holding the content model fitted by the parent process.
+
+    Returns:
+        TrainedModels: The fitted models.
+    """
+    content_model = ContentModel.load(content_dir)
+    cold_start = ColdStartService()
+    cold_start.refresh(session)
+    budget = MemoryBudget()
+    return TrainedModels(
+        interaction_matrix=InteractionMatrix.from_session(session, budget=budget),
+        content_model=content_model,
+        profiles=UserProfileStore(content_model).build(budget.interaction_triples(session), budget),
+        cold_start=cold_start
+    )
+
+
+def _init_worker(cutoff: datetime, content_dir: str, config_names: List[str], snapshot: Optional[str] = None) -> None:
+    session = holdout_session(cutoff, snapshot_session_factory(snapshot, until=cutoff) or SessionFactory)
+    models = train_models(session, content_dir)
+    _worker["session"] = session
+    _worker["recommenders"] = {name: CONFIGURATIONS[name](session, models) for name in config_names}
+
+
+def _close_worker() -> None:
+    session = _worker.pop("session", None)
+    if session is not None:
+        close_holdout_session(session)
+    _worker.clear()
+
+
+def _evaluate_shard(users: List[Tuple[int, Set[str]]], k: int) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """
+    Ranks a shard of test users with every configuration.
+
+    Args:
+        users (List[Tuple[int, Set[str]]]): Test users and their held-out products.
+        k (int): Cut-off.
+
+    Returns:
+        Dict[str, Tuple[np.ndarray, np.ndarray]]: Hit matrix and per-user latencies of each configuration.
+    """
+    results = {}
+    relevant = [items for _, items in users]
+    for name, recommender in _worker["recommenders"].items():
+        rankings = []
+        latencies = np.zeros(len(users))
+        for i, (user_id, _) in enumerate(users):
+            start = time.perf_counter()
+            result = recommender.apply_filters(Context([], user_id, k))
+            latencies[i] = time.perf_counter() - start
+            rankings.append([rec.product_id for rec in result.recommendations[:k]] if result else [])
+        results[name] = (hit_matrix(rankings, relevant, k), latencies)
+    return results
+
+
+def split_users(session: Session, cutoff: datetime, snapshot: Optional[Snapshot] = None) -> List[Tuple[int, Set[str]]]:
+    """
+    Collects the test users and the held-out products they had not interacted with before the cutoff.
+
+    Args:
+        session (Session): Session over the full interactions; unused when a snapshot is given.
+        cutoff (datetime): First held-out timestamp.
+        snapshot (Optional[Snapshot]): Snapshot whose user and product columns are read instead of the session.
+
+    Returns:
+        List[Tuple[int, Set[str]]]: Test users ordered by ID, with their relevant products.
+    """
+    if snapshot is not None:
+        before, after = snapshot.interaction_pairs(until=cutoff), snapshot.interaction_pairs(since=cutoff)
+    else:
+        repository = InteractionRepository(session)
+        before, after = repository.get_interaction_pairs(before=cutoff), repository.get_interaction_pairs(since=cutoff)
+    seen: Dict[int, Set[str]] = defaultdict(set)
+    for user_id, product_id in before:
+        seen[user_id].add(product_id)
+
+    relevant: Dict[int, Set[str]] = defaultdict(set)
+    for user_id, product_id in after:
+        if product_id not in seen.get(user_id, ()):
+            relevant[user_id].add(product_id)
+    return sorted(relevant.items())
+
+
+def evaluate(config_names: Optional[List[str]] = None, test_fraction: float = 0.2, k: int = 10, workers: int = 4,
+             max_users: int = 0, shard_size: int = 200, snapshot: Optional[str] = None) -> List[Dict]:
+    """
+    Evaluates filter configurations offline with a time-based split of the interactions.
+
+    The latest `test_fraction` of the interactions is held out. Every configuration is trained on the
+    earlier interactions and asked for the top-k of each test user. The products the user interacted
+    with after the cutoff, and not before it, count as relevant.
+
+    Args:
+        config_names (Optional[List[str]]): Configurations from `CONFIGURATIONS`; all by default.
+        test_fraction (float): Fraction of the interactions held out.
+        k (int): Cut-off of the ranking metrics.
+        workers (int): Number of worker processes; 1 evaluates in this process.
+        max_users (int): Maximum number of test users, evenly sampled; 0 for all.
+        shard_size (int): Number of users sent to a worker at once.
+        snapshot (Optional[str]): Snapshot directory (or "latest") read instead of the live database.
+
+    Returns:
+        List[Dict]: Metrics and latency summary of each configuration.
+    """
+    logger = Logger()
+    config_names = config_names or list(CONFIGURATIONS)
+    unknown = [name for name in config_names if name not in CONFIGURATIONS]
+    if unknown:
+        raise ValueError(f"Unknown configurations: {', '.join(unknown)}")
+
+    snapshot = resolve_snapshot(snapshot)
+    exported = Snapshot(snapshot) if snapshot is not None else None
+    if exported is not None:
+        # The split reads the snapshot columns; only the training days are copied into the replica
+        cutoff = exported.time_split_cutoff(test_fraction)
+    else:
+        with SessionFactory() as session:
+            cutoff = InteractionRepository(session).get_time_split_cutoff(test_fraction)
+    if cutoff is None:
+        logger.warn("No interactions to evaluate on.")
+        return []
+    with (snapshot_session_factory(snapshot, until=cutoff) or SessionFactory)() as session:
+        users = split_users(session, cutoff, exported)
+        # The catalog does not depend on the split, so the content model is fitted once and shared
+        content_model = ContentModel.from_session(session, create_vectorizer(CONTENT_FEATURIZER, n_features=HASHING_FEATURES))
+
+    if max_users and len(users) > max_users:
+        users = [users[i] for i in np.linspace(0, len(users) - 1, max_users).astype(int)]
+    logger.info(f"Evaluating {', '.join(config_names)} on {len(users)} test users (cutoff {cutoff}, k={k}).")
+
+    content_dir = tempfile.mkdtemp(prefix="evaluation-")
+    try:
+        content_model.save(content_dir)
+        shards = [users[i:i + shard_size] for i in range(0, len(users), shard_size)]
+        outputs = []
+        if workers <= 1:
+            _init_worker(cutoff, content_dir, config_names, snapshot)
+            try:
+                outputs = [_evaluate_shard(shard, k) for shard in shards]
+            finally:
+                _close_worker()
+        else:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                     initializer=_init_worker, initargs=(cutoff, content_dir, config_names, snapshot)) as executor:
+                futures = [executor.submit(_evaluate_shard, shard, k) for shard in shards]
+                for done, future in enumerate(futures, start=1):
+                    outputs.append(future.result())
+                    logger.info(f"Evaluated {min(done * shard_size, len(users))}/{len(users)} users.")
+    finally:
+        shutil.rmtree(content_dir, ignore_errors=True)
+
+    n_relevant = np.array([len(items) for _, items in users], dtype=np.int64)
+    results = []
+    for name in config_names:
+        hits = np.concatenate([output[name][0] for output in outputs]) if outputs else np.zeros((0, k), dtype=bool)
+        latencies = np.concatenate([output[name][1] for output in outputs]) if outputs else np.zeros(0)
+        results.append({"name": name, "users": len(users), **ranking_metrics(hits, n_relevant), **latency_summary(latencies)})
+
+    headers = ["Configuration", "Users", f"P@{k}", f"R@{k}", f"MAP@{k}", f"NDCG@{k}", "Mean (ms)", "p50 (ms)", "p95 (ms)", "p99 (ms)"]
+    print(" | ".join(headers))
+    for result in results:
+        print(" | ".join([
+            result["name"],
+            str(result["users"]),
+            f"{result['precision']:.4f}",
+            f"{result['recall']:.4f}",
+            f"{result['map']:.4f}",
+            f"{result['ndcg']:.4f}",
+            f"{result['mean_ms']:.1f}",
+            f"{result['p50_ms']:.1f}",
+            f"{result['p95_ms']:.1f}",
+            f"{result['p99_ms']:.1f}"
+        ]))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate filter configurations offline on a time-based split.")
+    parser.add_argument("--configs", nargs="+", choices=list(CONFIGURATIONS), help="Configurations to evaluate (all by default).")
+    parser.add_argument("--test-fraction", type=float, default=0.2, help="Fraction of the latest interactions held out.")
+    parser.add_argument("-k", type=int, default=10, help="Cut-off of the ranking metrics.")
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes (1 evaluates in-process).")
+    parser.add_argument("--max-users", type=int, default=0, help="Maximum number of test users (0 for all).")
+    parser.add_argument("--shard-size", type=int, default=200, help="Users sent to a worker at once.")
+    parser.add_argument("--snapshot", help="Snapshot directory, or \"latest\", read instead of the live database.")
+    args = parser.parse_args()
+    evaluate(args.configs, args.test_fraction, args.k, args.workers, args.max_users, args.shard_size, args.snapshot)
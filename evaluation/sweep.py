@@ -0,0 +1,346 @@
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set, Tuple
+import numpy as np
+from sqlalchemy.orm import Session
+from data_access.db.db import SessionFactory
+from data_access.db.repositories import CustomerRepository, InteractionRepository, ProductFeaturesRepository, ProductRepository
+from data_access.snapshot import Snapshot, resolve_snapshot, snapshot_session_factory
+from evaluation.metrics import hit_matrix, latency_summary, ranking_metrics
+from evaluation.offline_evaluation import close_holdout_session, holdout_session, split_users
+from filters.candidate_generator import CandidateGenerator
+from filters.collaborative_filter import CollaborativeFilter
+from filters.content_based_filter import ContentBaseFilter
+from filters.content_model import CONTENT_INTERACTION_WEIGHTS, ContentModel, create_vectorizer
+from filters.filter_pipe import FilterPipe
+from filters.interaction_matrix import DEFAULT_INTERACTION_WEIGHTS, InteractionMatrix
+from filters.user_profile_store import UserProfileStore
+from models.context_model import Context
+from services.cold_start_service import ColdStartService
+from services.logger import Logger
+
+# Parameter grid swept by default; every combination is one trial of the content + collaborative pipeline
+DEFAULT_GRID = {
+    # Interaction weights of the collaborative matrix and of the content profiles (the filters use different ones)
+    "cf_weights": [DEFAULT_INTERACTION_WEIGHTS, CONTENT_INTERACTION_WEIGHTS],
+    "content_weights": [CONTENT_INTERACTION_WEIGHTS, DEFAULT_INTERACTION_WEIGHTS],
+    # Number of most similar users contributing to collaborative scores (None for all)
+    "neighbours": [None, 50],
+    # Keyword arguments of `create_vectorizer`
+    "vectorizer": [{"featurizer": "tfidf"}, {"featurizer": "tfidf", "ngram_range": [1, 2]}, {"featurizer": "hashing"}],
+    # Weights of the content and collaborative scores in the combined score
+    "fusion": [[1.0, 1.0], [2.0, 1.0], [1.0, 2.0]],
+}
+
+# State of a sweep worker process, set by `_init_worker`
+_worker: Dict = {}
+
+
+def artifact_key(*params) -> str:
+    """
+    Returns a stable key for the parameters an artifact depends on.
+    """
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def expand_grid(grid: Dict[str, List]) -> List[Dict]:
+    """
+    Lists every combination of a parameter grid.
+
+    Args:
+        grid (Dict[str, List]): Candidate values of each parameter.
+
+    Returns:
+        List[Dict]: One parameter set per trial.
+    """
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+class ArtifactCache:
+    """
+    Intermediate artifacts shared by sweep trials, each built once per set of parameters it depends on.
+
+    Artifacts live in memory for the lifetime of the process. Content models, the most expensive ones,
+    are also saved under `directory` so that every worker loads the same fit instead of refitting; the
+    saved fits are keyed by the catalog too, so a directory reused across catalogs never serves a stale one.
+
+    Artifacts and the parameters they depend on:
+        triples             the split (fixed for a sweep)
+        cold_start          the split
+        features            nothing (tokenized product text)
+        catalog             nothing (number of products and a hash of their IDs)
+        content_model       vectorizer, catalog
+        profiles            vectorizer, content_weights
+        interaction_matrix  cf_weights; also keeps the users' neighbour similarities across trials
+    """
+    def __init__(self, session: Session, directory: str, similarity_cache_size: int = 1024) -> None:
+        """
+        Initializes an empty cache.
+
+        Args:
+            session (Session): Session the artifacts are read from (a holdout session in workers).
+            directory (str): Directory shared by all workers for persisted content models.
+            similarity_cache_size (int): Number of users whose neighbour similarities each interaction matrix keeps.
+        """
+        self.logger = Logger()
+        self.session = session
+        self.directory = directory
+        self.similarity_cache_size = similarity_cache_size
+        self.hits = 0
+        self.misses = 0
+        self._artifacts: Dict[Tuple[str, str], object] = {}
+
+    def get(self, name: str, params: Tuple, build: Callable[[], object]) -> object:
+        """
+        Returns an artifact, building it on first use.
+
+        Args:
+            name (str): Kind of artifact.
+            params (Tuple): Parameters the artifact depends on.
+            build (Callable[[], object]): Builds the artifact.
+
+        Returns:
+            object: The artifact.
+        """
+        key = (name, artifact_key(*params))
+        if key in self._artifacts:
+            self.hits += 1
+            return self._artifacts[key]
+        self.misses += 1
+        start = time.perf_counter()
+        artifact = self._artifacts[key] = build()
+        self.logger.info(f"Built {name} {key[1]} in {time.perf_counter() - start:.1f}s.")
+        return artifact
+
+    def triples(self) -> List[Tuple[int, str, str]]:
+        return self.get("triples", (), lambda: InteractionRepository(self.session).get_interaction_triples())
+
+    def cold_start(self) -> ColdStartService:
+        def build():
+            cold_start = ColdStartService()
+            cold_start.refresh(self.session)
+            return cold_start
+        return self.get("cold_start", (), build)
+
+    def features(self) -> List:
+        return self.get("features", (), lambda: ProductFeaturesRepository(self.session).get_all())
+
+    def catalog(self) -> str:
+        def build():
+            product_ids = ProductRepository(self.session).get_all_ids()
+            digest = hashlib.sha1("\n".join(product_ids).encode()).hexdigest()[:16]
+            return f"{len(product_ids)}-{digest}"
+        return self.get("catalog", (), build)
+
+    def content_model(self, vectorizer: Dict) -> ContentModel:
+        def build():
+            path = os.path.join(self.directory, f"content-{artifact_key(vectorizer, self.catalog())}")
+            model = ContentModel.load(path)
+            if model is None:
+                model = self._fit_content_model(vectorizer)
+                model.save(path)
+            return model
+        return self.get("content_model", (vectorizer,), build)
+
+    def profiles(self, vectorizer: Dict, weights: Dict[str, int]) -> UserProfileStore:
+        return self.get("profiles", (vectorizer, weights),
+                        lambda: UserProfileStore(self.content_model(vectorizer), weights).build(self.triples()))
+
+    def interaction_matrix(self, weights: Dict[str, int]) -> InteractionMatrix:
+        return self.get("interaction_matrix", (weights,), lambda: InteractionMatrix.from_triples(
+            CustomerRepository(self.session).get_all_ids(),
+            ProductRepository(self.session).get_all_ids(),
+            self.triples(),
+            weights=weights,
+            cache_size=self.similarity_cache_size
+        ))
+
+    def _fit_content_model(self, vectorizer: Dict) -> ContentModel:
+        options = dict(vectorizer)
+        if "ngram_range" in options:
+            options["ngram_range"] = tuple(options["ngram_range"])
+        model = ContentModel(create_vectorizer(**options))
+        features = self.features()
+        if features:
+            return model.fit_features(features)
+        return model.fit_products(ProductRepository(self.session).get_all())
+
+
+def build_trial(session: Session, cache: ArtifactCache, params: Dict) -> FilterPipe:
+    """
+    Builds the content + collaborative pipeline of a trial from cached artifacts.
+
+    Args:
+        session (Session): Session the filters read from.
+        cache (ArtifactCache): Artifacts shared between trials.
+        params (Dict): Parameters of the trial, see `DEFAULT_GRID`.
+
+    Returns:
+        FilterPipe: The configured pipeline.
+    """
+    cold_start = cache.cold_start()
+    return FilterPipe([
+        ContentBaseFilter(session, cold_start=cold_start, model=cache.content_model(params["vectorizer"]),
+                          profiles=cache.profiles(params["vectorizer"], params["content_weights"]),
+                          weights=params["content_weights"]),
+        CollaborativeFilter(session, model=cache.interaction_matrix(params["cf_weights"]), cold_start=cold_start,
+                            neighbours=params["neighbours"])
+    ], session=session, candidate_generator=CandidateGenerator.default(session), cold_start=cold_start,
+        weights=params["fusion"])
+
+
+def _init_worker(cutoff: datetime, directory: str, users: List[Tuple[int, Set[str]]], k: int,
+                 snapshot: Optional[str] = None) -> None:
+    session = holdout_session(cutoff, snapshot_session_factory(snapshot, until=cutoff) or SessionFactory)
+    _worker["session"] = session
+    _worker["cache"] = ArtifactCache(session, directory, similarity_cache_size=max(len(users), 1))
+    _worker["users"] = users
+    _worker["k"] = k
+
+
+def _close_worker() -> None:
+    session = _worker.pop("session", None)
+    if session is not None:
+        close_holdout_session(session)
+    _worker.clear()
+
+
+def _run_trial(params: Dict) -> Dict:
+    """
+    Ranks every test user with one parameter set.
+
+    Args:
+        params (Dict): Parameters of the trial.
+
+    Returns:
+        Dict: The parameters with the ranking metrics and latency summary.
+    """
+    users, k = _worker["users"], _worker["k"]
+    pipe = build_trial(_worker["session"], _worker["cache"], params)
+    rankings = []
+    latencies = np.zeros(len(users))
+    for i, (user_id, _) in enumerate(users):
+        start = time.perf_counter()
+        result = pipe.apply_filters(Context([], user_id, k))
+        latencies[i] = time.perf_counter() - start
+        rankings.append([rec.product_id for rec in result.recommendations[:k]] if result else [])
+
+    hits = hit_matrix(rankings, [items for _, items in users], k)
+    n_relevant = np.array([len(items) for _, items in users], dtype=np.int64)
+    return {"params": params, **ranking_metrics(hits, n_relevant), **latency_summary(latencies)}
+
+
+def sweep(grid: Optional[Dict[str, List]] = None, test_fraction: float = 0.2, k: int = 10, workers: int = 4,
+          max_users: int = 500, cache_dir: Optional[str] = None, snapshot: Optional[str] = None) -> List[Dict]:
+    """
+    Evaluates every combination of a parameter grid on a time-based split.
+
+    Content models are fitted once per vectorizer setting before the trials start and shared through
+    `cache_dir`; the remaining artifacts are built by each worker the first time a trial needs them.
+    Trials sharing an interaction-weight setting are sent to the pool next to each other, so a worker
+    usually reuses the same matrix and its cached neighbour similarities.
+
+    Args:
+        grid (Optional[Dict[str, List]]): Parameter grid, see `DEFAULT_GRID`.
+        test_fraction (float): Fraction of the latest interactions held out.
+        k (int): Cut-off of the ranking metrics.
+        workers (int): Number of worker processes; 1 runs the trials in this process.
+        max_users (int): Maximum number of test users, evenly sampled; 0 for all.
+        cache_dir (Optional[str]): Directory for persisted artifacts, kept between runs when given;
+                                   a temporary directory otherwise.
+        snapshot (Optional[str]): Snapshot directory (or "latest") read instead of the live database.
+
+    Returns:
+        List[Dict]: One result per trial, best NDCG first.
+    """
+    logger = Logger()
+    grid = grid or DEFAULT_GRID
+    trials = sorted(expand_grid(grid), key=lambda params: artifact_key(params["cf_weights"], params["vectorizer"]))
+
+    snapshot = resolve_snapshot(snapshot)
+    exported = Snapshot(snapshot) if snapshot is not None else None
+    if exported is not None:
+        # The split reads the snapshot columns; only the training days are copied into the replica
+        cutoff = exported.time_split_cutoff(test_fraction)
+    else:
+        with SessionFactory() as session:
+            cutoff = InteractionRepository(session).get_time_split_cutoff(test_fraction)
+    if cutoff is None:
+        logger.warn("No interactions to sweep on.")
+        return []
+    with (snapshot_session_factory(snapshot, until=cutoff) or SessionFactory)() as session:
+        users = split_users(session, cutoff, exported)
+        if max_users and len(users) > max_users:
+            users = [users[i] for i in np.linspace(0, len(users) - 1, max_users).astype(int)]
+
+        directory = cache_dir or tempfile.mkdtemp(prefix="sweep-")
+        # Content models do not depend on the split; fit each distinct one once for all workers
+        parent_cache = ArtifactCache(session, directory)
+        for vectorizer in {artifact_key(params["vectorizer"]): params["vectorizer"] for params in trials}.values():
+            parent_cache.content_model(vectorizer)
+
+    logger.info(f"Running {len(trials)} trials on {len(users)} test users (cutoff {cutoff}, k={k}).")
+    results = []
+    try:
+        if workers <= 1:
+            _init_worker(cutoff, directory, users, k, snapshot)
+            try:
+                results = [_run_trial(params) for params in trials]
+            finally:
+                _close_worker()
+        else:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                     initializer=_init_worker, initargs=(cutoff, directory, users, k, snapshot)) as executor:
+                futures = [executor.submit(_run_trial, params) for params in trials]
+                for done, future in enumerate(as_completed(futures), start=1):
+                    results.append(future.result())
+                    logger.info(f"Completed {done}/{len(trials)} trials.")
+    finally:
+        if cache_dir is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    results.sort(key=lambda result: result["ndcg"], reverse=True)
+    names = list(grid)
+    print(" | ".join(names + [f"P@{k}", f"R@{k}", f"MAP@{k}", f"NDCG@{k}", "Mean (ms)", "p95 (ms)"]))
+    for result in results:
+        print(" | ".join([json.dumps(result["params"][name]) for name in names] + [
+            f"{result['precision']:.4f}",
+            f"{result['recall']:.4f}",
+            f"{result['map']:.4f}",
+            f"{result['ndcg']:.4f}",
+            f"{result['mean_ms']:.1f}",
+            f"{result['p95_ms']:.1f}"
+        ]))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep pipeline parameters on a time-based split.")
+    parser.add_argument("--grid", help="JSON file with the parameter grid (DEFAULT_GRID when omitted).")
+    parser.add_argument("--test-fraction", type=float, default=0.2, help="Fraction of the latest interactions held out.")
+    parser.add_argument("-k", type=int, default=10, help="Cut-off of the ranking metrics.")
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes (1 runs in-process).")
+    parser.add_argument("--max-users", type=int, default=500, help="Maximum number of test users (0 for all).")
+    parser.add_argument("--cache-dir", help="Keep fitted content models in this directory between runs.")
+    parser.add_argument("--output", help="Write all results to this JSON file.")
+    parser.add_argument("--snapshot", help="Snapshot directory, or \"latest\", read instead of the live database.")
+    args = parser.parse_args()
+
+    grid = None
+    if args.grid:
+        with open(args.grid) as file:
+            grid = json.load(file)
+    results = sweep(grid, args.test_fraction, args.k, args.workers, args.max_users, args.cache_dir, args.snapshot)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
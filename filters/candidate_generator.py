@@ -0,0 +1,233 @@
+import time
+from abc import ABC, abstractmethod
+from typing import List, Optional, Tuple
+from sqlalchemy.orm import Session
+from data_access.db.models import Product
+from data_access.db.repositories import InteractionRepository, ProductRepository
+from filters.co_interaction_counter import CoInteractionCounter
+from filters.co_interaction_filter import recent_products
+from filters.session_filter import SessionFilter
+from models.context_model import Context
+from services.logger import Logger
+
+
+class CandidateSource(ABC):
+    def __init__(self):
+        """
+        Initializes the CandidateSource with a logger.
+        """
+        self.logger = Logger()
+
+    @abstractmethod
+    def get_candidates(self, context: Context, limit: int) -> List[str]:
+        """
+        Return cheap, roughly ranked candidate product IDs for the user in the context.
+
+        Args:
+            context (Context): The context containing the user ID.
+            limit (int): Maximum number of IDs to return.
+
+        Returns:
+            List[str]: Candidate product IDs, best first.
+        """
+        pass
+
+
+class CategoryAffinitySource(CandidateSource):
+    """
+    Popular products from the categories the user interacts with most.
+    """
+    def __init__(self, session: Session, max_categories: int = 5):
+        """
+        Args:
+            session (Session): The SQLAlchemy session used for database operations.
+            max_categories (int): Number of top categories to draw candidates from.
+        """
+        super().__init__()
+        self.interaction_repository = InteractionRepository(session)
+        self.product_repository = ProductRepository(session)
+        self.max_categories = max_categories
+
+    def get_candidates(self, context: Context, limit: int) -> List[str]:
+        category_counts = self.interaction_repository.get_user_category_counts(context.userId)[:self.max_categories]
+        total = sum(count for _, count in category_counts)
+        candidates = []
+        for category, count in category_counts:
+            # Split the budget proportionally to the user's affinity with each category
+            share = max(1, round(limit * count / total))
+            candidates.extend(self.product_repository.get_popular_ids_by_category(category, share))
+        return candidates[:limit]
+
+
+class CoInteractionSource(CandidateSource):
+    """
+    Products other users interacted with alongside the user's own products.
+    """
+    def __init__(self, session: Session):
+        """
+        Args:
+            session (Session): The SQLAlchemy session used for database operations.
+        """
+        super().__init__()
+        self.interaction_repository = InteractionRepository(session)
+
+    def get_candidates(self, context: Context, limit: int) -> List[str]:
+        return self.interaction_repository.get_co_interacted_product_ids(context.userId, limit)
+
+
+class CoInteractionCounterSource(CandidateSource):
+    """
+    Neighbours of the user's recent products in a streaming `CoInteractionCounter`; one sketch read per
+    product instead of a query over other users' histories.
+    """
+    def __init__(self, session: Session, counter: CoInteractionCounter, neighbours: int = 50):
+        """
+        Args:
+            session (Session): The SQLAlchemy session used when the counter has no history for the user.
+            counter (CoInteractionCounter): Shared, incrementally updated co-interaction counts.
+            neighbours (int): Neighbours read per product of the user's history.
+        """
+        super().__init__()
+        self.interaction_repository = InteractionRepository(session)
+        self.counter = counter
+        self.neighbours = neighbours
+
+    def get_candidates(self, context: Context, limit: int) -> List[str]:
+        history = recent_products(self.counter, self.interaction_repository, context.userId)
+        scores = self.counter.score(history, self.neighbours)
+        return sorted(scores, key=scores.__getitem__, reverse=True)[:limit]
+
+
+class SessionNeighboursSource(CandidateSource):
+    """
+    Neighbours of the products in the user's current session, read from memory; lets a click bring
+    products into the candidate set that the other sources, built on older history, would not.
+    """
+    def __init__(self, session_filter: SessionFilter):
+        """
+        Args:
+            session_filter (SessionFilter): Filter whose session buffers and neighbour table are read.
+        """
+        super().__init__()
+        self.session_filter = session_filter
+
+    def get_candidates(self, context: Context, limit: int) -> List[str]:
+        scores = self.session_filter.score(context.userId)
+        return sorted(scores, key=scores.__getitem__, reverse=True)[:limit]
+
+
+class PopularitySource(CandidateSource):
+    """
+    Globally most interacted products, cached for `ttl` seconds across calls.
+    """
+    _cache: Tuple[float, List[str]] = (0.0, [])
+
+    def __init__(self, session: Session, ttl: float = 300):
+        """
+        Args:
+            session (Session): The SQLAlchemy session used for database operations.
+            ttl (float): Seconds a popularity list is reused before it is queried again.
+        """
+        super().__init__()
+        self.interaction_repository = InteractionRepository(session)
+        self.ttl = ttl
+
+    def get_candidates(self, context: Context, limit: int) -> List[str]:
+        created_at, popular = PopularitySource._cache
+        if time.monotonic() - created_at > self.ttl or len(popular) < limit:
+            popular = self.interaction_repository.get_popular_product_ids(limit)
+            PopularitySource._cache = (time.monotonic(), popular)
+        return popular[:limit]
+
+
+class CandidateGenerator:
+    """
+    First retrieval stage: merges several cheap sources into a bounded candidate set.
+
+    Each source gets a share of the budget proportional to its weight; budget a source cannot fill
+    is handed to the next ones. The user's own interacted products are always included (and do not
+    count towards the budget) because content-based scoring needs them to build the user profile.
+    """
+    def __init__(self, session: Session, sources: List[Tuple[CandidateSource, float]], budget: int = 300,
+                 history_limit: int = 200):
+        """
+        Args:
+            session (Session): The SQLAlchemy session used to load the candidate products.
+            sources (List[Tuple[CandidateSource, float]]): Sources and their share of the budget.
+            budget (int): Maximum number of candidates, excluding the user's history.
+            history_limit (int): Maximum number of the user's most recently interacted products to include.
+        """
+        self.logger = Logger()
+        self.sources = sources
+        self.budget = budget
+        self.history_limit = history_limit
+        self.product_repository = ProductRepository(session)
+        self.interaction_repository = InteractionRepository(session)
+
+    @classmethod
+    def default(cls, session: Session, budget: int = 300, counter: Optional[CoInteractionCounter] = None,
+                session_filter: Optional[SessionFilter] = None) -> "CandidateGenerator":
+        """
+        Builds a generator with category affinity, co-interaction and popularity sources, preceded by the
+        neighbours of the user's session when a session filter is given.
+
+        Args:
+            session (Session): The SQLAlchemy session used for database operations.
+            budget (int): Maximum number of candidates.
+            counter (Optional[CoInteractionCounter]): Co-interaction counts read in memory; without them the
+                                                      co-interactions are queried from the database.
+            session_filter (Optional[SessionFilter]): Session filter whose neighbours are added as candidates;
+                                                      the budget it leaves unused goes to the other sources.
+
+        Returns:
+            CandidateGenerator: The configured generator.
+        """
+        co_interactions = CoInteractionCounterSource(session, counter) if counter is not None else CoInteractionSource(session)
+        sources = [
+            (CategoryAffinitySource(session), 0.4),
+            (co_interactions, 0.4),
+            (PopularitySource(session), 0.2)
+        ]
+        if session_filter is not None:
+            sources.insert(0, (SessionNeighboursSource(session_filter), 0.2))
+        return cls(session, sources, budget=budget)
+
+    def generate(self, context: Context) -> List[Product]:
+        """
+        Builds the candidate set for the user in the context.
+
+        Args:
+            context (Context): The context containing the user ID.
+
+        Returns:
+            List[Product]: The user's interacted products followed by the merged candidates.
+        """
+        history = self.interaction_repository.get_recent_product_ids(context.userId, self.history_limit)
+        seen = set(history)
+        candidates: List[str] = []
+
+        remaining_weight = sum(weight for _, weight in self.sources)
+        for source, weight in self.sources:
+            remaining_budget = self.budget - len(candidates)
+            if remaining_budget <= 0:
+                break
+            quota = round(remaining_budget * weight / remaining_weight) if remaining_weight else remaining_budget
+            remaining_weight -= weight
+            try:
+                # Over-fetch so IDs already taken by the history or earlier sources do not leave the quota unfilled
+                ids = source.get_candidates(context, remaining_budget + len(seen))
+            except Exception as e:
+                self.logger.error(f"Candidate source {source.__class__.__name__} failed: {str(e)}")
+                continue
+
+            added = 0
+            for product_id in ids:
+                if added >= quota:
+                    break
+                if product_id not in seen:
+                    seen.add(product_id)
+                    candidates.append(product_id)
+                    added += 1
+
+        self.logger.info(f"Generated {len(candidates)} candidates for user {context.userId} from {len(self.sources)} sources.")
+        return self.product_repository.get_by_ids(history + candidates)
@@ -0,0 +1,230 @@
+import math
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy.orm import Session
+from data_access.db.events import INTERACTION_CREATED, InteractionEvent, repository_events
+from data_access.db.repositories import InteractionRepository
+from services.logger import Logger
+
+# Decayed counts are rescaled once the growth factor of new increments passes this value
+RESCALE_THRESHOLD = 2.0 ** 40
+
+
+class SpaceSaving:
+    """
+    Space-saving sketch of the heaviest keys of a stream, holding at most `capacity` counters.
+
+    A key that is already tracked is incremented. A new key takes a free counter, or replaces the smallest
+    one and inherits its count, which is then kept as the key's maximum overestimation. Keys heavier
+    than total / capacity are always tracked.
+    """
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.counts: Dict[str, float] = {}
+        self.errors: Dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def add(self, key: str, amount: float) -> None:
+        if key in self.counts:
+            self.counts[key] += amount
+            return
+        base = 0.0
+        if len(self.counts) >= self.capacity:
+            # Linear scan: capacities are a few dozen counters, cheaper than keeping a heap in sync
+            evicted = min(self.counts, key=self.counts.__getitem__)
+            base = self.counts.pop(evicted)
+            self.errors.pop(evicted, None)
+        self.counts[key] = base + amount
+        if base:
+            self.errors[key] = base
+
+    def scale(self, factor: float) -> None:
+        for key in self.counts:
+            self.counts[key] *= factor
+        for key in self.errors:
+            self.errors[key] *= factor
+
+    def top(self, n: int) -> List[Tuple[str, float]]:
+        return sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:n]
+
+
+class CoInteractionCounter:
+    """
+    Streaming item-to-item co-interaction counts ("customers who bought this also bought").
+
+    Every new interaction of a user is paired with the user's recent products and increments both
+    directions of each pair. Memory is bounded: each product keeps a `SpaceSaving` sketch with
+    `capacity` counters, and only the last `history_size` products of the `max_users` most recently
+    active users are remembered. With a half-life, counts decay exponentially with age. Forward decay is
+    used, so new increments are scaled up instead of every stored count being scaled down. A lookup reads a
+    single sketch.
+    """
+    def __init__(self, capacity: int = 100, history_size: int = 20, max_users: int = 100000,
+                 half_life: Optional[float] = None, interaction_types: Optional[Set[str]] = None) -> None:
+        """
+        Initializes an empty counter.
+
+        Args:
+            capacity (int): Counters kept per product; lookups return at most this many neighbours.
+            history_size (int): Recent products per user that a new interaction is paired with.
+            max_users (int): Users whose recent products are remembered, least recently active evicted first.
+            half_life (Optional[float]): Seconds after which a co-interaction counts half; no decay when None.
+            interaction_types (Optional[Set[str]]): Interaction types counted, e.g. {"purchase"}; all when None.
+        """
+        self.logger = Logger()
+        self.capacity = capacity
+        self.history_size = history_size
+        self.max_users = max_users
+        self.half_life = half_life
+        self.interaction_types = interaction_types
+        self._sketches: Dict[str, SpaceSaving] = {}
+        self._histories: "OrderedDict[int, Deque[str]]" = OrderedDict()
+        self._landmark: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sketches)
+
+    def build(self, session: Session) -> "CoInteractionCounter":
+        """
+        Replays the `interactions` table in chronological order.
+
+        Args:
+            session (Session): The SQLAlchemy session used for database operations.
+
+        Returns:
+            CoInteractionCounter: The counter itself.
+        """
+        count = 0
+        for user_id, product_id, interaction_type, time_stamp in InteractionRepository(session).get_interaction_stream():
+            self.add(user_id, product_id, interaction_type, time_stamp)
+            count += 1
+        self.logger.info(f"Built co-interaction counts for {len(self._sketches)} products from {count} interactions.")
+        return self
+
+    def add(self, user_id: int, product_id: str, interaction_type: str, time_stamp: Optional[datetime] = None) -> None:
+        """
+        Pairs one interaction with the user's recent products.
+
+        Args:
+            user_id (int): ID of the user.
+            product_id (str): ID of the product.
+            interaction_type (str): Type of interaction.
+            time_stamp (Optional[datetime]): When the interaction happened; now by default.
+        """
+        if self.interaction_types is not None and interaction_type not in self.interaction_types:
+            return
+        with self._lock:
+            amount = self._increment(time_stamp or datetime.now())
+            history = self._histories.get(user_id)
+            if history is None:
+                history = self._histories[user_id] = deque(maxlen=self.history_size)
+                if len(self._histories) > self.max_users:
+                    self._histories.popitem(last=False)
+            else:
+                self._histories.move_to_end(user_id)
+
+            for other in set(history):
+                if other == product_id:
+                    continue
+                self._sketch(product_id).add(other, amount)
+                self._sketch(other).add(product_id, amount)
+            if product_id in history:
+                history.remove(product_id)
+            history.append(product_id)
+
+    def neighbours(self, product_id: str, n: int = 20) -> List[Tuple[str, float]]:
+        """
+        Returns the products most often co-interacted with a product.
+
+        Args:
+            product_id (str): ID of the product.
+            n (int): Maximum number of neighbours.
+
+        Returns:
+            List[Tuple[str, float]]: `(product_id, count)` pairs, highest first; counts are decayed to now.
+        """
+        with self._lock:
+            sketch = self._sketches.get(product_id)
+            if sketch is None:
+                return []
+            top = sketch.top(n)
+            factor = 1.0 / self._increment(datetime.now()) if self.half_life else 1.0
+        return [(other, count * factor) for other, count in top]
+
+    def history(self, user_id: int) -> Optional[List[str]]:
+        """
+        Returns the user's remembered recent products, oldest first, or None if the user is not tracked.
+        """
+        with self._lock:
+            history = self._histories.get(user_id)
+            return list(history) if history is not None else None
+
+    def score(self, products: Iterable[str], n: int = 50) -> Dict[str, float]:
+        """
+        Sums the co-interaction counts of the neighbours of several products.
+
+        Args:
+            products (Iterable[str]): Seed products, e.g. the user's recent history.
+            n (int): Neighbours read per seed product.
+
+        Returns:
+            Dict[str, float]: Score of every neighbour that is not itself a seed.
+        """
+        seeds = set(products)
+        scores: Dict[str, float] = {}
+        for product_id in seeds:
+            for other, count in self.neighbours(product_id, n):
+                if other not in seeds:
+                    scores[other] = scores.get(other, 0.0) + count
+        return scores
+
+    def on_interaction(self, event: InteractionEvent) -> None:
+        """
+        Repository event handler; see `attach`.
+        """
+        self.add(event.user_id, event.product_id, event.interaction_type, event.time_stamp)
+
+    def attach(self) -> "CoInteractionCounter":
+        """
+        Subscribes the counter to interactions created through `InteractionRepository`.
+
+        Returns:
+            CoInteractionCounter: The counter itself, for chaining.
+        """
+        repository_events.subscribe(INTERACTION_CREATED, self.on_interaction)
+        return self
+
+    def detach(self) -> None:
+        repository_events.unsubscribe(INTERACTION_CREATED, self.on_interaction)
+
+    def _sketch(self, product_id: str) -> SpaceSaving:
+        sketch = self._sketches.get(product_id)
+        if sketch is None:
+            sketch = self._sketches[product_id] = SpaceSaving(self.capacity)
+        return sketch
+
+    def _increment(self, time_stamp: datetime) -> float:
+        """
+        Weight of an interaction at `time_stamp` relative to the landmark, i.e. 2 ** (age of landmark / half-life).
+
+        Once that weight grows past `RESCALE_THRESHOLD`, every stored count is scaled down and the landmark
+        moves forward, so the counts never overflow.
+        """
+        if not self.half_life:
+            return 1.0
+        seconds = time_stamp.timestamp()
+        if self._landmark is None:
+            self._landmark = seconds
+        exponent = (seconds - self._landmark) / self.half_life
+        if exponent > math.log2(RESCALE_THRESHOLD):
+            factor = 2.0 ** -exponent
+            for sketch in self._sketches.values():
+                sketch.scale(factor)
+            self._landmark = seconds
+            exponent = 0.0
+        return 2.0 ** exponent
@@ -0,0 +1,95 @@
+from typing import List, Optional
+from sqlalchemy.orm import Session
+from data_access.db.repositories import CustomerRepository, InteractionRepository
+from filters.co_interaction_counter import CoInteractionCounter
+from filters.filter_base import FilterBase
+from models.context_model import Context
+from models.filter_result_model import FilterResultModel
+from models.recommendation_model import RecommendationModel
+from services.cold_start_service import ColdStartService
+
+
+def recent_products(counter: CoInteractionCounter, interaction_repository: InteractionRepository, user_id: int) -> List[str]:
+    """
+    The user's recent products: the history remembered by the counter, or the latest interactions in the
+    database when the user is not tracked.
+
+    Args:
+        counter (CoInteractionCounter): The co-interaction counter.
+        interaction_repository (InteractionRepository): Repository used when the counter has no history.
+        user_id (int): ID of the user.
+
+    Returns:
+        List[str]: Up to `counter.history_size` product IDs.
+    """
+    history = counter.history(user_id)
+    if history is None:
+        interactions = sorted(interaction_repository.get_interactions_by_user(user_id), key=lambda x: x.time_stamp)
+        history = [interaction.product_id for interaction in interactions][-counter.history_size:]
+    return history
+
+
+class CoInteractionFilter(FilterBase):
+    """
+    Recommends the products most often interacted with together with the user's recent products.
+    """
+
+    def __init__(self, session: Session, counter: CoInteractionCounter, cold_start: Optional[ColdStartService] = None,
+                 neighbours: int = 50) -> None:
+        """
+        Initializes the CoInteractionFilter.
+
+        Args:
+            session (Session): The SQLAlchemy session used for database operations.
+            counter (CoInteractionCounter): Shared, incrementally updated co-interaction counts.
+            cold_start (Optional[ColdStartService]): Popularity lists served to users without history.
+            neighbours (int): Neighbours read per product of the user's history.
+        """
+        super().__init__()
+        self.session = session
+        self.counter = counter
+        self.cold_start = cold_start
+        self.neighbours = neighbours
+        self.customer_repository = CustomerRepository(session)
+        self.interaction_repository = InteractionRepository(session)
+
+    def apply_filter(self, context: Context) -> FilterResultModel:
+        """
+        Scores the context products by their co-interaction counts with the user's recent products.
+
+        Args:
+            context (Context): The context containing user ID, product list, and limit for recommendations.
+
+        Returns:
+            FilterResultModel: The result model containing user ID and a list of recommended products.
+        """
+        self.logger.info(f"Applying co-interaction filtering to {len(context.products)} products for user {context.userId} with limit {context.limit}.")
+
+        history = recent_products(self.counter, self.interaction_repository, context.userId)
+        if not history:
+            self.logger.warn(f"No interactions found for user {context.userId}.")
+            return FilterResultModel(user_id=context.userId, recommendations=self._get_default_recommendations(context))
+
+        scores = self.counter.score(history, self.neighbours)
+        candidates = [(product.unique_id, scores[product.unique_id]) for product in context.products if product.unique_id in scores]
+        if not candidates:
+            return FilterResultModel(user_id=context.userId, recommendations=[])
+
+        # Sort by count and normalize the scores to [0, 1]
+        candidates.sort(key=lambda item: item[1], reverse=True)
+        max_score = candidates[0][1]
+        return FilterResultModel(user_id=context.userId, recommendations=[
+            RecommendationModel(product_id=product_id, similarity_score=score / max_score if max_score else 0.0)
+            for product_id, score in candidates[:context.limit]
+        ])
+
+    def _get_default_recommendations(self, context: Context) -> List[RecommendationModel]:
+        """
+        Recommendations for users without history: the cold-start popularity list of the user's segment
+        when available, otherwise the first products of the context.
+        """
+        if self.cold_start is not None:
+            recommendations = self.cold_start.recommend(self.customer_repository.get_by_id(context.userId), 50)
+            if recommendations:
+                return recommendations
+        return [RecommendationModel(x.unique_id, 1) for x in context.products[:50]]
@@ -1,25 +1,43 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
+import numpy as np
 from sqlalchemy.orm import Session
 from data_access.db.repositories import CustomerRepository, InteractionRepository, ProductRepository
 from filters.filter_base import FilterBase
+from filters.interaction_matrix import DEFAULT_INTERACTION_WEIGHTS, InteractionMatrix
+from filters.seen_items_index import SeenItemsIndex
 from models.context_model import Context
 from models.filter_result_model import FilterResultModel
 from models.recommendation_model import RecommendationModel
+from services.cold_start_service import ColdStartService
 
 class CollaborativeFilter(FilterBase):
     """
     A collaborative filtering recommendation system based on user interactions.
     """
 
-    def __init__(self, session: Session) -> None:
+    def __init__(self, session: Session, model: Optional[InteractionMatrix] = None,
+                 cold_start: Optional[ColdStartService] = None, weights: Optional[Dict[str, int]] = None,
+                 neighbours: Optional[int] = None, seen: Optional[SeenItemsIndex] = None) -> None:
         """
         Initializes the CollaborativeFilter with the given database session.
 
         Args:
             session (Session): The SQLAlchemy session used for database operations.
+            model (Optional[InteractionMatrix]): Shared, incrementally updated interaction matrix. When omitted,
+                                                 the matrix is rebuilt from the database on every call.
+            cold_start (Optional[ColdStartService]): Popularity lists served to users without interactions.
+            weights (Optional[Dict[str, int]]): Weight of each interaction type when the matrix is built per call;
+                                                a shared model carries its own weights.
+            neighbours (Optional[int]): Number of most similar users that contribute to the scores; all users when None.
+            seen (Optional[SeenItemsIndex]): Index used to exclude the user's products; the user's matrix row otherwise.
         """
         super().__init__()
         self.session = session
+        self.model = model
+        self.cold_start = cold_start
+        self.weights = weights or DEFAULT_INTERACTION_WEIGHTS
+        self.neighbours = neighbours
+        self.seen = seen
         self.customer_repository = CustomerRepository(session)
         self.interaction_repository = InteractionRepository(session)
         self.product_repository = ProductRepository(session)
@@ -36,174 +54,139 @@ class CollaborativeFilter(FilterBase):
         """
         self.logger.info(f"Applying collaborative filtering to {len(context.products)} products for user {context.userId} with limit {context.limit}.")
 
-        # Retrieve user interactions
-        user_interactions = self.interaction_repository.get_interactions_by_user(context.userId)
-        if not user_interactions:
-            self.logger.warn(f"No interactions found for user {context.userId}.")
-            # Generate default recommendations if no interactions are found
-            all_recommendations = [RecommendationModel(x.unique_id, 1) for x in context.products]
-            recommendations = all_recommendations[:50]
-            return FilterResultModel(user_id=context.userId, recommendations=recommendations)
-
-        # Retrieve all products and build the interaction matrix
-        all_products = self.product_repository.get_all()
-        product_ids = [product.unique_id for product in all_products]
-
-        # Build the interaction matrix for all products
-        interaction_matrix = self._build_interaction_matrix(product_ids)
+        # Use the shared model, or build the interaction matrix for all products
+        interaction_matrix = self.model if self.model is not None else self._build_interaction_matrix()
 
         # Find the index of the user in the interaction matrix
-        user_index = self._get_user_index(context.userId)
-        if user_index is None:
-            self.logger.warn(f"User {context.userId} not found in the interaction matrix.")
-            all_recommendations = [RecommendationModel(x.unique_id, 1) for x in context.products]
-            recommendations = all_recommendations[:50]
-            return FilterResultModel(user_id=context.userId, recommendations=recommendations)
+        user_index = self._get_user_index(context.userId, interaction_matrix)
+        if user_index is None or interaction_matrix.row_norm(user_index) == 0:
+            self.logger.warn(f"No interactions found for user {context.userId}.")
+            return FilterResultModel(user_id=context.userId, recommendations=self._get_default_recommendations(context))
 
         # Calculate user similarities based on interaction matrix
         user_similarities = self._calculate_user_similarities(user_index, interaction_matrix)
 
         # Generate product recommendations based on user similarities
-        recommendations = self._generate_recommendations(user_index, user_similarities, product_ids, interaction_matrix, context)
+        recommendations = self._generate_recommendations(user_index, user_similarities, interaction_matrix, context)
 
         return FilterResultModel(user_id=context.userId, recommendations=recommendations)
 
-    def _build_interaction_matrix(self, product_ids: List[str]) -> List[List[int]]:
+    def _get_default_recommendations(self, context: Context) -> List[RecommendationModel]:
         """
-        Builds an interaction matrix from customer interactions.
+        Recommendations for users without interactions: the cold-start popularity list of the user's
+        segment when available, otherwise the first products of the context.
 
         Args:
-            product_ids (List[str]): List of product IDs to create the interaction matrix for.
+            context (Context): The context containing user ID and product list.
 
         Returns:
-            List[List[int]]: A matrix where each row represents a customer and each column represents a product.
+            List[RecommendationModel]: Up to 50 default recommendations.
         """
-        customers = self.customer_repository.get_all()
-        interaction_matrix = []
-
-        for customer in customers:
-            interactions = self.interaction_repository.get_interactions_by_user(customer.customer_id)
-            interaction_row = [0] * len(product_ids)
-            for interaction in interactions:
-                if interaction.product_id in product_ids:
-                    index = product_ids.index(interaction.product_id)
-                    interaction_row[index] = self._get_interaction_weight(interaction.interaction_type)
-            interaction_matrix.append(interaction_row)
-
-        return interaction_matrix
+        if self.cold_start is not None:
+            recommendations = self.cold_start.recommend(self.customer_repository.get_by_id(context.userId), 50)
+            if recommendations:
+                return recommendations
+        return [RecommendationModel(x.unique_id, 1) for x in context.products[:50]]
 
-    def _get_interaction_weight(self, interaction_type: str) -> int:
+    def _build_interaction_matrix(self) -> InteractionMatrix:
         """
-        Returns the weight of an interaction based on its type.
-
-        Args:
-            interaction_type (str): The type of interaction (e.g., "view", "like", "purchase").
+        Builds a sparse interaction matrix from customer interactions.
 
         Returns:
-            int: The weight assigned to the interaction type.
+            InteractionMatrix: A matrix where each row represents a customer and each column represents a product.
         """
-        weights = {
-            "view": 1,
-            "like": 2,
-            "purchase": 3
-        }
-        return weights.get(interaction_type, 0)
-
-    def _get_user_index(self, user_id: int) -> Optional[int]:
+        return InteractionMatrix.from_triples(
+            self.customer_repository.get_all_ids(),
+            self.product_repository.get_all_ids(),
+            self.interaction_repository.get_interaction_triples(),
+            weights=self.weights
+        )
+
+    def _get_user_index(self, user_id: int, interaction_matrix: InteractionMatrix) -> Optional[int]:
         """
         Finds the index of a user in the interaction matrix.
 
         Args:
             user_id (int): The ID of the user to find.
+            interaction_matrix (InteractionMatrix): The matrix of user interactions.
 
         Returns:
             Optional[int]: The index of the user in the interaction matrix or None if not found.
         """
-        customers = self.customer_repository.get_all()
-        for i, customer in enumerate(customers):
-            if customer.customer_id == user_id:
-                return i
-        return None
+        return interaction_matrix.user_index.get(user_id)
 
-    def _calculate_user_similarities(self, user_index: int, interaction_matrix: List[List[int]]) -> List[tuple]:
+    def _calculate_user_similarities(self, user_index: int, interaction_matrix: InteractionMatrix) -> np.ndarray:
         """
-        Calculates similarities between the specified user and other users.
+        Calculates cosine similarities between the specified user and every other user.
+
+        When a neighbourhood size is set, only the most similar users keep their similarity.
 
         Args:
             user_index (int): The index of the user in the interaction matrix.
-            interaction_matrix (List[List[int]]): The matrix of user interactions.
+            interaction_matrix (InteractionMatrix): The matrix of user interactions.
 
         Returns:
-            List[tuple]: A list of tuples where each tuple contains a user index and the similarity score.
-        """
-        user_vector = interaction_matrix[user_index]
-        similarities = []
-
-        for i, other_user_vector in enumerate(interaction_matrix):
-            if i == user_index:
-                continue
-            similarity = self._cosine_similarity(user_vector, other_user_vector)
-            similarities.append((i, similarity))
-
-        similarities.sort(key=lambda x: x[1], reverse=True)
+            np.ndarray: One similarity per user; the user's own entry and non-neighbours are zero.
+        """
+        similarities = interaction_matrix.user_similarities(user_index).copy()
+        similarities[user_index] = 0.0
+        if self.neighbours is not None and self.neighbours < similarities.size:
+            # Zero everyone outside the top-N without sorting the whole array
+            outside = np.argpartition(-similarities, self.neighbours)[self.neighbours:]
+            similarities[outside] = 0.0
         return similarities
 
-    def _cosine_similarity(self, vector_a: List[int], vector_b: List[int]) -> float:
-        """
-        Computes the cosine similarity between two vectors.
-
-        Args:
-            vector_a (List[int]): The first vector.
-            vector_b (List[int]): The second vector.
-
-        Returns:
-            float: The cosine similarity score between the two vectors.
-        """
-        dot_product = sum(a * b for a, b in zip(vector_a, vector_b))
-        magnitude_a = sum(a**2 for a in vector_a) ** 0.5
-        magnitude_b = sum(b**2 for b in vector_b) ** 0.5
-        if magnitude_a == 0 or magnitude_b == 0:
-            return 0.0
-        return dot_product / (magnitude_a * magnitude_b)
-
-    def _generate_recommendations(self, user_index: int, user_similarities: List[tuple], product_ids: List[str], interaction_matrix: List[List[int]], context: Context) -> List[RecommendationModel]:
+    def _generate_recommendations(self, user_index: int, user_similarities: np.ndarray, interaction_matrix: InteractionMatrix, context: Context) -> List[RecommendationModel]:
         """
         Generates product recommendations based on user similarities and interactions.
 
+        Each product the user has not interacted with is scored with the sum of the other users'
+        interaction weights, weighted by their similarity normalized to [0, 1]. Only the context products
+        some other user interacted with are candidates; the whole catalog when the context has none.
+
         Args:
             user_index (int): The index of the user in the interaction matrix.
-            user_similarities (List[tuple]): A list of user similarities with other users.
-            product_ids (List[str]): List of product IDs for recommendation.
-            interaction_matrix (List[List[int]]): The matrix of user interactions.
+            user_similarities (np.ndarray): Similarity of every user with the given user.
+            interaction_matrix (InteractionMatrix): The matrix of user interactions.
             context (Context): The context containing user ID, product list, and recommendation limit.
 
         Returns:
             List[RecommendationModel]: A list of recommendations for the user.
         """
-        recommendations = []
-        recommended_scores = {}
-
         # Normalize user similarities to the range [0, 1]
-        max_similarity = max(similarity for _, similarity in user_similarities) if user_similarities else 1
-
-        for similar_user_index, similarity in user_similarities:
-            for i, interaction in enumerate(interaction_matrix[similar_user_index]):
-                if interaction > 0 and interaction_matrix[user_index][i] == 0:
-                    normalized_similarity = similarity / max_similarity if max_similarity != 0 else 0
-                    
-                    if product_ids[i] in recommended_scores:
-                        recommended_scores[product_ids[i]] += interaction * normalized_similarity
-                    else:
-                        recommended_scores[product_ids[i]] = interaction * normalized_similarity
+        others = np.ones(interaction_matrix.shape[0], dtype=bool)
+        others[user_index] = False
+        max_similarity = user_similarities[others].max() if others.any() else 1
+        normalized_similarities = user_similarities / max_similarity if max_similarity != 0 else np.zeros_like(user_similarities)
+
+        # Score every product at once and keep the ones the user has not seen but someone else has
+        scores = interaction_matrix.rmatvec(normalized_similarities)
+        interacted_by_others = interaction_matrix.rmatvec(others.astype(np.float64)) > 0
+        candidates = np.flatnonzero(interacted_by_others)
+        if context.products:
+            # Keep to the candidate set, so its budget also bounds what this filter returns
+            columns = [interaction_matrix.product_index.get(product.unique_id) for product in context.products]
+            columns = np.unique(np.array([col for col in columns if col is not None], dtype=np.int64))
+            candidates = columns[interacted_by_others[columns]] if columns.size else columns
+        if self.seen is not None:
+            # Look the candidates up in the user's sorted seen array instead of densifying the matrix row
+            candidates = candidates[self.seen.unseen(context.userId, self.seen.align(interaction_matrix.product_ids)[candidates])]
+        else:
+            candidates = candidates[interaction_matrix.user_row(user_index)[candidates] == 0]
+        if candidates.size == 0:
+            return []
 
         # Sort recommendations by score and limit the number of recommendations
-        sorted_recommendations = sorted(recommended_scores.items(), key=lambda x: x[1], reverse=True)
-        for product_id, score in sorted_recommendations[:context.limit]:
-            # Normalize the final score to the range [0, 1]
-            max_score = max(recommended_scores.values(), default=1)
-            normalized_score = score / max_score if max_score != 0 else 0
-            recommendations.append(
-                RecommendationModel(product_id=product_id, similarity_score=normalized_score)
+        candidate_scores = scores[candidates]
+        order = np.argsort(-candidate_scores, kind="stable")[:context.limit]
+
+        # Normalize the final score to the range [0, 1]
+        max_score = candidate_scores.max()
+        product_ids = interaction_matrix.product_ids
+        return [
+            RecommendationModel(
+                product_id=product_ids[candidates[i]],
+                similarity_score=float(candidate_scores[i] / max_score) if max_score != 0 else 0
             )
-
-        return recommendations
+            for i in order
+        ]
@@ -1,27 +1,49 @@
 from abc import ABC
-from typing import List, Optional
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from typing import Dict, List, Optional
 import numpy as np
+from scipy import sparse
+from scipy.sparse import linalg as sparse_linalg
 from data_access.db.db import SessionLocal
-from data_access.db.repositories import InteractionRepository
+from data_access.db.models import Interaction
+from data_access.db.repositories import CustomerRepository, InteractionRepository
+from filters.content_model import CONTENT_INTERACTION_WEIGHTS, ContentModel, create_vectorizer
 from filters.filter_base import FilterBase
+from filters.seen_items_index import SeenItemsIndex
+from filters.user_profile_store import UserProfileStore
 from models.context_model import Context
 from models.filter_result_model import FilterResultModel
 from models.recommendation_model import RecommendationModel
+from services.cold_start_service import ColdStartService
 
 class ContentBaseFilter(FilterBase):
-    def __init__(self, session):
+    def __init__(self, session, cold_start: Optional[ColdStartService] = None, model: Optional[ContentModel] = None,
+                 profiles: Optional[UserProfileStore] = None, featurizer: str = "tfidf",
+                 weights: Optional[Dict[str, int]] = None, seen: Optional[SeenItemsIndex] = None):
         """
         Initializes the ContentBaseFilter with a database session.
 
         Args:
             session (SessionLocal): The SQLAlchemy database session.
+            cold_start (Optional[ColdStartService]): Popularity lists served when the user has no profile.
+            model (Optional[ContentModel]): Catalog-wide fitted model. When omitted, TF-IDF is fitted on the
+                                            context products on every call.
+            profiles (Optional[UserProfileStore]): Incrementally maintained user profiles for `model`.
+            featurizer (str): "tfidf" or "hashing"; the featurizer fitted per call when no model is given.
+            weights (Optional[Dict[str, int]]): Weight of each interaction type in the user vector; stored profiles
+                                                carry their own weights.
+            seen (Optional[SeenItemsIndex]): Index used to exclude the user's products without querying their
+                                             interactions; they are loaded from the database otherwise.
         """
         super().__init__()
         self.session = session
-        self.tfidf_vectorizer = TfidfVectorizer(stop_words='english')
+        self.cold_start = cold_start
+        self.model = model
+        self.profiles = profiles
+        self.weights = weights or CONTENT_INTERACTION_WEIGHTS
+        self.seen = seen
+        self.tfidf_vectorizer = create_vectorizer(featurizer)
         self.interactions_repository = InteractionRepository(session)
+        self.customer_repository = CustomerRepository(session)
 
     def apply_filter(self, context: Context) -> Optional[FilterResultModel]:
         """
@@ -44,18 +66,33 @@ class ContentBaseFilter(FilterBase):
         self.logger.info(f"Applying content-based filters to {len(context.products)} products, expecting {context.limit} filtered.")
 
         try:
-            # Extract product descriptions and compute TF-IDF matrix
-            product_descriptions = self.get_product_descriptions(context.products)
-            tfidf_matrix = self.tfidf_vectorizer.fit_transform(product_descriptions)
+            # The user's interactions are fetched at most once, only when the profile or the exclusion set needs them
+            user_interactions = None
+
+            if self.model is not None:
+                # Reuse the catalog-wide model and the stored profile when there is one
+                tfidf_matrix = self.model.vectorize(context.products)
+                user_vector = self.profiles.get_vector(context.userId) if self.profiles is not None else None
+                if user_vector is None:
+                    user_interactions = self.interactions_repository.get_interactions_by_user(context.userId)
+                    user_vector = self.get_user_vector(user_interactions, self.model.product_index, self.model.matrix)
+            else:
+                user_interactions = self.interactions_repository.get_interactions_by_user(context.userId)
+
+                # Extract product descriptions and compute TF-IDF matrix
+                product_descriptions = self.get_product_descriptions(context.products)
+                tfidf_matrix = self.tfidf_vectorizer.fit_transform(product_descriptions)
+                product_index = {product.unique_id: i for i, product in enumerate(context.products)}
+
+                # Compute user vector based on their interactions
+                user_vector = self.get_user_vector(user_interactions, product_index, tfidf_matrix)
 
-            # Compute user vector based on their interactions
-            user_vector = self.get_user_vector(context.userId, context.products, tfidf_matrix)
             if user_vector is None:
                 self.logger.warn("No valid user vector found.")
-                return None
+                return self.get_cold_start_result(context)
 
             # Generate and return recommendations based on cosine similarity
-            recommendations = self.get_recommendations(context, tfidf_matrix, user_vector)
+            recommendations = self.get_recommendations(context, tfidf_matrix, user_vector, user_interactions)
 
             return FilterResultModel(user_id=context.userId, recommendations=recommendations)
 
@@ -63,6 +100,23 @@ class ContentBaseFilter(FilterBase):
             self.logger.error(f"An error occurred while applying the Content-Based filter: {str(e)}")
             return None
 
+    def get_cold_start_result(self, context: Context) -> Optional[FilterResultModel]:
+        """
+        Build a result from the cold-start popularity lists for users without a content profile.
+
+        Args:
+            context (Context): The context containing user ID and recommendation limit.
+
+        Returns:
+            Optional[FilterResultModel]: The popularity-based result, or None when no cold-start service is available.
+        """
+        if self.cold_start is None:
+            return None
+        recommendations = self.cold_start.recommend(self.customer_repository.get_by_id(context.userId), max(context.limit, 50))
+        if not recommendations:
+            return None
+        return FilterResultModel(user_id=context.userId, recommendations=recommendations)
+
     def get_product_descriptions(self, products: List) -> List[str]:
         """
         Extract descriptions from a list of products.
@@ -75,43 +129,41 @@ class ContentBaseFilter(FilterBase):
         """
         return [product.getProductDescribed() for product in products]
 
-    def get_user_vector(self, user_id: int, products: List, tfidf_matrix: np.ndarray) -> Optional[np.ndarray]:
+    def get_user_vector(self, user_interactions: List[Interaction], product_index: Dict[str, int], tfidf_matrix: sparse.csr_matrix) -> Optional[sparse.csr_matrix]:
         """
-        Calculate the user's vector based on their interactions with products.
+        Calculate the user's vector as the weighted average of the vectors of the products they interacted with.
+
+        The average is computed as a single sparse product between a weight row and the TF-IDF matrix,
+        so no vocabulary-sized dense vector is materialized.
 
         Args:
-            user_id (int): The user ID.
-            products (List): A list of product objects.
-            tfidf_matrix (np.ndarray): The TF-IDF matrix of product descriptions.
+            user_interactions (List[Interaction]): The user's interactions.
+            product_index (Dict[str, int]): Row of each product ID in the TF-IDF matrix.
+            tfidf_matrix (sparse.csr_matrix): The TF-IDF matrix of product descriptions.
 
         Returns:
-            Optional[np.ndarray]: The user's vector, or None if unable to calculate.
+            Optional[sparse.csr_matrix]: The user's vector as a 1 x vocabulary sparse row, or None if unable to calculate.
         """
         try:
+            rows = []
             interaction_weights = []
-            product_vectors = []
-
-            # Get user's interactions
-            user_interactions = self.interactions_repository.get_interactions_by_user(user_id)
             for interaction in user_interactions:
-                # Find the corresponding product
-                product = next((p for p in products if p.unique_id == interaction.product_id), None)
-                if product:
-                    # Get the product vector from the TF-IDF matrix
-                    index = products.index(product)
-                    product_vectors.append(tfidf_matrix[index].toarray().flatten())
-
+                index = product_index.get(interaction.product_id)
+                if index is not None:
+                    rows.append(index)
                     # Assign weight based on interaction type
-                    weight = self.get_interaction_weight(interaction.interaction_type)
-                    interaction_weights.append(weight)
+                    interaction_weights.append(self.get_interaction_weight(interaction.interaction_type))
 
-            if not product_vectors:
+            if not rows:
                 self.logger.warn("No user interactions with the products were found.")
                 return None
 
             # Compute the user's vector as a weighted average of the product vectors
-            user_vector = np.average(product_vectors, axis=0, weights=interaction_weights)
-            return user_vector
+            weights = sparse.csr_matrix(
+                (np.asarray(interaction_weights, dtype=np.float64) / sum(interaction_weights), ([0] * len(rows), rows)),
+                shape=(1, tfidf_matrix.shape[0])
+            )
+            return weights @ tfidf_matrix
 
         except Exception as e:
             self.logger.error(f"An error occurred when trying to get the user vector: {str(e)}")
@@ -127,44 +179,63 @@ class ContentBaseFilter(FilterBase):
         Returns:
             int: The weight associated with the interaction type.
         """
-        return {
-            "view": 2,
-            "like": 3,
-            "purchase": 5
-        }.get(interaction_type, 1)
+        return self.weights.get(interaction_type, 1)
 
-    def get_recommendations(self, context: Context, tfidf_matrix: np.ndarray, user_vector: np.ndarray) -> List[RecommendationModel]:
+    def get_recommendations(self, context: Context, tfidf_matrix: sparse.csr_matrix, user_vector: sparse.csr_matrix, user_interactions: Optional[List[Interaction]] = None) -> List[RecommendationModel]:
         """
         Generate a list of recommendations based on cosine similarity between the user's vector and product vectors.
 
         Args:
             context (Context): The context containing user ID, product list, and recommendation limit.
-            tfidf_matrix (np.ndarray): The TF-IDF matrix of product descriptions.
-            user_vector (np.ndarray): The user's vector based on their interactions.
+            tfidf_matrix (sparse.csr_matrix): The TF-IDF matrix of product descriptions.
+            user_vector (sparse.csr_matrix): The user's vector based on their interactions.
+            user_interactions (Optional[List[Interaction]]): The user's interactions, used to exclude already seen
+                                                             products when there is no seen-items index; loaded
+                                                             when omitted.
 
         Returns:
             List[RecommendationModel]: A list of recommended products with their similarity scores.
         """
         # Compute cosine similarity between user vector and all product vectors
-        cosine_similarities = cosine_similarity([user_vector], tfidf_matrix).flatten()
-
-        # Get IDs of products the user has already interacted with
-        interacted_product_ids = {
-            interaction.product_id
-            for interaction in self.interactions_repository.get_interactions_by_user(context.userId)
-        }
+        cosine_similarities = self.cosine_similarities(tfidf_matrix, user_vector)
+
+        # Exclude the products the user has already interacted with
+        if self.seen is not None:
+            unseen = self.seen.unseen(context.userId, self.seen.columns(product.unique_id for product in context.products))
+        else:
+            if user_interactions is None:
+                user_interactions = self.interactions_repository.get_interactions_by_user(context.userId)
+            interacted_product_ids = {interaction.product_id for interaction in user_interactions}
+            unseen = np.array([product.unique_id not in interacted_product_ids for product in context.products], dtype=bool)
+        candidates = np.flatnonzero(unseen)
+        if candidates.size == 0:
+            return []
 
         # Generate recommendations
-        recommendations = []
-        for i in cosine_similarities.argsort()[::-1]:
-            if context.products[i].unique_id not in interacted_product_ids:
-                recommendations.append(
-                    RecommendationModel(
-                        product_id=context.products[i].unique_id,
-                        similarity_score=cosine_similarities[i]
-                    )
-                )
-            if len(recommendations) >= context.limit:
-                break
-
-        return recommendations
+        candidate_scores = cosine_similarities[candidates]
+        order = np.argsort(-candidate_scores, kind="stable")[:context.limit]
+        return [
+            RecommendationModel(
+                product_id=context.products[candidates[i]].unique_id,
+                similarity_score=float(candidate_scores[i])
+            )
+            for i in order
+        ]
+
+    def cosine_similarities(self, matrix: sparse.csr_matrix, user_vector: sparse.csr_matrix) -> np.ndarray:
+        """
+        Compute the cosine similarity between a sparse user vector and every row of a sparse matrix.
+
+        Args:
+            matrix (sparse.csr_matrix): Product vectors, one per row.
+            user_vector (sparse.csr_matrix): The user's vector as a sparse row.
+
+        Returns:
+            np.ndarray: One similarity per product; zero for empty vectors.
+        """
+        dots = np.asarray((matrix @ user_vector.T).todense()).ravel()
+        row_norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms = row_norms * sparse_linalg.norm(user_vector)
+        similarities = np.zeros_like(dots)
+        np.divide(dots, norms, out=similarities, where=norms > 0)
+        return similarities
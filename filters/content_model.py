@@ -0,0 +1,304 @@
+import os
+import pickle
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from sklearn.preprocessing import normalize
+from sqlalchemy.orm import Session
+from data_access.db.models import Product, ProductFeatures
+from data_access.db.repositories import ProductFeaturesRepository, ProductRepository
+from filters.memory_budget import INDEX_DTYPE, VALUE_DTYPE, MemoryBudget
+from services.logger import Logger
+from services.text_features import tokenize
+
+# Weight of each interaction type when building content profiles; unknown types weigh 1
+CONTENT_INTERACTION_WEIGHTS = {
+    "view": 2,
+    "like": 3,
+    "purchase": 5
+}
+
+MODEL_FILE = "content_model.pkl"
+
+# Supported featurizers: a fitted TF-IDF vocabulary, or stateless feature hashing with a fixed dimension
+FEATURIZERS = ("tfidf", "hashing")
+
+# Bytes allocated per token when hashing precomputed features: row and column indices, the value and its
+# share of the summed CSR matrix
+HASHED_TOKEN_BYTES = 24
+
+
+def create_vectorizer(featurizer: str = "tfidf", n_features: int = 2 ** 18, ngram_range: Tuple[int, int] = (1, 1),
+                      dtype=VALUE_DTYPE):
+    """
+    Creates the text featurizer used by the content model.
+
+    The "hashing" featurizer maps terms to a fixed number of columns, so memory and profile size stay
+    bounded as the catalog grows and new products can be transformed without refitting. It produces
+    L2-normalized term frequencies (no IDF, which would need fitted state).
+
+    Args:
+        featurizer (str): "tfidf" or "hashing".
+        n_features (int): Number of columns of the hashing featurizer.
+        ngram_range (Tuple[int, int]): Range of n-gram sizes to extract.
+        dtype: Output dtype; float32 by default, np.float64 doubles the matrix size.
+
+    Returns:
+        The unfitted vectorizer.
+
+    Raises:
+        ValueError: If the featurizer is unknown.
+    """
+    if featurizer == "tfidf":
+        return TfidfVectorizer(stop_words='english', ngram_range=ngram_range, dtype=dtype)
+    if featurizer == "hashing":
+        return HashingVectorizer(stop_words='english', ngram_range=ngram_range, n_features=n_features,
+                                 alternate_sign=False, norm='l2', dtype=dtype)
+    raise ValueError(f"Unknown featurizer '{featurizer}', expected one of {', '.join(FEATURIZERS)}")
+
+
+class ContentModel:
+    """
+    Text featurizer fitted once over the whole catalog, with the resulting product matrix.
+
+    Attributes:
+        vectorizer: The fitted featurizer.
+        product_ids (List[str]): Product ID of every row.
+        product_index (Dict[str, int]): Row of each product ID.
+        matrix (sparse.csr_matrix): One L2-normalized row per product.
+        built_at (Optional[datetime]): When the model was fitted; identifies the feature space.
+        pretokenized (bool): Whether the vectorizer consumes space-separated tokens instead of raw descriptions.
+    """
+
+    def __init__(self, vectorizer=None) -> None:
+        """
+        Initializes an unfitted model.
+
+        Args:
+            vectorizer: Featurizer with `fit_transform`/`transform`, see `create_vectorizer`. Defaults to the
+                        TF-IDF vectorizer used by `ContentBaseFilter`.
+        """
+        self.logger = Logger()
+        self.vectorizer = vectorizer if vectorizer is not None else create_vectorizer()
+        self.product_ids: List[str] = []
+        self.product_index: Dict[str, int] = {}
+        self.matrix: Optional[sparse.csr_matrix] = None
+        self.built_at: Optional[datetime] = None
+        self.pretokenized = False
+        self._lock = threading.Lock()
+
+    def fit(self, product_ids: List[str], descriptions: List[str]) -> "ContentModel":
+        """
+        Fits the featurizer over the given descriptions and stores the product matrix.
+
+        Args:
+            product_ids (List[str]): Product ID of every description.
+            descriptions (List[str]): Product descriptions.
+
+        Returns:
+            ContentModel: The fitted model.
+        """
+        self.matrix = sparse.csr_matrix(self.vectorizer.fit_transform(descriptions))
+        self.product_ids = list(product_ids)
+        self.product_index = {product_id: i for i, product_id in enumerate(self.product_ids)}
+        self.built_at = datetime.now()
+        self.logger.info(f"Content model fitted on {len(self.product_ids)} products ({self.matrix.shape[1]} features).")
+        return self
+
+    def fit_products(self, products: List[Product]) -> "ContentModel":
+        """
+        Fits the model over product entities.
+
+        Args:
+            products (List[Product]): Products to fit on.
+
+        Returns:
+            ContentModel: The fitted model.
+        """
+        return self.fit([product.unique_id for product in products], [product.getProductDescribed() for product in products])
+
+    def fit_features(self, features: List[ProductFeatures], budget: Optional[MemoryBudget] = None) -> "ContentModel":
+        """
+        Fits the model from precomputed product features instead of raw text.
+
+        The hashing featurizer builds its matrix straight from the stored token hashes. The TF-IDF
+        featurizer is fitted on the stored tokens and afterwards expects tokenized input, which
+        `vectorize` and `add_product` take care of. N-gram configurations need the raw text and are
+        fitted on the normalized descriptions. Hashed matrices over the memory budget are built
+        `budget.chunk_size` products at a time; TF-IDF needs the whole corpus to fit its weights.
+
+        Args:
+            features (List[ProductFeatures]): Features of the products to fit on.
+            budget (Optional[MemoryBudget]): Memory budget of the build; the configured one by default.
+
+        Returns:
+            ContentModel: The fitted model.
+        """
+        product_ids = [feature.product_id for feature in features]
+        if tuple(self.vectorizer.ngram_range) != (1, 1):
+            return self.fit(product_ids, [feature.normalized_text for feature in features])
+
+        if isinstance(self.vectorizer, HashingVectorizer):
+            budget = budget or MemoryBudget()
+            hash_lists = [feature.token_hashes or [] for feature in features]
+            tokens = sum(len(hashes) for hashes in hash_lists)
+            step = len(hash_lists) if budget.fits("Hashing product features", tokens * HASHED_TOKEN_BYTES) else budget.chunk_size
+            parts = [self._hashed_matrix(hash_lists[start:start + step]) for start in range(0, max(len(hash_lists), 1), max(step, 1))]
+            self.matrix = parts[0] if len(parts) == 1 else sparse.vstack(parts, format="csr")
+            self.product_ids = list(product_ids)
+            self.product_index = {product_id: i for i, product_id in enumerate(self.product_ids)}
+            self.built_at = datetime.now()
+            self.logger.info(f"Content model built from features of {len(self.product_ids)} products ({self.matrix.shape[1]} features).")
+            return self
+
+        self.vectorizer.set_params(analyzer=str.split, stop_words=None)
+        self.pretokenized = True
+        return self.fit(product_ids, [feature.tokens or "" for feature in features])
+
+    @classmethod
+    def from_session(cls, session: Session, vectorizer=None, budget: Optional[MemoryBudget] = None) -> "ContentModel":
+        """
+        Fits a model over the whole catalog stored in the database.
+
+        Precomputed product features are used when available; otherwise descriptions are built from
+        the product rows.
+
+        Args:
+            session (Session): The SQLAlchemy session used for database operations.
+            vectorizer: Optional featurizer.
+            budget (Optional[MemoryBudget]): Memory budget of the build; the configured one by default.
+
+        Returns:
+            ContentModel: The fitted model.
+        """
+        features = ProductFeaturesRepository(session).get_all()
+        if not features:
+            return cls(vectorizer).fit_products(ProductRepository(session).get_all())
+
+        missing = len(ProductRepository(session).get_all_ids()) - len(features)
+        if missing > 0:
+            Logger().warn(f"{missing} products have no precomputed features; rebuild them to include them in the content model.")
+        return cls(vectorizer).fit_features(features, budget)
+
+    def prepare(self, descriptions: List[str]) -> List[str]:
+        """
+        Converts raw descriptions into the documents the vectorizer expects.
+
+        Args:
+            descriptions (List[str]): Raw product descriptions.
+
+        Returns:
+            List[str]: The descriptions, tokenized when the model was fitted on precomputed tokens.
+        """
+        if self.pretokenized:
+            return [" ".join(tokenize(description)) for description in descriptions]
+        return descriptions
+
+    def vectorize(self, products: List[Product]) -> sparse.csr_matrix:
+        """
+        Returns the rows of the given products, transforming only products unknown to the model.
+
+        Args:
+            products (List[Product]): Products in the order the rows should have.
+
+        Returns:
+            sparse.csr_matrix: One row per product.
+        """
+        rows = [self.product_index.get(product.unique_id) for product in products]
+        missing = [i for i, row in enumerate(rows) if row is None]
+        if not missing:
+            return self.matrix[rows]
+
+        # Stack known rows and freshly transformed ones, then restore the requested order
+        known = [i for i, row in enumerate(rows) if row is not None]
+        transformed = self.vectorizer.transform(self.prepare([products[i].getProductDescribed() for i in missing]))
+        stacked = sparse.vstack([self.matrix[[rows[i] for i in known]], transformed], format="csr")
+        order = np.argsort(np.asarray(known + missing))
+        return stacked[order]
+
+    def add_product(self, product_id: str, description: str) -> int:
+        """
+        Appends a product to the matrix without refitting; its vector uses the existing feature space.
+
+        Args:
+            product_id (str): ID of the new product.
+            description (str): Description of the new product.
+
+        Returns:
+            int: Row of the product.
+        """
+        with self._lock:
+            row = self.product_index.get(product_id)
+            if row is not None:
+                return row
+            vector = sparse.csr_matrix(self.vectorizer.transform(self.prepare([description])), dtype=self.matrix.dtype)
+            self.matrix = sparse.vstack([self.matrix, vector], format="csr")
+            self.product_ids.append(product_id)
+            self.product_index[product_id] = len(self.product_ids) - 1
+            return self.product_index[product_id]
+
+    def save(self, directory: str) -> str:
+        """
+        Pickles the model into a directory, writing to a temporary file first.
+
+        Args:
+            directory (str): Target directory, created if needed.
+
+        Returns:
+            str: Path of the written file.
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, MODEL_FILE)
+        state = {
+            "vectorizer": self.vectorizer,
+            "product_ids": self.product_ids,
+            "matrix": self.matrix,
+            "built_at": self.built_at,
+            "pretokenized": self.pretokenized
+        }
+        with open(path + ".tmp", "wb") as file:
+            pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+        return path
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["ContentModel"]:
+        """
+        Loads a model saved with `save`.
+
+        Args:
+            directory (str): Directory holding the model.
+
+        Returns:
+            Optional[ContentModel]: The model, or None if the directory holds none.
+        """
+        path = os.path.join(directory, MODEL_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as file:
+            state = pickle.load(file)
+        model = cls(state["vectorizer"])
+        model.matrix = state["matrix"]
+        model.product_ids = list(state["product_ids"])
+        model.product_index = {product_id: i for i, product_id in enumerate(model.product_ids)}
+        model.built_at = state["built_at"]
+        model.pretokenized = state.get("pretokenized", False)
+        return model
+
+    def _hashed_matrix(self, hash_lists: List[List[int]]) -> sparse.csr_matrix:
+        """
+        Builds the L2-normalized term-frequency matrix the hashing vectorizer would produce from token hashes.
+        """
+        n_features = self.vectorizer.n_features
+        lengths = [len(hashes) for hashes in hash_lists]
+        rows = np.repeat(np.arange(len(hash_lists), dtype=INDEX_DTYPE), lengths)
+        cols = (np.abs(np.fromiter((h for hashes in hash_lists for h in hashes), dtype=np.int64, count=sum(lengths))) % n_features).astype(INDEX_DTYPE)
+        matrix = sparse.csr_matrix(
+            (np.ones(len(cols), dtype=self.vectorizer.dtype), (rows, cols)),
+            shape=(len(hash_lists), n_features)
+        )
+        matrix.sum_duplicates()
+        return normalize(matrix, norm=self.vectorizer.norm, copy=False) if self.vectorizer.norm else matrix
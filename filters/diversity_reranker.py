@@ -0,0 +1,183 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+from weakref import WeakKeyDictionary
+import numpy as np
+from sqlalchemy.orm import Session
+from data_access.db.repositories import ProductRepository
+from filters.content_model import ContentModel
+from models.recommendation_model import RecommendationModel
+from services.logger import Logger
+
+
+def _ranges(starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Concatenated positions of several `[start, end)` ranges of CSR arrays, and the length of each range.
+    """
+    lengths = ends - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return np.arange(lengths.sum()) + offsets, lengths
+
+
+class DiversityReranker:
+    """
+    Re-ranks the head of a recommendation list with maximal marginal relevance and brand/category caps.
+
+    Products are picked one at a time by `trade_off * score - (1 - trade_off) * max_similarity`. Here
+    `max_similarity` is the highest cosine similarity to the products already picked, computed from the
+    content model vectors. It is kept in one array updated with a single sparse product per pick, so
+    re-ranking n candidates to k costs k vectorized steps instead of k * n Python comparisons. Products whose
+    brand or category already filled its cap are masked out.
+    """
+    # Brand and category codes aligned with the rows of each live content model, with the number of products
+    # they cover. Models are weak keys, so the old and new bundles of a hot swap each keep theirs until freed
+    _attributes: "WeakKeyDictionary[ContentModel, Tuple[int, np.ndarray, np.ndarray]]" = WeakKeyDictionary()
+    _attributes_lock = threading.Lock()
+
+    def __init__(self, session: Session, content_model: ContentModel, trade_off: float = 0.7, window: int = 500,
+                 max_per_brand: Optional[int] = None, max_per_category: Optional[int] = None):
+        """
+        Initializes the reranker.
+
+        Args:
+            session (Session): The SQLAlchemy session used to read product brands and categories.
+            content_model (ContentModel): Model whose product vectors measure similarity.
+            trade_off (float): Weight of relevance against novelty; 1 keeps the score order.
+            window (int): Number of top products considered; the rest keep their order after the re-ranked head.
+            max_per_brand (Optional[int]): Maximum products of one brand in the re-ranked head.
+            max_per_category (Optional[int]): Maximum products of one category in the re-ranked head.
+        """
+        self.logger = Logger()
+        self.product_repository = ProductRepository(session)
+        self.content_model = content_model
+        self.trade_off = trade_off
+        self.window = window
+        self.max_per_brand = max_per_brand
+        self.max_per_category = max_per_category
+
+    def rerank(self, recommendations: List[RecommendationModel], limit: int) -> List[RecommendationModel]:
+        """
+        Re-ranks the first `window` recommendations into a diverse head of `limit` products.
+
+        Args:
+            recommendations (List[RecommendationModel]): Recommendations sorted by score, best first.
+            limit (int): Number of products picked for the head.
+
+        Returns:
+            List[RecommendationModel]: The head, followed by the remaining recommendations in their original order.
+        """
+        window = recommendations[:self.window]
+        if len(window) <= 1 or limit <= 0:
+            return recommendations
+
+        rows = np.array([self.content_model.product_index.get(x.product_id, -1) for x in window], dtype=np.int64)
+        scores = np.array([x.similarity_score for x in window], dtype=np.float64)
+        row_ptr, values, features = self._normalized_vectors(rows)
+        feature_ptr, feature_rows, feature_values = self._transpose(row_ptr, values, features)
+        brands, categories = self._get_attributes()
+        known = rows >= 0
+        brand_codes = np.where(known, brands[np.where(known, rows, 0)], -1)
+        category_codes = np.where(known, categories[np.where(known, rows, 0)], -1)
+        brand_counts: Dict[int, int] = {}
+        category_counts: Dict[int, int] = {}
+
+        unpicked = np.ones(len(window), dtype=bool)
+        allowed = np.ones(len(window), dtype=bool)
+        max_similarity = np.zeros(len(window))
+        picked: List[int] = []
+        while len(picked) < min(limit, len(window)):
+            # Once the caps exclude every remaining product, the head is completed without them
+            available = unpicked & allowed
+            if not available.any():
+                available = unpicked
+            mmr = self.trade_off * scores - (1 - self.trade_off) * max_similarity
+            mmr[~available] = -np.inf
+            chosen = int(np.argmax(mmr))
+            picked.append(chosen)
+            unpicked[chosen] = False
+
+            # One sparse dot product against the window updates the similarity of every candidate to the picked set
+            start, end = row_ptr[chosen], row_ptr[chosen + 1]
+            if end > start:
+                positions, lengths = _ranges(feature_ptr[features[start:end]], feature_ptr[features[start:end] + 1])
+                weights = np.repeat(values[start:end], lengths) * feature_values[positions]
+                similarity = np.bincount(feature_rows[positions], weights=weights, minlength=len(window))
+                np.maximum(max_similarity, similarity, out=max_similarity)
+
+            # Mask the brand or category once its cap is reached
+            allowed &= ~self._capped(brand_codes, brand_counts, chosen, self.max_per_brand)
+            allowed &= ~self._capped(category_codes, category_counts, chosen, self.max_per_category)
+
+        head = [window[i] for i in picked]
+        picked_set = set(picked)
+        rest = [x for i, x in enumerate(window) if i not in picked_set]
+        return head + rest + recommendations[self.window:]
+
+    def preload(self) -> None:
+        """
+        Loads the brand and category codes of the content model, so the first `rerank` does not.
+        """
+        self._get_attributes()
+
+    def _capped(self, codes: np.ndarray, counts: Dict[int, int], chosen: int, cap: Optional[int]) -> np.ndarray:
+        code = int(codes[chosen])
+        if cap is None or code < 0:
+            return np.zeros(codes.size, dtype=bool)
+        counts[code] = counts.get(code, 0) + 1
+        return codes == code if counts[code] >= cap else np.zeros(codes.size, dtype=bool)
+
+    def _normalized_vectors(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        CSR arrays (indptr, values, feature indices) of the L2-normalized content vectors of the window;
+        products without a vector get an empty row. Plain numpy, since scipy's per-call overhead would
+        dominate at this size.
+        """
+        matrix = self.content_model.matrix
+        starts = np.where(rows >= 0, matrix.indptr[np.maximum(rows, 0)], 0)
+        ends = np.where(rows >= 0, matrix.indptr[np.maximum(rows, 0) + 1], 0)
+        positions, lengths = _ranges(starts, ends)
+        row_ptr = np.concatenate([[0], np.cumsum(lengths)])
+        values = matrix.data[positions].astype(np.float64)
+
+        owners = np.repeat(np.arange(rows.size), lengths)
+        norms = np.sqrt(np.bincount(owners, weights=values * values, minlength=rows.size))
+        values /= np.where(norms > 0, norms, 1.0)[owners]
+        return row_ptr, values, matrix.indices[positions]
+
+    def _transpose(self, row_ptr: np.ndarray, values: np.ndarray, features: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Transposes the window vectors into CSR arrays (indptr, rows, values) over the features present in
+        the window; `features` is rewritten in place to those local feature positions.
+        """
+        owners = np.repeat(np.arange(row_ptr.size - 1), np.diff(row_ptr))
+        order = np.argsort(features)
+        starts = np.concatenate([[features.size > 0], np.diff(features[order]) != 0])
+        feature_ptr = np.concatenate([np.flatnonzero(starts), [features.size]])
+        features[order] = np.cumsum(starts) - 1
+        return feature_ptr, owners[order], values[order]
+
+    def _get_attributes(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Integer brand and category codes of every content model product, loaded once per model.
+        """
+        size = len(self.content_model.product_ids)
+        with DiversityReranker._attributes_lock:
+            attributes = DiversityReranker._attributes.get(self.content_model)
+        # Products added to the model since the codes were loaded need them reloaded
+        if attributes is not None and attributes[0] == size:
+            return attributes[1], attributes[2]
+
+        by_id = {unique_id: (brand, category) for unique_id, brand, category in self.product_repository.get_attributes()}
+        brand_codes: Dict[str, int] = {}
+        category_codes: Dict[str, int] = {}
+        brands = np.full(size, -1, dtype=np.int64)
+        categories = np.full(size, -1, dtype=np.int64)
+        for row, product_id in enumerate(self.content_model.product_ids[:size]):
+            brand, category = by_id.get(product_id, (None, None))
+            if brand:
+                brands[row] = brand_codes.setdefault(brand, len(brand_codes))
+            if category:
+                categories[row] = category_codes.setdefault(category, len(category_codes))
+
+        with DiversityReranker._attributes_lock:
+            DiversityReranker._attributes[self.content_model] = (size, brands, categories)
+        return brands, categories
@@ -1,81 +1,309 @@
-from typing import List, Dict
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, List, Dict, Optional, Tuple, TypeVar
+from sqlalchemy.orm import Session
+from data_access.config import FILTER_PIPE_WORKERS
 from data_access.db.db import SessionLocal
 from data_access.db.repositories import ProductRepository
+from filters.candidate_generator import CandidateGenerator
+from filters.diversity_reranker import DiversityReranker
 from filters.filter_base import FilterBase
 from models.context_model import Context
-from models.filter_result_model import FilterResultModel
+from models.filter_result_model import FilterResultModel, PATH_ABSTAINED, PATH_COLD_START, PATH_COMPLETE, PATH_PREVIOUS_STAGE, \
+    PATH_UNRANKED
 from models.recommendation_model import RecommendationModel
+from services.cold_start_service import ColdStartService
 from services.logger import Logger
+from services.profiler import RequestProfiler, profiled
+
+T = TypeVar("T")
+
+# Threads running stages that have a time budget, shared by every pipe
+_stage_executor: Optional[ThreadPoolExecutor] = None
+_stage_executor_lock = threading.Lock()
+
+
+def _get_stage_executor() -> ThreadPoolExecutor:
+    global _stage_executor
+    with _stage_executor_lock:
+        if _stage_executor is None:
+            _stage_executor = ThreadPoolExecutor(max_workers=FILTER_PIPE_WORKERS, thread_name_prefix="filter-stage")
+        return _stage_executor
+
+
+class StageFailure(Exception):
+    """
+    Raised by `FilterPipe._run_stage` when a stage runs out of time or fails.
+
+    Attributes:
+        reason (str): Human-readable description, recorded on the result.
+        abandoned (bool): True when the stage is still running in the background and may still be using the session.
+    """
+    def __init__(self, reason: str, abandoned: bool = False) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.abandoned = abandoned
+
 
 class FilterPipe:
-    def __init__(self, filters: List[FilterBase]):
+    def __init__(self, filters: List[FilterBase], session: Optional[Session] = None,
+                 candidate_generator: Optional[CandidateGenerator] = None,
+                 cold_start: Optional[ColdStartService] = None, weights: Optional[List[float]] = None,
+                 reranker: Optional[DiversityReranker] = None, budget: Optional[float] = None,
+                 filter_budgets: Optional[List[Optional[float]]] = None):
         """
         Initializes the FilterPipe with a list of filters.
 
         Args:
             filters (List[FilterBase]): A list of FilterBase instances that will be applied in sequence.
+            session (Optional[Session]): Session used to resolve products between filters. When omitted,
+                                         the thread-local `SessionLocal` session is used and closed afterwards.
+            candidate_generator (Optional[CandidateGenerator]): Optional first stage that replaces the context
+                                                                products with a bounded candidate set.
+            cold_start (Optional[ColdStartService]): Popularity lists returned when the first filter yields nothing,
+                                                     instead of the unranked product list.
+            weights (Optional[List[float]]): Weight of each filter's score in the combined score; equal weights
+                                             (a plain average) by default.
+            reranker (Optional[DiversityReranker]): Optional last stage that diversifies the head of the
+                                                    combined list.
+            budget (Optional[float]): Seconds the whole request may take; no limit when None.
+            filter_budgets (Optional[List[Optional[float]]]): Seconds each filter may take; None entries are only
+                                                              bound by the request budget.
+
+        Raises:
+            ValueError: If the number of weights or filter budgets does not match the number of filters.
         """
+        if weights is not None and len(weights) != len(filters):
+            raise ValueError(f"Expected {len(filters)} filter weights, got {len(weights)}")
+        if filter_budgets is not None and len(filter_budgets) != len(filters):
+            raise ValueError(f"Expected {len(filters)} filter budgets, got {len(filter_budgets)}")
         self.logger = Logger()
         self.filters = filters
+        self.session = session
+        self.candidate_generator = candidate_generator
+        self.cold_start = cold_start
+        self.weights = weights if weights is not None else [1.0] * len(filters)
+        self.reranker = reranker
+        self.budget = budget
+        self.filter_budgets = filter_budgets if filter_budgets is not None else [None] * len(filters)
+        self._abandoned: List[Future] = []
+        self._abandoned_lock = threading.Lock()
 
     def apply_filters(self, context: Context) -> FilterResultModel:
         """
         Apply a sequence of filters to the given context and return a FilterResultModel with combined scores.
 
-        This method applies each filter in the list sequentially to the products in the context, 
-        collects and combines their scores, and returns a sorted list of recommendations based on 
-        the combined scores.
+        When a candidate generator is configured, it first narrows the context products to a bounded
+        candidate set. This method then applies each filter in the list sequentially to the products in
+        the context, collects and combines their scores, and returns a sorted list of recommendations
+        based on the combined scores. A filter that abstains, e.g. a session filter for a user without a
+        session, is skipped: it adds no score and no weight, and the next filter gets the same products.
+
+        With time budgets, each stage runs in a worker thread and is abandoned when it exceeds its own
+        budget or the time left in the request. A filter that times out, raises or returns nothing does
+        not end the request with the unranked product list. The result falls back to the ranking of the
+        filters that completed, then to the cold-start list, and only then to the unranked products.
+        The path taken is recorded on the result. An abandoned stage may still be using the session; see
+        `when_idle`.
+
+        When profiling is enabled, by `PROFILE_MODE` or by `context.profile`, the request and each stage are
+        profiled and the profile of a request slower than `PROFILE_THRESHOLD` is written; its summary file
+        is recorded on the result.
 
         Args:
-            context (Context): The context containing information such as user ID, product list, and 
+            context (Context): The context containing information such as user ID, product list, and
                                any other relevant data for filtering.
 
         Returns:
-            FilterResultModel: A result model containing the user ID and a sorted list of 
+            FilterResultModel: A result model containing the user ID and a sorted list of
                                recommended products with their combined similarity scores.
         """
+        profiler = RequestProfiler.for_request(context.profile, f"user-{context.userId}")
+        if profiler is None:
+            return self._apply_filters(context, None)
+        with profiler:
+            result = self._apply_filters(context, profiler)
+        result.profile = profiler.dumped
+        return result
+
+    def _apply_filters(self, context: Context, profiler: Optional[RequestProfiler]) -> FilterResultModel:
         self.logger.info("Applying filters in sequence.")
-        filtered_products = context.products
-        product_scores: Dict[str, List[float]] = {}
+        product_scores: Dict[str, List[Tuple[float, float]]] = {}
+        deadline = time.monotonic() + self.budget if self.budget is not None else None
 
-        with SessionLocal() as session:
+        # A caller-owned session is left open; the shared scoped session is closed when done
+        session = self.session if self.session is not None else SessionLocal()
+        filtered_products = context.products
+        try:
             product_repo = ProductRepository(session)
-            
-            for filter in self.filters:
-                self.logger.info(f"Applying filter: {filter.__class__.__name__}")
+
+            # Generate a bounded candidate set so scoring cost does not grow with the catalog
+            if self.candidate_generator is not None:
+                candidates = self._run_stage("CandidateGenerator", lambda: self.candidate_generator.generate(context), None, deadline, profiler)
+                if candidates:
+                    context.products = candidates
+                else:
+                    self.logger.warn("Candidate generation returned no products; scoring the full product list.")
+                    context.products = context.products or product_repo.get_all()
+            filtered_products = context.products
+
+            for filter, weight, filter_budget in zip(self.filters, self.weights, self.filter_budgets):
+                name = filter.__class__.__name__
+                self.logger.info(f"Applying filter: {name}")
                 context.products = filtered_products
-                
+
                 # Apply the filter
-                filter_result = filter.apply_filter(context)
-                
+                filter_result = self._run_stage(name, lambda: filter.apply_filter(context), filter_budget, deadline, profiler)
+
+                # A filter without an opinion on this user neither scores nor narrows the products
+                if filter_result is not None and filter_result.path == PATH_ABSTAINED:
+                    self.logger.info(f"{name} abstained for user {context.userId}.")
+                    continue
+
                 # Check if the filter result is valid
                 if not filter_result or not filter_result.recommendations:
-                    self.logger.warn(f"No recommendations from filter: {filter.__class__.__name__}")
-                    # Return a default set of recommendations if no results are obtained
-                    return FilterResultModel(user_id=context.userId, recommendations=[RecommendationModel(x.unique_id, 1) for x in filtered_products])
+                    raise StageFailure(f"{name} returned no recommendations")
 
                 # Update the scores for the filtered products
                 for rec in filter_result.recommendations:
                     product_id = rec.product_id
                     score = rec.similarity_score
-                    
+
                     if product_id in product_scores:
-                        product_scores[product_id].append(score)
+                        product_scores[product_id].append((score, weight))
                     else:
-                        product_scores[product_id] = [score]
+                        product_scores[product_id] = [(score, weight)]
 
                 # Update the list of filtered products with the results from the current filter
-                filtered_products = [product_repo.get_by_id(rec.product_id) for rec in filter_result.recommendations]
+                filtered_products = product_repo.get_by_ids([rec.product_id for rec in filter_result.recommendations])
+
+            if not product_scores:
+                raise StageFailure("every filter abstained")
+            recommendations = self._rank(product_scores)
+            # Spread the head of the list over brands, categories and dissimilar products
+            if self.reranker is not None:
+                recommendations = profiled(profiler, "DiversityReranker", lambda: self.reranker.rerank(recommendations, context.limit))()
+            return FilterResultModel(user_id=context.userId, recommendations=recommendations, path=PATH_COMPLETE)
+
+        except StageFailure as failure:
+            self.logger.warn(f"Degrading recommendations for user {context.userId}: {failure.reason}.")
+            return self._fallback(context, product_scores, filtered_products, None if failure.abandoned else session, failure.reason)
+
+        finally:
+            if self.session is None:
+                if any(not future.done() for future in self._abandoned):
+                    # Leave the busy session to the abandoned stage; the next caller on this thread gets a new one
+                    SessionLocal.registry.clear()
+                self.when_idle(session.close)
+
+    def when_idle(self, callback: Callable[[], None]) -> None:
+        """
+        Runs `callback` once no abandoned stage is running, immediately if there is none.
+
+        Callers that own the session must close it through this method after a degraded result, so a stage
+        still running in the background does not share its connection with the next request.
+
+        Args:
+            callback (Callable[[], None]): Function to call, e.g. `session.close`.
+        """
+        with self._abandoned_lock:
+            self._abandoned = [future for future in self._abandoned if not future.done()]
+            pending = list(self._abandoned)
+        if not pending:
+            callback()
+            return
+
+        remaining = [len(pending)]
+        lock = threading.Lock()
+
+        def done(_: Future) -> None:
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                callback()
+
+        for future in pending:
+            future.add_done_callback(done)
+
+    def _run_stage(self, name: str, stage: Callable[[], T], budget: Optional[float], deadline: Optional[float],
+                   profiler: Optional[RequestProfiler] = None) -> T:
+        """
+        Runs a stage inline when it has no time limit, otherwise in a worker thread bounded by the
+        stage budget and the request deadline. With a profiler, the stage is profiled in whichever thread runs it.
+
+        Raises:
+            StageFailure: If the stage times out or raises.
+        """
+        stage = profiled(profiler, name, stage)
+        timeout = budget
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        try:
+            if timeout is None:
+                return stage()
+            if timeout <= 0:
+                raise StageFailure(f"request budget exhausted before {name}")
+            future = _get_stage_executor().submit(stage)
+            try:
+                return future.result(timeout=timeout)
+            except FutureTimeoutError:
+                if future.cancel():
+                    raise StageFailure(f"{name} did not start within {timeout * 1000:.0f} ms")
+                with self._abandoned_lock:
+                    self._abandoned.append(future)
+                raise StageFailure(f"{name} timed out after {timeout * 1000:.0f} ms", abandoned=True)
+        except StageFailure:
+            raise
+        except Exception as e:
+            raise StageFailure(f"{name} failed: {str(e)}")
 
+    def _fallback(self, context: Context, product_scores: Dict[str, List[Tuple[float, float]]], filtered_products: List,
+                  session: Optional[Session], reason: str) -> FilterResultModel:
+        """
+        Best available result when a stage did not complete: the ranking of the filters that did, the
+        cold-start list, or the unranked products, in that order.
+
+        Args:
+            context (Context): The request context.
+            product_scores (Dict[str, List[Tuple[float, float]]]): Scores of the completed filters.
+            filtered_products (List): Products the failed stage was given.
+            session (Optional[Session]): The session, or None when an abandoned stage may still be using it.
+            reason (str): Why the pipeline degraded.
+
+        Returns:
+            FilterResultModel: The degraded result with its path and reason.
+        """
+        if product_scores:
+            return FilterResultModel(context.userId, self._rank(product_scores), path=PATH_PREVIOUS_STAGE, reason=reason)
+
+        if self.cold_start is not None:
+            limit = max(context.limit, 50)
+            # Without the session only the overall list is available, since the customer's segment is unknown
+            fallback = self.cold_start.recommend_for_user(session, context.userId, limit) if session is not None \
+                else self.cold_start.recommend(None, limit)
+            if fallback:
+                return FilterResultModel(context.userId, fallback, path=PATH_COLD_START, reason=reason)
+
+        return FilterResultModel(context.userId, [RecommendationModel(x.unique_id, 1) for x in filtered_products or []],
+                                 path=PATH_UNRANKED, reason=reason)
+
+    def _rank(self, product_scores: Dict[str, List[Tuple[float, float]]]) -> List[RecommendationModel]:
+        """
+        Combines the scores of each product and sorts the products by combined score.
+        """
         # Convert the product_scores to RecommendationModel with combined scores
         final_recommendations = []
         for product_id, scores in product_scores.items():
-            combined_score = sum(scores) / len(scores)  # Example: average of the scores
+            # Weighted average of the scores of the filters that ranked the product
+            total_weight = sum(weight for _, weight in scores)
+            combined_score = sum(score * weight for score, weight in scores) / total_weight if total_weight else 0.0
             final_recommendations.append(
                 RecommendationModel(product_id=product_id, similarity_score=combined_score)
             )
 
         # Sort recommendations by score in descending order
         final_recommendations.sort(key=lambda x: x.similarity_score, reverse=True)
-
-        return FilterResultModel(user_id=context.userId, recommendations=final_recommendations)
+        return final_recommendations
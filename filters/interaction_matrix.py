@@ -0,0 +1,428 @@
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from scipy import sparse
+from sqlalchemy.orm import Session
+from data_access.db.events import INTERACTION_CREATED, InteractionEvent, repository_events
+from data_access.db.repositories import CustomerRepository, ProductRepository
+from filters.memory_budget import INDEX_DTYPE, MemoryBudget, chunks, weight_dtype
+from services.logger import Logger
+
+# Weights used by the collaborative model for each interaction type
+DEFAULT_INTERACTION_WEIGHTS = {
+    "view": 1,
+    "like": 2,
+    "purchase": 3
+}
+
+MATRIX_FILE = "interaction_matrix.pkl"
+
+
+def squared_row_norms(matrix: sparse.csr_matrix) -> np.ndarray:
+    """
+    Squared L2 norm of every row, accumulated in float64 so small integer weights cannot overflow.
+    """
+    data = matrix.data.astype(np.float64)
+    totals = np.concatenate([[0.0], np.cumsum(data * data)])
+    return totals[matrix.indptr[1:]] - totals[matrix.indptr[:-1]]
+
+
+class InteractionMatrix:
+    """
+    Sparse customer x product interaction matrix that can be updated in place.
+
+    The matrix is stored as a compacted CSR base plus a small set of pending cell updates. Row norms
+    and cached neighbour dot products are patched on every update, so recording an interaction costs
+    O(cached users) instead of a full rebuild. Pending updates are folded into the base by `compact`,
+    either explicitly, periodically, or once `compaction_threshold` updates have accumulated.
+
+    The base stores the weights in the smallest dtype that holds them (uint8 for the default integer
+    weights, see `weight_dtype`). Products of two such matrices would overflow, so consumers of `to_csr`
+    multiply it with float operands only.
+
+    Attributes:
+        user_ids (List[int]): Customer ID of every row.
+        product_ids (List[str]): Product ID of every column.
+        user_index (Dict[int, int]): Row of each customer ID.
+        product_index (Dict[str, int]): Column of each product ID.
+        version (int): Incremented on every applied update.
+        dtype (np.dtype): Dtype of the stored weights.
+    """
+
+    def __init__(self, user_ids: List[int], product_ids: List[str], matrix: sparse.csr_matrix,
+                 weights: Optional[Dict[str, int]] = None, compaction_threshold: int = 10000,
+                 cache_size: int = 1024) -> None:
+        """
+        Initializes the model from an already built CSR matrix.
+
+        Args:
+            user_ids (List[int]): Customer ID of every row.
+            product_ids (List[str]): Product ID of every column.
+            matrix (sparse.csr_matrix): Interaction weights, one row per customer.
+            weights (Optional[Dict[str, int]]): Weight of each interaction type.
+            compaction_threshold (int): Number of pending updates that triggers a compaction.
+            cache_size (int): Maximum number of users whose neighbour dot products are cached.
+        """
+        self.logger = Logger()
+        self.weights = weights or DEFAULT_INTERACTION_WEIGHTS
+        self.dtype = weight_dtype(self.weights)
+        self.compaction_threshold = compaction_threshold
+        self.cache_size = cache_size
+        self.version = 0
+
+        self.user_ids = list(user_ids)
+        self.product_ids = list(product_ids)
+        self.user_index = {user_id: i for i, user_id in enumerate(self.user_ids)}
+        self.product_index = {product_id: i for i, product_id in enumerate(self.product_ids)}
+
+        self._base = sparse.csr_matrix(matrix, dtype=self.dtype)
+        self._base.sort_indices()
+        self._row_sq_norms = squared_row_norms(self._base)
+        self._pending: Dict[int, Dict[int, float]] = {}
+        self._pending_count = 0
+        self._diff: Optional[sparse.csr_matrix] = None
+        self._dot_cache: "OrderedDict[int, np.ndarray]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._compaction_stop: Optional[threading.Event] = None
+
+    @classmethod
+    def from_triples(cls, user_ids: List[int], product_ids: List[str], triples: Iterable[Tuple[int, str, str]],
+                     weights: Optional[Dict[str, int]] = None, budget: Optional[MemoryBudget] = None,
+                     **kwargs) -> "InteractionMatrix":
+        """
+        Builds the model from `(user_id, product_id, interaction_type)` tuples.
+
+        Interactions referencing unknown customers or products are ignored, like in the original
+        list-based matrix. The tuples are consumed `budget.chunk_size` at a time into int32 row and column
+        arrays and an array of weights, so a streamed input is never held in memory as Python objects. A
+        repeated (user, product) pair keeps the weight of its last interaction.
+
+        Args:
+            user_ids (List[int]): Customer ID of every row.
+            product_ids (List[str]): Product ID of every column.
+            triples (Iterable[Tuple[int, str, str]]): Interactions to load.
+            weights (Optional[Dict[str, int]]): Weight of each interaction type.
+            budget (Optional[MemoryBudget]): Sets the chunk size; the configured budget by default.
+
+        Returns:
+            InteractionMatrix: The built model.
+        """
+        weights = weights or DEFAULT_INTERACTION_WEIGHTS
+        budget = budget or MemoryBudget()
+        dtype = weight_dtype(weights)
+        user_index = {user_id: i for i, user_id in enumerate(user_ids)}
+        product_index = {product_id: i for i, product_id in enumerate(product_ids)}
+
+        rows, cols, values = [], [], []
+        for chunk in chunks(triples, budget.chunk_size):
+            chunk_rows = np.fromiter((user_index.get(user_id, -1) for user_id, _, _ in chunk), dtype=INDEX_DTYPE, count=len(chunk))
+            chunk_cols = np.fromiter((product_index.get(product_id, -1) for _, product_id, _ in chunk), dtype=INDEX_DTYPE, count=len(chunk))
+            chunk_values = np.fromiter((weights.get(interaction_type, 0) for _, _, interaction_type in chunk), dtype=dtype, count=len(chunk))
+            known = (chunk_rows >= 0) & (chunk_cols >= 0)
+            rows.append(chunk_rows[known])
+            cols.append(chunk_cols[known])
+            values.append(chunk_values[known])
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=INDEX_DTYPE)
+        cols = np.concatenate(cols) if cols else np.zeros(0, dtype=INDEX_DTYPE)
+        values = np.concatenate(values) if values else np.zeros(0, dtype=dtype)
+
+        # Keep the last occurrence of every cell; the unique keys also come out in row-major order
+        keys = rows.astype(np.int64) * max(len(product_ids), 1) + cols
+        _, last = np.unique(keys[::-1], return_index=True)
+        last = keys.size - 1 - last
+        matrix = sparse.csr_matrix((values[last], (rows[last], cols[last])), shape=(len(user_ids), len(product_ids)), dtype=dtype)
+        matrix.eliminate_zeros()
+        return cls(user_ids, product_ids, matrix, weights=weights, **kwargs)
+
+    @classmethod
+    def from_session(cls, session: Session, weights: Optional[Dict[str, int]] = None, budget: Optional[MemoryBudget] = None,
+                     until: Optional[datetime] = None, **kwargs) -> "InteractionMatrix":
+        """
+        Builds the model from the database with three column queries; the interactions are streamed
+        when loading them at once would exceed the memory budget.
+
+        Args:
+            session (Session): The SQLAlchemy session used for database operations.
+            weights (Optional[Dict[str, int]]): Weight of each interaction type.
+            budget (Optional[MemoryBudget]): Memory budget of the build; the configured one by default.
+            until (Optional[datetime]): Only interactions at or before this time.
+
+        Returns:
+            InteractionMatrix: The built model.
+        """
+        budget = budget or MemoryBudget()
+        user_ids = CustomerRepository(session).get_all_ids()
+        product_ids = ProductRepository(session).get_all_ids()
+        triples = budget.interaction_triples(session, until)
+        return cls.from_triples(user_ids, product_ids, triples, weights=weights, budget=budget, **kwargs)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self._base.shape
+
+    @property
+    def pending_updates(self) -> int:
+        return self._pending_count
+
+    def get_weight(self, row: int, col: int) -> float:
+        """
+        Returns the current value of a cell, including pending updates.
+        """
+        pending_row = self._pending.get(row)
+        if pending_row is not None and col in pending_row:
+            return pending_row[col]
+        return self._base_value(row, col)
+
+    def user_row(self, row: int) -> np.ndarray:
+        """
+        Returns the dense interaction row of a user, including pending updates.
+        """
+        with self._lock:
+            values = self._base.getrow(row).toarray().ravel().astype(np.float64)
+            for col, value in self._pending.get(row, {}).items():
+                values[col] = value
+            return values
+
+    def row_norm(self, row: int) -> float:
+        return float(np.sqrt(max(self._row_sq_norms[row], 0.0)))
+
+    def user_similarities(self, row: int) -> np.ndarray:
+        """
+        Computes the cosine similarity between a user and every user (itself included).
+
+        Dot products are served from the neighbour cache when available; norms are always current.
+
+        Args:
+            row (int): Row of the user.
+
+        Returns:
+            np.ndarray: One similarity per row of the matrix.
+        """
+        with self._lock:
+            dots = self._dot_cache.get(row)
+            if dots is None:
+                dots = self.matvec(self.user_row(row))
+                self._dot_cache[row] = dots
+                if len(self._dot_cache) > self.cache_size:
+                    self._dot_cache.popitem(last=False)
+            else:
+                self._dot_cache.move_to_end(row)
+
+            norms = np.sqrt(np.maximum(self._row_sq_norms, 0.0)) * self.row_norm(row)
+            similarities = np.zeros_like(dots)
+            np.divide(dots, norms, out=similarities, where=norms > 0)
+            return similarities
+
+    def matvec(self, vector: np.ndarray) -> np.ndarray:
+        """
+        Computes `M @ vector` over users, including pending updates.
+        """
+        with self._lock:
+            return self._base @ vector + self._pending_diff() @ vector
+
+    def rmatvec(self, vector: np.ndarray) -> np.ndarray:
+        """
+        Computes `M.T @ vector` over products, including pending updates.
+        """
+        with self._lock:
+            return self._base.T @ vector + self._pending_diff().T @ vector
+
+    def update(self, user_id: int, product_id: str, interaction_type: str) -> None:
+        """
+        Sets one cell to the weight of a new interaction, growing the matrix for unseen IDs.
+
+        Args:
+            user_id (int): ID of the customer.
+            product_id (str): ID of the product.
+            interaction_type (str): Type of interaction.
+        """
+        weight = float(self.weights.get(interaction_type, 0))
+        with self._lock:
+            row = self._ensure_user(user_id)
+            col = self._ensure_product(product_id)
+            old = self.get_weight(row, col)
+            delta = weight - old
+            if delta == 0:
+                return
+
+            if col not in self._pending.setdefault(row, {}):
+                self._pending_count += 1
+            self._pending[row][col] = weight
+            self._diff = None
+            self._row_sq_norms[row] += weight * weight - old * old
+
+            # Patch the cached dot products of other users; the updated user's own entry is recomputed lazily
+            self._dot_cache.pop(row, None)
+            for other, dots in self._dot_cache.items():
+                other_weight = self.get_weight(other, col)
+                if other_weight:
+                    dots[row] += other_weight * delta
+
+            self.version += 1
+            if self._pending_count >= self.compaction_threshold:
+                self.compact()
+
+    def on_interaction(self, event: InteractionEvent) -> None:
+        """
+        Repository event handler; see `attach`.
+        """
+        self.update(event.user_id, event.product_id, event.interaction_type)
+
+    def attach(self) -> "InteractionMatrix":
+        """
+        Subscribes the model to interactions created through `InteractionRepository`.
+
+        Returns:
+            InteractionMatrix: The model itself, for chaining.
+        """
+        repository_events.subscribe(INTERACTION_CREATED, self.on_interaction)
+        return self
+
+    def detach(self) -> None:
+        """
+        Stops receiving repository events and periodic compactions.
+        """
+        repository_events.unsubscribe(INTERACTION_CREATED, self.on_interaction)
+        if self._compaction_stop is not None:
+            self._compaction_stop.set()
+
+    def compact(self) -> None:
+        """
+        Folds pending updates into the CSR base.
+        """
+        with self._lock:
+            if not self._pending_count:
+                return
+            self._base = (self._base + self._pending_diff()).tocsr().astype(self.dtype)
+            self._base.eliminate_zeros()
+            self._base.sort_indices()
+            self._pending.clear()
+            self._pending_count = 0
+            self._diff = None
+            # Recompute norms from the compacted base to discard floating point drift
+            self._row_sq_norms = squared_row_norms(self._base)
+
+    def start_periodic_compaction(self, interval: float) -> None:
+        """
+        Compacts pending updates every `interval` seconds in a daemon thread until `detach` is called.
+
+        Args:
+            interval (float): Seconds between compactions.
+        """
+        if self._compaction_stop is not None and not self._compaction_stop.is_set():
+            return
+        stop = threading.Event()
+        self._compaction_stop = stop
+
+        def run():
+            while not stop.wait(interval):
+                self.compact()
+
+        threading.Thread(target=run, name="interaction-matrix-compaction", daemon=True).start()
+
+    def to_csr(self) -> sparse.csr_matrix:
+        """
+        Compacts pending updates and returns the CSR matrix; treat it as read-only.
+
+        Returns:
+            sparse.csr_matrix: Interaction weights, one row per customer.
+        """
+        with self._lock:
+            self.compact()
+            return self._base
+
+    def save(self, directory: str) -> str:
+        """
+        Compacts the model and pickles it into a directory, writing to a temporary file first.
+
+        Args:
+            directory (str): Target directory, created if needed.
+
+        Returns:
+            str: Path of the written file.
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, MATRIX_FILE)
+        with self._lock:
+            self.compact()
+            state = {
+                "user_ids": list(self.user_ids),
+                "product_ids": list(self.product_ids),
+                "matrix": self._base,
+                "weights": self.weights,
+                "compaction_threshold": self.compaction_threshold,
+                "cache_size": self.cache_size
+            }
+        with open(path + ".tmp", "wb") as file:
+            pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+        return path
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["InteractionMatrix"]:
+        """
+        Loads a model saved with `save`.
+
+        Args:
+            directory (str): Directory holding the model.
+
+        Returns:
+            Optional[InteractionMatrix]: The model, or None if the directory holds none.
+        """
+        path = os.path.join(directory, MATRIX_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as file:
+            state = pickle.load(file)
+        return cls(state["user_ids"], state["product_ids"], state["matrix"], weights=state["weights"],
+                   compaction_threshold=state["compaction_threshold"], cache_size=state["cache_size"])
+
+    def _base_value(self, row: int, col: int) -> float:
+        start, end = self._base.indptr[row], self._base.indptr[row + 1]
+        position = start + np.searchsorted(self._base.indices[start:end], col)
+        if position < end and self._base.indices[position] == col:
+            return float(self._base.data[position])
+        return 0.0
+
+    def _pending_diff(self) -> sparse.csr_matrix:
+        """
+        Returns the pending updates as a sparse `new - base` matrix, built lazily after each update.
+        """
+        if self._diff is None:
+            rows, cols, values = [], [], []
+            for row, entries in self._pending.items():
+                for col, value in entries.items():
+                    rows.append(row)
+                    cols.append(col)
+                    values.append(value - self._base_value(row, col))
+            self._diff = sparse.csr_matrix((values, (rows, cols)), shape=self._base.shape, dtype=np.float64)
+        return self._diff
+
+    def _ensure_user(self, user_id: int) -> int:
+        row = self.user_index.get(user_id)
+        if row is None:
+            row = len(self.user_ids)
+            self.user_ids.append(user_id)
+            self.user_index[user_id] = row
+            self._resize(row + 1, self.shape[1])
+            self._row_sq_norms = np.append(self._row_sq_norms, 0.0)
+            for other in list(self._dot_cache):
+                self._dot_cache[other] = np.append(self._dot_cache[other], 0.0)
+        return row
+
+    def _ensure_product(self, product_id: str) -> int:
+        col = self.product_index.get(product_id)
+        if col is None:
+            col = len(self.product_ids)
+            self.product_ids.append(product_id)
+            self.product_index[product_id] = col
+            self._resize(self.shape[0], col + 1)
+        return col
+
+    def _resize(self, n_rows: int, n_cols: int) -> None:
+        self._base.resize((n_rows, n_cols))
+        self._diff = None
@@ -0,0 +1,152 @@
+import os
+import pickle
+from typing import List, Optional, Tuple
+import numpy as np
+from scipy import sparse
+from data_access.config import ITEM_NEIGHBOURS
+from filters.interaction_matrix import InteractionMatrix
+from filters.memory_budget import INDEX_DTYPE, VALUE_DTYPE, MemoryBudget, csr_nbytes
+from services.logger import Logger
+
+NEIGHBOURS_FILE = "item_neighbours.pkl"
+
+
+class ItemNeighbours:
+    """
+    Precomputed item-to-item table: the `k` products most similar to each product, by cosine similarity of
+    their columns in the interaction matrix (products interacted with by the same users).
+
+    The table is read-only and belongs to one model version; products added after the build have no
+    neighbours until the next one. `neighbours` has the same signature as `CoInteractionCounter.neighbours`,
+    so either can back a `SessionFilter`.
+
+    Attributes:
+        product_ids (List[str]): Product ID of every row.
+        product_index (Dict[str, int]): Row of each product ID.
+        matrix (sparse.csr_matrix): Products x products similarities, at most `k` per row, highest first.
+    """
+    def __init__(self, product_ids: List[str], matrix: sparse.csr_matrix) -> None:
+        self.logger = Logger()
+        self.product_ids = list(product_ids)
+        self.product_index = {product_id: i for i, product_id in enumerate(self.product_ids)}
+        self.matrix = matrix
+
+    def __len__(self) -> int:
+        return len(self.product_ids)
+
+    @classmethod
+    def from_matrix(cls, interaction_matrix: InteractionMatrix, k: int = ITEM_NEIGHBOURS,
+                    budget: Optional[MemoryBudget] = None) -> "ItemNeighbours":
+        """
+        Computes the table from an interaction matrix.
+
+        The similarities of all product pairs are computed as one sparse product when it fits the memory
+        budget, otherwise for as many products at a time as the budget allows; only the top `k` of each row
+        are kept.
+
+        Args:
+            interaction_matrix (InteractionMatrix): The collaborative model.
+            k (int): Neighbours kept per product.
+            budget (Optional[MemoryBudget]): Memory budget of the build; the configured one by default.
+
+        Returns:
+            ItemNeighbours: The table.
+        """
+        budget = budget or MemoryBudget()
+        matrix = interaction_matrix.to_csr()
+        n_products = matrix.shape[1]
+
+        # Normalize the product columns, so dot products are cosine similarities
+        data = matrix.data.astype(np.float64)
+        norms = np.sqrt(np.bincount(matrix.indices, weights=data * data, minlength=n_products))
+        scale = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+        users = sparse.csr_matrix((data * scale[matrix.indices], matrix.indices, matrix.indptr), shape=matrix.shape)
+        products = users.T.tocsr()
+
+        # A user with d interactions contributes at most d * d non-zeros to the product
+        degrees = np.diff(matrix.indptr).astype(np.int64)
+        bound = int((degrees * degrees).sum())
+        nbytes = csr_nbytes(n_products, bound, np.float64)
+        step = n_products
+        if not budget.fits("Building item neighbours", nbytes):
+            step = min(budget.chunk_size, max(1, int(n_products * budget.limit / nbytes)))
+
+        indptr = np.zeros(n_products + 1, dtype=np.int64)
+        indices, values = [], []
+        for first in range(0, n_products, max(step, 1)):
+            similarities = (products[first:first + step] @ users).tocsr()
+            for i in range(similarities.shape[0]):
+                start, end = similarities.indptr[i], similarities.indptr[i + 1]
+                columns, scores = similarities.indices[start:end], similarities.data[start:end]
+                keep = (columns != first + i) & (scores > 0)
+                columns, scores = columns[keep], scores[keep]
+                if columns.size > k:
+                    top = np.argpartition(-scores, k)[:k]
+                    columns, scores = columns[top], scores[top]
+                order = np.argsort(-scores, kind="stable")
+                indices.append(columns[order])
+                values.append(scores[order])
+                indptr[first + i + 1] = columns.size
+        table = sparse.csr_matrix((
+            np.concatenate(values).astype(VALUE_DTYPE) if values else np.zeros(0, dtype=VALUE_DTYPE),
+            np.concatenate(indices).astype(INDEX_DTYPE) if indices else np.zeros(0, dtype=INDEX_DTYPE),
+            np.cumsum(indptr).astype(INDEX_DTYPE)
+        ), shape=(n_products, n_products))
+
+        neighbours = cls(interaction_matrix.product_ids, table)
+        neighbours.logger.info(f"Built item neighbours for {n_products} products ({table.nnz} pairs).")
+        return neighbours
+
+    def neighbours(self, product_id: str, n: int = 20) -> List[Tuple[str, float]]:
+        """
+        Returns the products most similar to a product.
+
+        Args:
+            product_id (str): ID of the product.
+            n (int): Maximum number of neighbours.
+
+        Returns:
+            List[Tuple[str, float]]: `(product_id, similarity)` pairs, highest first; empty for unknown products.
+        """
+        row = self.product_index.get(product_id)
+        if row is None:
+            return []
+        start = self.matrix.indptr[row]
+        end = min(self.matrix.indptr[row + 1], start + n)
+        return [(self.product_ids[column], score)
+                for column, score in zip(self.matrix.indices[start:end].tolist(), self.matrix.data[start:end].tolist())]
+
+    def save(self, directory: str) -> str:
+        """
+        Pickles the table into a directory, writing to a temporary file first.
+
+        Args:
+            directory (str): Target directory, created if needed.
+
+        Returns:
+            str: Path of the written file.
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, NEIGHBOURS_FILE)
+        with open(path + ".tmp", "wb") as file:
+            pickle.dump({"product_ids": self.product_ids, "matrix": self.matrix}, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+        return path
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["ItemNeighbours"]:
+        """
+        Loads a table saved with `save`.
+
+        Args:
+            directory (str): Directory holding the table.
+
+        Returns:
+            Optional[ItemNeighbours]: The table, or None if the directory holds none.
+        """
+        path = os.path.join(directory, NEIGHBOURS_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as file:
+            state = pickle.load(file)
+        return cls(state["product_ids"], state["matrix"])
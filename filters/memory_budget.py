@@ -0,0 +1,103 @@
+from datetime import datetime
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+from sqlalchemy.orm import Session
+from data_access.config import MODEL_BUILD_CHUNK_SIZE, MODEL_MEMORY_BUDGET
+from data_access.db.repositories import InteractionRepository
+from services.logger import Logger
+
+# Dtypes of the stored models: similarities and TF-IDF values, sparse indices and row pointers
+VALUE_DTYPE = np.float32
+INDEX_DTYPE = np.int32
+
+# Approximate size of one interaction held as a Python `(user_id, product_id, interaction_type)` tuple,
+# counting the tuple, its list slot and the product ID string
+TRIPLE_BYTES = 240
+
+
+def weight_dtype(weights: Dict[str, float]) -> np.dtype:
+    """
+    Smallest dtype that holds every interaction weight exactly: uint8 for integer weights up to 255
+    (the defaults are 1 to 5), float32 otherwise.
+    """
+    values = list(weights.values())
+    if all(float(value).is_integer() and 0 <= value <= np.iinfo(np.uint8).max for value in values):
+        return np.dtype(np.uint8)
+    return np.dtype(np.float32)
+
+
+def csr_nbytes(n_rows: int, nnz: int, data_dtype=VALUE_DTYPE, index_dtype=INDEX_DTYPE) -> int:
+    """
+    Size of a CSR matrix: values and column indices per stored entry, plus the row pointers.
+    """
+    index_size = np.dtype(index_dtype).itemsize
+    return nnz * (np.dtype(data_dtype).itemsize + index_size) + (n_rows + 1) * index_size
+
+
+def chunks(items: Iterable, size: int) -> Iterator[List]:
+    """
+    Splits any iterable, including a database stream, into lists of at most `size` items.
+    """
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class MemoryBudget:
+    """
+    Memory limit of a model build.
+
+    Build steps call `fits` with an estimate of what they are about to allocate, before allocating it.
+    Within the budget they build in one pass; over it they stream their input from the database or
+    build their matrices `chunk_size` rows at a time. That is slower, but the peak stays bounded by the
+    chunk instead of the whole population. Estimates cover the large arrays, not Python overhead.
+    """
+    def __init__(self, limit: Optional[int] = MODEL_MEMORY_BUDGET, chunk_size: int = MODEL_BUILD_CHUNK_SIZE) -> None:
+        """
+        Initializes the budget.
+
+        Args:
+            limit (Optional[int]): Bytes a build step may allocate; None for no limit.
+            chunk_size (int): Rows read or built at once by steps over the budget.
+        """
+        self.logger = Logger()
+        self.limit = limit
+        self.chunk_size = chunk_size
+
+    def fits(self, step: str, nbytes: int) -> bool:
+        """
+        Checks whether a build step can allocate `nbytes` at once.
+
+        Args:
+            step (str): Name of the step, for the log.
+            nbytes (int): Estimated footprint of the step.
+
+        Returns:
+            bool: True when there is no limit or the estimate is within it.
+        """
+        if self.limit is None or nbytes <= self.limit:
+            return True
+        self.logger.warn(f"{step} needs about {nbytes / 2 ** 20:.0f} MiB, over the budget of {self.limit / 2 ** 20:.0f} MiB; "
+                         f"building in chunks of {self.chunk_size}.")
+        return False
+
+    def interaction_triples(self, session: Session, until: Optional[datetime] = None) -> Iterable[Tuple[int, str, str]]:
+        """
+        Every interaction as a `(user_id, product_id, interaction_type)` tuple: loaded as one list when it
+        fits, otherwise streamed from the database `chunk_size` rows at a time, oldest first.
+
+        A streamed result can be iterated only once.
+
+        Args:
+            session (Session): The SQLAlchemy session used for database operations.
+            until (Optional[datetime]): Only interactions at or before this time.
+        """
+        repository = InteractionRepository(session)
+        if self.fits("Loading interactions", repository.count() * TRIPLE_BYTES):
+            return repository.get_interaction_triples(until=until)
+        return ((user_id, product_id, interaction_type) for user_id, product_id, interaction_type, _
+                in repository.get_interaction_stream(batch_size=self.chunk_size, until=until))
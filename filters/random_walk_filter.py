@@ -0,0 +1,221 @@
+import threading
+import weakref
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from scipy import sparse
+from sqlalchemy.orm import Session
+from data_access.db.repositories import CustomerRepository, InteractionRepository, ProductRepository
+from filters.filter_base import FilterBase
+from filters.interaction_matrix import DEFAULT_INTERACTION_WEIGHTS, InteractionMatrix
+from models.context_model import Context
+from models.filter_result_model import FilterResultModel
+from models.recommendation_model import RecommendationModel
+from services.cold_start_service import ColdStartService
+
+
+class RandomWalkFilter(FilterBase):
+    """
+    Ranks products by a personalised random walk with restart over the customer–product graph.
+
+    The interaction matrix is read as a weighted bipartite graph. A walker starts at the user, moves to a
+    product with probability proportional to the interaction weight, then to a customer of that product,
+    and so on, jumping back to the user with probability `restart` after every round trip. The score of a
+    product is how often the walker visits it. Unlike `CollaborativeFilter`, products reached through
+    several hops contribute, and each iteration costs O(edges) instead of users x products.
+    """
+
+    def __init__(self, session: Session, model: Optional[InteractionMatrix] = None,
+                 cold_start: Optional[ColdStartService] = None, weights: Optional[Dict[str, int]] = None,
+                 restart: float = 0.3, max_iterations: int = 30, tolerance: float = 1e-6) -> None:
+        """
+        Initializes the RandomWalkFilter with the given database session.
+
+        Args:
+            session (Session): The SQLAlchemy session used for database operations.
+            model (Optional[InteractionMatrix]): Shared, incrementally updated interaction matrix. When omitted,
+                                                 the matrix is rebuilt from the database on every call.
+            cold_start (Optional[ColdStartService]): Popularity lists served to users without interactions.
+            weights (Optional[Dict[str, int]]): Weight of each interaction type when the matrix is built per call.
+            restart (float): Probability of jumping back to the user after each user -> product -> user step.
+            max_iterations (int): Maximum number of power iterations.
+            tolerance (float): The iteration stops once the L1 change of the user distribution is below it.
+
+        Raises:
+            ValueError: If `restart` is not in (0, 1].
+        """
+        super().__init__()
+        if not 0 < restart <= 1:
+            raise ValueError(f"restart must be in (0, 1], got {restart}")
+        self.session = session
+        self.model = model
+        self.cold_start = cold_start
+        self.weights = weights or DEFAULT_INTERACTION_WEIGHTS
+        self.restart = restart
+        self.max_iterations = max_iterations
+        self.tolerance = tolerance
+        self.customer_repository = CustomerRepository(session)
+        self.interaction_repository = InteractionRepository(session)
+        self.product_repository = ProductRepository(session)
+        self._transitions: Optional[Tuple[weakref.ref, int, sparse.csr_matrix, sparse.csr_matrix]] = None
+        self._precomputed: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        self._lock = threading.Lock()
+
+    def apply_filter(self, context: Context) -> FilterResultModel:
+        """
+        Ranks the context products the user has not interacted with by random-walk visit probability.
+
+        A top-N precomputed with `precompute` is used when the user has one.
+
+        Args:
+            context (Context): The context containing user ID, product list, and limit for recommendations.
+
+        Returns:
+            FilterResultModel: The result model containing user ID and a list of recommended products.
+        """
+        self.logger.info(f"Applying random-walk filtering to {len(context.products)} products for user {context.userId} with limit {context.limit}.")
+
+        interaction_matrix = self.model if self.model is not None else self._build_interaction_matrix()
+        user_index = interaction_matrix.user_index.get(context.userId)
+        if user_index is None or interaction_matrix.row_norm(user_index) == 0:
+            self.logger.warn(f"No interactions found for user {context.userId}.")
+            return FilterResultModel(user_id=context.userId, recommendations=self._get_default_recommendations(context))
+
+        # Columns of the context products the user has not interacted with yet
+        columns = [interaction_matrix.product_index.get(product.unique_id) for product in context.products]
+        columns = np.array([col for col in columns if col is not None], dtype=np.int64)
+        seen = interaction_matrix.user_row(user_index)
+        columns = columns[seen[columns] == 0] if columns.size else columns
+
+        precomputed = self._precomputed.get(context.userId)
+        if precomputed is not None:
+            cols, values = precomputed
+            keep = np.isin(cols, columns)
+            candidates, candidate_scores = cols[keep], values[keep]
+        else:
+            scores = self.walk(interaction_matrix, np.array([user_index]))[:, 0]
+            candidates = columns[scores[columns] > 0]
+            candidate_scores = scores[candidates]
+        if candidates.size == 0:
+            return FilterResultModel(user_id=context.userId, recommendations=[])
+
+        # Sort by visit probability and normalize the scores to [0, 1]
+        order = np.argsort(-candidate_scores, kind="stable")[:context.limit]
+        max_score = candidate_scores.max()
+        product_ids = interaction_matrix.product_ids
+        return FilterResultModel(user_id=context.userId, recommendations=[
+            RecommendationModel(product_id=product_ids[candidates[i]], similarity_score=float(candidate_scores[i] / max_score))
+            for i in order
+        ])
+
+    def walk(self, interaction_matrix: InteractionMatrix, user_rows: np.ndarray) -> np.ndarray:
+        """
+        Runs the random walk with restart for several users at once with sparse power iteration.
+
+        Each column of the state is the distribution of one walker over the users. An iteration moves it
+        to the products and back, then mixes in the restart vector; the loop stops when no column changes
+        by more than `tolerance` (L1) or after `max_iterations`.
+
+        Args:
+            interaction_matrix (InteractionMatrix): The matrix of user interactions.
+            user_rows (np.ndarray): Matrix rows of the users the walks start from.
+
+        Returns:
+            np.ndarray: Products x users array with the probability that each walker is at each product.
+        """
+        to_products, to_users = self._get_transitions(interaction_matrix)
+        restart = np.zeros((to_products.shape[0], user_rows.size))
+        restart[user_rows, np.arange(user_rows.size)] = 1.0
+
+        users = restart
+        iteration, change = 0, np.inf
+        for iteration in range(1, self.max_iterations + 1):
+            products = to_products.T @ users
+            updated = (1 - self.restart) * (to_users.T @ products) + self.restart * restart
+            change = np.abs(updated - users).sum(axis=0).max()
+            users = updated
+            if change < self.tolerance:
+                break
+        self.logger.info(f"Random walk for {user_rows.size} users stopped after {iteration} iterations (last change {change:.2e}).")
+        return to_products.T @ users
+
+    def precompute(self, top_n: int = 100, user_ids: Optional[List[int]] = None, batch_size: int = 64) -> int:
+        """
+        Precomputes the top-N products of each user so `apply_filter` does not walk at request time.
+
+        Users are walked in batches; the lists exclude the products each user had interacted with.
+
+        Args:
+            top_n (int): Number of products kept per user.
+            user_ids (Optional[List[int]]): Users to precompute; every user with interactions by default.
+            batch_size (int): Number of users walked at once.
+
+        Returns:
+            int: Number of users with a precomputed list.
+        """
+        interaction_matrix = self.model if self.model is not None else self._build_interaction_matrix()
+        matrix = interaction_matrix.to_csr()
+        if user_ids is None:
+            rows = np.flatnonzero(np.diff(matrix.indptr) > 0)
+        else:
+            rows = np.array([interaction_matrix.user_index[user_id] for user_id in user_ids
+                             if user_id in interaction_matrix.user_index], dtype=np.int64)
+
+        precomputed = {}
+        for start in range(0, rows.size, batch_size):
+            batch = rows[start:start + batch_size]
+            scores = self.walk(interaction_matrix, batch)
+            for i, row in enumerate(batch):
+                user_scores = scores[:, i].copy()
+                user_scores[matrix.indices[matrix.indptr[row]:matrix.indptr[row + 1]]] = 0.0
+                candidates = np.flatnonzero(user_scores > 0)
+                if candidates.size > top_n:
+                    candidates = candidates[np.argpartition(-user_scores[candidates], top_n)[:top_n]]
+                precomputed[interaction_matrix.user_ids[row]] = (candidates, user_scores[candidates])
+
+        with self._lock:
+            self._precomputed = precomputed
+        self.logger.info(f"Precomputed random-walk top-{top_n} for {len(precomputed)} users.")
+        return len(precomputed)
+
+    def _get_transitions(self, interaction_matrix: InteractionMatrix) -> Tuple[sparse.csr_matrix, sparse.csr_matrix]:
+        """
+        Row-stochastic user -> product and product -> user transition matrices, rebuilt when the matrix changes.
+        """
+        with self._lock:
+            # A weak reference rather than the id: matrices built per call without a model are freed, and
+            # a new one may reuse the id of the cached one
+            if self._transitions is not None:
+                cached, version, to_products, to_users = self._transitions
+                if cached() is interaction_matrix and version == interaction_matrix.version:
+                    return to_products, to_users
+
+            matrix = interaction_matrix.to_csr()
+            to_products = self._normalize_rows(matrix)
+            to_users = self._normalize_rows(matrix.T.tocsr())
+            self._transitions = (weakref.ref(interaction_matrix), interaction_matrix.version, to_products, to_users)
+            return to_products, to_users
+
+    def _normalize_rows(self, matrix: sparse.csr_matrix) -> sparse.csr_matrix:
+        sums = np.asarray(matrix.sum(axis=1), dtype=np.float64).ravel()
+        inverse = np.zeros_like(sums)
+        np.divide(1.0, sums, out=inverse, where=sums > 0)
+        return sparse.diags(inverse) @ matrix
+
+    def _get_default_recommendations(self, context: Context) -> List[RecommendationModel]:
+        """
+        Recommendations for users without interactions: the cold-start popularity list of the user's
+        segment when available, otherwise the first products of the context.
+        """
+        if self.cold_start is not None:
+            recommendations = self.cold_start.recommend(self.customer_repository.get_by_id(context.userId), 50)
+            if recommendations:
+                return recommendations
+        return [RecommendationModel(x.unique_id, 1) for x in context.products[:50]]
+
+    def _build_interaction_matrix(self) -> InteractionMatrix:
+        return InteractionMatrix.from_triples(
+            self.customer_repository.get_all_ids(),
+            self.product_repository.get_all_ids(),
+            self.interaction_repository.get_interaction_triples(),
+            weights=self.weights
+        )
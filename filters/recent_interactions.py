@@ -0,0 +1,124 @@
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Deque, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from data_access.config import SESSION_GAP, SESSION_HISTORY_SIZE, SESSION_MAX_USERS
+from data_access.db.events import INTERACTION_CREATED, InteractionEvent, repository_events
+from data_access.db.repositories import InteractionRepository
+from services.logger import Logger
+
+
+class RecentInteractions:
+    """
+    The current browsing session of each user: a ring buffer of their last `history_size` interactions.
+
+    The buffers are fed by repository events, so an interaction is visible to the next request as soon as
+    `create_interaction` commits. An interaction more than `session_gap` seconds after the previous one
+    of the same user starts a new session and clears the buffer, and a session idle for longer than that
+    reads as empty until the user's next interaction. Only the `max_users` most recently
+    active users are kept, least recently active evicted first, so memory stays bounded. Reads never touch
+    the database.
+    """
+    def __init__(self, history_size: int = SESSION_HISTORY_SIZE, session_gap: Optional[float] = SESSION_GAP,
+                 max_users: int = SESSION_MAX_USERS, expire: bool = True) -> None:
+        """
+        Initializes empty buffers.
+
+        Args:
+            history_size (int): Interactions kept per user.
+            session_gap (Optional[float]): Seconds of inactivity after which a new session starts; None to
+                                           keep the last interactions regardless of their age.
+            max_users (int): Users whose sessions are kept.
+            expire (bool): Whether idle sessions read as empty; replays of past interactions, e.g. offline
+                           evaluation, keep each user's last session instead.
+        """
+        self.logger = Logger()
+        self.history_size = history_size
+        self.session_gap = session_gap
+        self.max_users = max_users
+        self.expire = expire
+        self._sessions: "OrderedDict[int, Deque[Tuple[str, str, datetime]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def build(self, session: Session, since: Optional[datetime] = None) -> "RecentInteractions":
+        """
+        Replays the `interactions` table in chronological order, e.g. to evaluate offline or to restore
+        the sessions after a restart.
+
+        Args:
+            session (Session): The SQLAlchemy session used for database operations.
+            since (Optional[datetime]): Only interactions after this time.
+
+        Returns:
+            RecentInteractions: The buffers themselves.
+        """
+        count = 0
+        for user_id, product_id, interaction_type, time_stamp in InteractionRepository(session).get_interaction_stream(since):
+            self.add(user_id, product_id, interaction_type, time_stamp)
+            count += 1
+        self.logger.info(f"Replayed {count} interactions into the sessions of {len(self._sessions)} users.")
+        return self
+
+    def add(self, user_id: int, product_id: str, interaction_type: str, time_stamp: Optional[datetime] = None) -> None:
+        """
+        Appends an interaction to the user's session, dropping the oldest one when the buffer is full.
+
+        Args:
+            user_id (int): ID of the user.
+            product_id (str): ID of the product.
+            interaction_type (str): Type of interaction.
+            time_stamp (Optional[datetime]): When the interaction happened; now by default.
+        """
+        time_stamp = time_stamp or datetime.now()
+        with self._lock:
+            buffer = self._sessions.get(user_id)
+            if buffer is None:
+                buffer = self._sessions[user_id] = deque(maxlen=self.history_size)
+                if len(self._sessions) > self.max_users:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(user_id)
+                if self.session_gap is not None and buffer and (time_stamp - buffer[-1][2]).total_seconds() > self.session_gap:
+                    buffer.clear()
+            buffer.append((product_id, interaction_type, time_stamp))
+
+    def recent(self, user_id: int, now: Optional[datetime] = None) -> List[Tuple[str, str, datetime]]:
+        """
+        Returns the user's current session as `(product_id, interaction_type, time_stamp)` tuples, oldest
+        first; empty for users without one or whose last interaction is more than `session_gap` seconds
+        before `now` (the current time by default).
+        """
+        with self._lock:
+            buffer = self._sessions.get(user_id)
+            if not buffer:
+                return []
+            if self.expire and self.session_gap is not None and \
+                    ((now or datetime.now()) - buffer[-1][2]).total_seconds() > self.session_gap:
+                return []
+            return list(buffer)
+
+    def on_interaction(self, event: InteractionEvent) -> None:
+        """
+        Repository event handler; see `attach`.
+        """
+        self.add(event.user_id, event.product_id, event.interaction_type, event.time_stamp)
+
+    def attach(self) -> "RecentInteractions":
+        """
+        Subscribes the buffers to interactions created through `InteractionRepository`.
+
+        Returns:
+            RecentInteractions: The buffers themselves, for chaining.
+        """
+        repository_events.subscribe(INTERACTION_CREATED, self.on_interaction)
+        return self
+
+    def detach(self) -> None:
+        repository_events.unsubscribe(INTERACTION_CREATED, self.on_interaction)
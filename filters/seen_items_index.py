@@ -0,0 +1,172 @@
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from sqlalchemy.orm import Session
+from data_access.db.events import INTERACTION_CREATED, InteractionEvent, repository_events
+from data_access.db.repositories import InteractionRepository, ProductRepository
+from services.logger import Logger
+
+EMPTY = np.empty(0, dtype=np.int32)
+
+# Product lists whose translation `align` keeps; each entry holds its list alive, so old ones are dropped
+ALIGNMENTS_KEPT = 8
+
+
+class SeenItemsIndex:
+    """
+    The products each user has interacted with, as a sorted int32 array of product columns per user.
+
+    Filters use it to drop already seen products with one vectorized lookup instead of loading the
+    user's interactions from the database and hashing every product ID against a set. Columns are
+    positions in the index's own product list. `align` translates another product list (the rows of a
+    content model, the columns of an interaction matrix) into them once per list. A new interaction
+    inserts one entry into the user's array; arrays are replaced, never modified, so readers need no lock.
+    """
+    def __init__(self, product_ids: Optional[List[str]] = None) -> None:
+        """
+        Initializes an empty index.
+
+        Args:
+            product_ids (Optional[List[str]]): Initial product list; `build` appends the rest of the catalog.
+        """
+        self.logger = Logger()
+        self.product_ids: List[str] = list(product_ids or [])
+        self.product_index: Dict[str, int] = {product_id: i for i, product_id in enumerate(self.product_ids)}
+        self._seen: Dict[int, np.ndarray] = {}
+        self._alignments: Dict[int, Tuple[List[str], int, int, np.ndarray]] = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._seen
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def build(self, session: Session) -> "SeenItemsIndex":
+        """
+        Loads every `(user, product)` pair from the database, sorting all of them at once.
+
+        Args:
+            session (Session): The SQLAlchemy session used for database operations.
+
+        Returns:
+            SeenItemsIndex: The index itself.
+        """
+        catalog = ProductRepository(session).get_all_ids()
+        pairs = InteractionRepository(session).get_interaction_pairs()
+
+        with self._lock:
+            for product_id in catalog:
+                self._column(product_id)
+            users = np.fromiter((user_id for user_id, _ in pairs), dtype=np.int64, count=len(pairs))
+            columns = np.fromiter((self._column(product_id) for _, product_id in pairs), dtype=np.int32, count=len(pairs))
+            order = np.lexsort((columns, users))
+            users, columns = users[order], columns[order]
+            # Drop repeated pairs, then split the columns at every change of user
+            keep = np.concatenate([[True], (users[1:] != users[:-1]) | (columns[1:] != columns[:-1])]) if users.size else np.zeros(0, dtype=bool)
+            users, columns = users[keep], columns[keep]
+            starts = np.flatnonzero(np.concatenate([[True], users[1:] != users[:-1]])) if users.size else np.zeros(0, dtype=np.int64)
+            seen = {int(users[start]): chunk for start, chunk in zip(starts, np.split(columns, starts[1:]))}
+            # Interactions recorded by events while loading are kept
+            for user_id, chunk in self._seen.items():
+                seen[user_id] = np.union1d(seen[user_id], chunk).astype(np.int32) if user_id in seen else chunk
+            self._seen = seen
+        self.logger.info(f"Built seen-items index for {len(seen)} users from {len(pairs)} interactions.")
+        return self
+
+    def add(self, user_id: int, product_id: str) -> None:
+        """
+        Records that a user interacted with a product; repeated pairs are ignored.
+        """
+        with self._lock:
+            column = self._column(product_id)
+            seen = self._seen.get(user_id, EMPTY)
+            position = int(np.searchsorted(seen, column))
+            if position < seen.size and seen[position] == column:
+                return
+            self._seen[user_id] = np.insert(seen, position, column)
+
+    def seen(self, user_id: int) -> np.ndarray:
+        """
+        Returns the sorted columns of the products the user interacted with; empty for unknown users.
+        """
+        return self._seen.get(user_id, EMPTY)
+
+    def columns(self, product_ids: Iterable[str]) -> np.ndarray:
+        """
+        Returns the column of each product ID, -1 for products the index has never seen.
+        """
+        product_index = self.product_index
+        return np.array([product_index.get(product_id, -1) for product_id in product_ids], dtype=np.int32)
+
+    def align(self, product_ids: List[str]) -> np.ndarray:
+        """
+        Translates positions in another product list into columns of the index.
+
+        The translation is cached per list and rebuilt when either list grows, so a long-lived list such
+        as `InteractionMatrix.product_ids` is mapped once rather than on every request. The cache keeps a
+        reference to the list, so the id of a freed list cannot be reused by a new one (e.g. after a model
+        swap) and served its stale translation.
+
+        Args:
+            product_ids (List[str]): The other product list.
+
+        Returns:
+            np.ndarray: Column of the product at each position, -1 for unknown products.
+        """
+        key = id(product_ids)
+        cached = self._alignments.get(key)
+        if cached is not None and cached[0] is product_ids and cached[1] == len(product_ids) and cached[2] == len(self.product_ids):
+            return cached[3]
+        translation = self.columns(product_ids)
+        with self._lock:
+            self._alignments.pop(key, None)
+            self._alignments[key] = (product_ids, len(translation), len(self.product_ids), translation)
+            while len(self._alignments) > ALIGNMENTS_KEPT:
+                del self._alignments[next(iter(self._alignments))]
+        return translation
+
+    def unseen(self, user_id: int, columns: np.ndarray) -> np.ndarray:
+        """
+        Exclusion mask: True for the columns the user has not interacted with.
+
+        Args:
+            user_id (int): ID of the user.
+            columns (np.ndarray): Columns of the index, e.g. from `columns` or `align`; -1 counts as unseen.
+
+        Returns:
+            np.ndarray: One boolean per column.
+        """
+        seen = self.seen(user_id)
+        if seen.size == 0:
+            return np.ones(len(columns), dtype=bool)
+        positions = np.minimum(np.searchsorted(seen, columns), seen.size - 1)
+        return seen[positions] != columns
+
+    def on_interaction(self, event: InteractionEvent) -> None:
+        """
+        Repository event handler; see `attach`.
+        """
+        self.add(event.user_id, event.product_id)
+
+    def attach(self) -> "SeenItemsIndex":
+        """
+        Subscribes the index to interactions created through `InteractionRepository`.
+
+        Attach before `build` so nothing recorded while loading is missed.
+
+        Returns:
+            SeenItemsIndex: The index itself, for chaining.
+        """
+        repository_events.subscribe(INTERACTION_CREATED, self.on_interaction)
+        return self
+
+    def detach(self) -> None:
+        repository_events.unsubscribe(INTERACTION_CREATED, self.on_interaction)
+
+    def _column(self, product_id: str) -> int:
+        column = self.product_index.get(product_id)
+        if column is None:
+            self.product_ids.append(product_id)
+            column = self.product_index[product_id] = len(self.product_ids) - 1
+        return column
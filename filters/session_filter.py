@@ -0,0 +1,96 @@
+from typing import Dict, Optional, Union
+import numpy as np
+from data_access.config import SESSION_RECENCY_DECAY
+from filters.co_interaction_counter import CoInteractionCounter
+from filters.filter_base import FilterBase
+from filters.interaction_matrix import DEFAULT_INTERACTION_WEIGHTS
+from filters.item_neighbours import ItemNeighbours
+from filters.recent_interactions import RecentInteractions
+from models.context_model import Context
+from models.filter_result_model import FilterResultModel, PATH_ABSTAINED
+from models.recommendation_model import RecommendationModel
+
+
+class SessionFilter(FilterBase):
+    """
+    Recommends the neighbours of the products in the user's current session.
+
+    Every interaction of the session votes for the neighbours of its product, weighted by its interaction
+    type and by its recency: each older interaction counts `decay` times the next one. The neighbours come
+    from a precomputed table, e.g. `ItemNeighbours` or `CoInteractionCounter`. With the sessions kept in
+    memory by `RecentInteractions`, a click changes the next recommendations without any database access or
+    model rebuild.
+
+    Every context product is returned, reordered by its session score, so the filter can run first in a
+    pipeline and score the whole candidate set while the filters after it still see every candidate and
+    apply the limit. The filter abstains for users without a session, or whose session has no neighbour among the context
+    products, so in a pipeline it adds no score or weight and the other filters rank on their own.
+    """
+
+    def __init__(self, recent: RecentInteractions, neighbours: Union[ItemNeighbours, CoInteractionCounter],
+                 decay: float = SESSION_RECENCY_DECAY, per_product: int = 50, weights: Optional[Dict[str, float]] = None) -> None:
+        """
+        Initializes the SessionFilter.
+
+        Args:
+            recent (RecentInteractions): Shared session buffers, updated by repository events.
+            neighbours (Union[ItemNeighbours, CoInteractionCounter]): Precomputed neighbours of each product.
+            decay (float): Weight of an interaction relative to the next, more recent one.
+            per_product (int): Neighbours read per product of the session.
+            weights (Optional[Dict[str, float]]): Weight of each interaction type; the collaborative weights by default.
+        """
+        super().__init__()
+        self.recent = recent
+        self.neighbours = neighbours
+        self.decay = decay
+        self.per_product = per_product
+        self.weights = weights or DEFAULT_INTERACTION_WEIGHTS
+
+    def apply_filter(self, context: Context) -> FilterResultModel:
+        """
+        Scores every context product by its similarity to the products of the user's session.
+
+        Args:
+            context (Context): The context containing user ID, product list, and limit for recommendations.
+
+        Returns:
+            FilterResultModel: The result model containing user ID and a list of recommended products, or
+                               an empty result with the `PATH_ABSTAINED` path.
+        """
+        self.logger.info(f"Applying session filtering to {len(context.products)} products for user {context.userId} with limit {context.limit}.")
+
+        scores = self.score(context.userId)
+        product_ids = [product.unique_id for product in context.products]
+        candidate_scores = np.array([scores.get(product_id, 0.0) for product_id in product_ids], dtype=np.float64)
+        if not candidate_scores.size or candidate_scores.max() <= 0:
+            return FilterResultModel(user_id=context.userId, recommendations=[], path=PATH_ABSTAINED)
+
+        order = np.argsort(-candidate_scores, kind="stable")
+        # Normalize the scores to [0, 1]
+        max_score = candidate_scores[order[0]]
+        return FilterResultModel(user_id=context.userId, recommendations=[
+            RecommendationModel(product_id=product_ids[i], similarity_score=float(candidate_scores[i] / max_score))
+            for i in order
+        ])
+
+    def score(self, user_id: int) -> Dict[str, float]:
+        """
+        Sums the neighbour scores of the products in the user's session, weighted by type and recency.
+
+        Args:
+            user_id (int): ID of the user.
+
+        Returns:
+            Dict[str, float]: Score of every neighbour that is not itself in the session; empty without a session.
+        """
+        session = self.recent.recent(user_id)
+        seeds: Dict[str, float] = {}
+        for age, (product_id, interaction_type, _) in enumerate(reversed(session)):
+            seeds[product_id] = seeds.get(product_id, 0.0) + float(self.weights.get(interaction_type, 1)) * self.decay ** age
+
+        scores: Dict[str, float] = {}
+        for product_id, weight in seeds.items():
+            for other, similarity in self.neighbours.neighbours(product_id, self.per_product):
+                if other not in seeds:
+                    scores[other] = scores.get(other, 0.0) + weight * similarity
+        return scores
@@ -0,0 +1,301 @@
+import os
+import pickle
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from scipy import sparse
+from data_access.db.events import INTERACTION_CREATED, InteractionEvent, repository_events
+from filters.content_model import CONTENT_INTERACTION_WEIGHTS, ContentModel
+from filters.memory_budget import INDEX_DTYPE, VALUE_DTYPE, MemoryBudget, chunks, csr_nbytes
+from services.logger import Logger
+
+PROFILES_FILE = "user_profiles.pkl"
+
+
+class UserProfileStore:
+    """
+    Incrementally maintained content profiles, one per user.
+
+    Each profile keeps the weighted sum of the vectors of the products the user interacted with and the
+    total weight, using the same view/like/purchase weights as `ContentBaseFilter`. The profile vector is
+    `sum / total`. A new interaction adds the product's non-zero features to the sum, so updates cost
+    O(nnz of one product) regardless of the user's history length.
+
+    The sums of a build are kept as one float32/int32 CSR matrix, one row per user. Users updated since
+    the build get their row copied into a small dict overlay, which `save` folds back into the matrix.
+    """
+
+    def __init__(self, model: ContentModel, weights: Optional[Dict[str, int]] = None) -> None:
+        """
+        Initializes an empty store bound to a content model.
+
+        Args:
+            model (ContentModel): Model whose feature space the profiles live in.
+            weights (Optional[Dict[str, int]]): Weight of each interaction type.
+        """
+        self.logger = Logger()
+        self.model = model
+        self.weights = weights or CONTENT_INTERACTION_WEIGHTS
+        self._rows: Dict[int, int] = {}
+        self._sums = self._pack([])
+        self._changed: Dict[int, Dict[int, float]] = {}
+        self._totals: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._totals
+
+    def __len__(self) -> int:
+        return len(self._totals)
+
+    def build(self, triples: Iterable[Tuple[int, str, str]], budget: Optional[MemoryBudget] = None) -> "UserProfileStore":
+        """
+        Rebuilds every profile from `(user_id, product_id, interaction_type)` tuples with sparse products.
+
+        The interactions are read in chunks into int32/float32 arrays. The product of the user x product
+        weights with the content matrix is computed for all users at once when its estimated size fits
+        the memory budget, otherwise `budget.chunk_size` users at a time. The estimate also covers the
+        result, which is kept as the float32/int32 sums matrix.
+
+        Args:
+            triples (Iterable[Tuple[int, str, str]]): Interactions to load; may be a stream.
+            budget (Optional[MemoryBudget]): Memory budget of the build; the configured one by default.
+
+        Returns:
+            UserProfileStore: The store itself.
+        """
+        budget = budget or MemoryBudget()
+        product_index = self.model.product_index
+        user_rows: Dict[int, int] = {}
+        rows, cols, values = [], [], []
+        for chunk in chunks(triples, budget.chunk_size):
+            chunk_rows, chunk_cols, chunk_values = [], [], []
+            for user_id, product_id, interaction_type in chunk:
+                col = product_index.get(product_id)
+                if col is None:
+                    continue
+                chunk_rows.append(user_rows.setdefault(user_id, len(user_rows)))
+                chunk_cols.append(col)
+                chunk_values.append(self._weight(interaction_type))
+            rows.append(np.asarray(chunk_rows, dtype=INDEX_DTYPE))
+            cols.append(np.asarray(chunk_cols, dtype=INDEX_DTYPE))
+            values.append(np.asarray(chunk_values, dtype=VALUE_DTYPE))
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=INDEX_DTYPE)
+        cols = np.concatenate(cols) if cols else np.zeros(0, dtype=INDEX_DTYPE)
+        values = np.concatenate(values) if values else np.zeros(0, dtype=VALUE_DTYPE)
+
+        matrix = self.model.matrix
+        weights = sparse.csr_matrix((values, (rows, cols)), shape=(len(user_rows), matrix.shape[0]), dtype=VALUE_DTYPE)
+        totals = np.asarray(weights.sum(axis=1), dtype=np.float64).ravel()
+        # Every interaction adds at most the non-zeros of its product to the user's sums
+        bound = int(np.diff(matrix.indptr)[cols].sum())
+        step = len(user_rows) if budget.fits("Building user profiles", csr_nbytes(len(user_rows), bound)) else budget.chunk_size
+
+        parts = []
+        for first in range(0, len(user_rows), max(step, 1)):
+            part = (weights[first:first + step] @ matrix).tocsr()
+            parts.append((part.data.astype(VALUE_DTYPE), part.indices.astype(INDEX_DTYPE), np.diff(part.indptr)))
+        indptr = np.zeros(len(user_rows) + 1, dtype=np.int64)
+        if parts:
+            np.cumsum(np.concatenate([part[2] for part in parts]), out=indptr[1:])
+        sums = sparse.csr_matrix((
+            np.concatenate([part[0] for part in parts]) if parts else np.zeros(0, dtype=VALUE_DTYPE),
+            np.concatenate([part[1] for part in parts]) if parts else np.zeros(0, dtype=INDEX_DTYPE),
+            indptr
+        ), shape=(len(user_rows), matrix.shape[1]))
+
+        with self._lock:
+            self._rows = user_rows
+            self._sums = sums
+            self._changed = {}
+            self._totals = {user_id: float(totals[row]) for user_id, row in user_rows.items()}
+        self.logger.info(f"Built {len(user_rows)} user profiles.")
+        return self
+
+    def add_interaction(self, user_id: int, product_id: str, interaction_type: str) -> None:
+        """
+        Adds one interaction to the user's profile.
+
+        Args:
+            user_id (int): ID of the user.
+            product_id (str): ID of the product.
+            interaction_type (str): Type of interaction.
+        """
+        row = self.model.product_index.get(product_id)
+        if row is None:
+            self.logger.warn(f"Product {product_id} is not in the content model; profile of user {user_id} not updated.")
+            return
+
+        weight = self._weight(interaction_type)
+        matrix = self.model.matrix
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        with self._lock:
+            profile = self._changed.get(user_id)
+            if profile is None:
+                profile = self._changed[user_id] = self._row(user_id)
+            for col, value in zip(matrix.indices[start:end].tolist(), matrix.data[start:end].tolist()):
+                profile[col] = profile.get(col, 0.0) + weight * value
+            self._totals[user_id] = self._totals.get(user_id, 0.0) + weight
+
+    def get_vector(self, user_id: int) -> Optional[sparse.csr_matrix]:
+        """
+        Returns the user's profile vector (weighted average of product vectors).
+
+        Args:
+            user_id (int): ID of the user.
+
+        Returns:
+            Optional[sparse.csr_matrix]: A 1 x features sparse row, or None if the user has no profile.
+        """
+        with self._lock:
+            total = self._totals.get(user_id)
+            if not total:
+                return None
+            profile = self._profile(user_id)
+            cols = np.fromiter(profile.keys(), dtype=np.int64, count=len(profile))
+            values = (np.fromiter(profile.values(), dtype=np.float64, count=len(profile)) / total).astype(VALUE_DTYPE)
+        return sparse.csr_matrix((values, (np.zeros_like(cols), cols)), shape=(1, self.model.matrix.shape[1]))
+
+    def to_csr(self, user_ids: List[int]) -> sparse.csr_matrix:
+        """
+        Stacks the profile vectors of several users into one matrix.
+
+        Args:
+            user_ids (List[int]): Users in row order; users without a profile get an empty row.
+
+        Returns:
+            sparse.csr_matrix: One profile vector per user.
+        """
+        indptr = np.zeros(len(user_ids) + 1, dtype=np.int64)
+        indices, data = [], []
+        with self._lock:
+            for i, user_id in enumerate(user_ids):
+                total = self._totals.get(user_id)
+                profile = self._profile(user_id) if total else None
+                if profile:
+                    indices.extend(profile.keys())
+                    data.extend(value / total for value in profile.values())
+                indptr[i + 1] = len(indices)
+        return sparse.csr_matrix(
+            (np.asarray(data, dtype=VALUE_DTYPE), np.asarray(indices, dtype=np.int64), indptr),
+            shape=(len(user_ids), self.model.matrix.shape[1])
+        )
+
+    def on_interaction(self, event: InteractionEvent) -> None:
+        """
+        Repository event handler; see `attach`.
+        """
+        self.add_interaction(event.user_id, event.product_id, event.interaction_type)
+
+    def attach(self) -> "UserProfileStore":
+        """
+        Subscribes the store to interactions created through `InteractionRepository`.
+
+        Returns:
+            UserProfileStore: The store itself, for chaining.
+        """
+        repository_events.subscribe(INTERACTION_CREATED, self.on_interaction)
+        return self
+
+    def detach(self) -> None:
+        repository_events.unsubscribe(INTERACTION_CREATED, self.on_interaction)
+
+    def save(self, directory: str) -> str:
+        """
+        Pickles the profiles next to the content model they belong to.
+
+        Args:
+            directory (str): Directory holding the content model.
+
+        Returns:
+            str: Path of the written file.
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, PROFILES_FILE)
+        with self._lock:
+            self._compact()
+            state = {
+                "model_built_at": self.model.built_at,
+                "weights": self.weights,
+                "rows": dict(self._rows),
+                "matrix": self._sums,
+                "totals": dict(self._totals)
+            }
+        with open(path + ".tmp", "wb") as file:
+            pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+        return path
+
+    @classmethod
+    def load(cls, directory: str, model: ContentModel) -> Optional["UserProfileStore"]:
+        """
+        Loads profiles saved with `save`, provided they were built on the same content model.
+
+        Args:
+            directory (str): Directory holding the profiles.
+            model (ContentModel): The loaded content model.
+
+        Returns:
+            Optional[UserProfileStore]: The store, or None if missing or built on another model.
+        """
+        path = os.path.join(directory, PROFILES_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as file:
+            state = pickle.load(file)
+        if state["model_built_at"] != model.built_at:
+            Logger().warn("Stored user profiles belong to another content model; ignoring them.")
+            return None
+        store = cls(model, state["weights"])
+        store._rows, store._sums = state["rows"], state["matrix"]
+        store._totals = state["totals"]
+        return store
+
+    def _row(self, user_id: int) -> Dict[int, float]:
+        """
+        The user's sums in the built matrix, as a `{feature: value}` dict; empty if the user has no row.
+        """
+        row = self._rows.get(user_id)
+        if row is None:
+            return {}
+        start, end = self._sums.indptr[row], self._sums.indptr[row + 1]
+        return dict(zip(self._sums.indices[start:end].tolist(), self._sums.data[start:end].tolist()))
+
+    def _profile(self, user_id: int) -> Dict[int, float]:
+        profile = self._changed.get(user_id)
+        return profile if profile is not None else self._row(user_id)
+
+    def _pack(self, profiles: List[Dict[int, float]]) -> sparse.csr_matrix:
+        """
+        Builds the float32/int32 sums matrix from one `{feature: value}` dict per row.
+        """
+        indptr = np.zeros(len(profiles) + 1, dtype=np.int64)
+        np.cumsum([len(profile) for profile in profiles], out=indptr[1:])
+        indices = np.fromiter((col for profile in profiles for col in profile), dtype=INDEX_DTYPE, count=int(indptr[-1]))
+        data = np.fromiter((value for profile in profiles for value in profile.values()), dtype=VALUE_DTYPE, count=int(indptr[-1]))
+        return sparse.csr_matrix((data, indices, indptr), shape=(len(profiles), self.model.matrix.shape[1]))
+
+    def _compact(self) -> None:
+        """
+        Folds the profiles changed since the build into the sums matrix; callers hold the lock.
+        """
+        if not self._changed:
+            return
+        n_rows = self._sums.shape[0]
+        changed = list(self._changed)
+        stacked = sparse.vstack([self._sums, self._pack([self._changed[user_id] for user_id in changed])], format="csr")
+        # Every user keeps its row; a changed user's row is taken from the appended sums
+        order = list(range(n_rows))
+        for k, user_id in enumerate(changed):
+            row = self._rows.get(user_id)
+            if row is None:
+                self._rows[user_id] = len(order)
+                order.append(n_rows + k)
+            else:
+                order[row] = n_rows + k
+        sums = stacked[np.asarray(order, dtype=np.int64)]
+        self._sums = sparse.csr_matrix((sums.data.astype(VALUE_DTYPE), sums.indices.astype(INDEX_DTYPE), sums.indptr), shape=sums.shape)
+        self._changed = {}
+
+    def _weight(self, interaction_type: str) -> float:
+        return float(self.weights.get(interaction_type, 1))
@@ -1,17 +1,127 @@
+import math
 import streamlit as st
-from data_access.db.db import SessionLocal
+from data_access.config import COLD_START_REFRESH_INTERVAL, COMPACTION_INTERVAL, FRONT_RANKED_LIST_SIZE, \
+    DIVERSITY_TRADE_OFF, DIVERSITY_WINDOW, DIVERSITY_MAX_PER_BRAND, DIVERSITY_MAX_PER_CATEGORY
+from data_access.db.db import SessionFactory
 from data_access.db.models import Product, Customer
 from data_access.db.repositories import ProductRepository, CustomerRepository, InteractionRepository
+from filters.candidate_generator import CandidateGenerator
 from filters.collaborative_filter import CollaborativeFilter
 from filters.content_based_filter import ContentBaseFilter
+from filters.diversity_reranker import DiversityReranker
 from filters.filter_pipe import FilterPipe
+from filters.interaction_matrix import InteractionMatrix
+from filters.seen_items_index import SeenItemsIndex
 from models.context_model import Context
+from services.cold_start_service import ColdStartService
 from services.logger import Logger
+from services.recommendation_service import load_content_model
+from services.warm_up import WarmUp
 
-# Crear una nueva instancia de la sesión  
-session = SessionLocal()
 logger = Logger()
 
+PLACEHOLDER_IMAGE = "https://tse1.mm.bing.net/th?id=OIP.XXWKhZZeWjrUPx-ZSfP0GAHaDt&pid=Api"
+
+# Los modelos se construyen una sola vez por proceso y se comparten entre sesiones de navegador;
+# se actualizan en memoria con cada interacción registrada a través del repositorio
+def build_cold_start():
+    cold_start = ColdStartService()
+    with SessionFactory() as session:
+        cold_start.refresh(session)
+    cold_start.start_periodic_refresh(SessionFactory, COLD_START_REFRESH_INTERVAL, refresh_now=False)
+    return cold_start
+
+def build_interaction_matrix():
+    with SessionFactory() as session:
+        interaction_matrix = InteractionMatrix.from_session(session).attach()
+    interaction_matrix.start_periodic_compaction(COMPACTION_INTERVAL)
+    return interaction_matrix
+
+def build_content_model():
+    with SessionFactory() as session:
+        model, profiles = load_content_model(session)
+        DiversityReranker(session, model).preload()
+    return model, profiles.attach()
+
+def build_seen_items():
+    with SessionFactory() as session:
+        return SeenItemsIndex().attach().build(session)
+
+# La construcción se lanza en segundo plano con la primera carga de la página, para que ninguna
+# petición de usuario pague el ajuste de TF-IDF ni la construcción de la matriz
+@st.cache_resource
+def get_warm_up():
+    return WarmUp([
+        ("cold_start", build_cold_start),
+        ("content_model", build_content_model),
+        ("interaction_matrix", build_interaction_matrix),
+        ("seen_items", build_seen_items)
+    ], name="front-warm-up").start()
+
+def get_cold_start():
+    return get_warm_up().result("cold_start")
+
+def get_interaction_matrix():
+    return get_warm_up().result("interaction_matrix")
+
+def get_content_model():
+    return get_warm_up().result("content_model")
+
+def get_seen_items():
+    return get_warm_up().result("seen_items")
+
+def get_session():
+    # Una sesión de base de datos por sesión de navegador, en lugar de una global compartida
+    if "db_session" not in st.session_state:
+        st.session_state.db_session = SessionFactory()
+    return st.session_state.db_session
+
+def get_filter_pipe():
+    # El pipeline usa la sesión del navegador y los modelos compartidos; se crea una vez por sesión
+    if "filter_pipe" not in st.session_state:
+        session = get_session()
+        cold_start = get_cold_start()
+        content_model, user_profiles = get_content_model()
+        st.session_state.filter_pipe = FilterPipe([
+            ContentBaseFilter(session, cold_start=cold_start, model=content_model, profiles=user_profiles,
+                              seen=get_seen_items()),
+            CollaborativeFilter(session, model=get_interaction_matrix(), cold_start=cold_start, seen=get_seen_items())
+        ], session=session, candidate_generator=CandidateGenerator.default(session), cold_start=cold_start,
+           reranker=DiversityReranker(session, content_model, DIVERSITY_TRADE_OFF, DIVERSITY_WINDOW,
+                                      DIVERSITY_MAX_PER_BRAND, DIVERSITY_MAX_PER_CATEGORY))
+    return st.session_state.filter_pipe
+
+def get_warming_up_recommendations(user_id):
+    # Mientras los modelos se cargan se usa la lista de popularidad, si ya está calculada
+    if not get_warm_up().has_result("cold_start"):
+        return []
+    return get_cold_start().recommend_for_user(get_session(), user_id, FRONT_RANKED_LIST_SIZE)
+
+def get_ranked_recommendations(user_id):
+    # Antes de que terminen de cargarse los modelos no se guarda nada, para ordenar de nuevo al estar listos.
+    # Si la carga falló, se reintentan los pasos pendientes en segundo plano y entretanto se usa la popularidad
+    warm_up = get_warm_up()
+    if not warm_up.ready:
+        if warm_up.done:
+            warm_up.retry()
+        return get_warming_up_recommendations(user_id)
+
+    # Se ordena una vez por usuario; la paginación recorre la lista guardada sin volver a ejecutar el pipeline
+    ranked = st.session_state.get("ranked_recommendations")
+    if ranked is None or ranked[0] != user_id:
+        result = get_filter_pipe().apply_filters(Context([], user_id, FRONT_RANKED_LIST_SIZE))
+        recommendations = result.recommendations[:FRONT_RANKED_LIST_SIZE] if result else []
+        ranked = (user_id, recommendations)
+        st.session_state.ranked_recommendations = ranked
+        st.session_state.page = 1
+    return ranked[1]
+
+def clear_ranked_recommendations():
+    st.session_state.pop("ranked_recommendations", None)
+
+def change_page(delta, page_count):
+    st.session_state.page = min(max(st.session_state.get("page", 1) + delta, 1), page_count)
+
 def create_product_form():
     st.title("Product Form")
 
@@ -49,6 +159,7 @@ def create_product_form():
         submitted = st.form_submit_button("Submit")
 
         if submitted:
+            session = get_session()
             try:
                 # Crear una instancia del repositorio de productos
                 product_repository = ProductRepository(session)
@@ -88,14 +199,17 @@ def create_product_form():
                 product_repository.add(new_product)
                 session.commit()  # Guardar los cambios
 
+                # El modelo de contenido ya cargado incorpora el producto sin reajustarse, para poder recomendarlo
+                if get_warm_up().has_result("content_model"):
+                    content_model, _ = get_content_model()
+                    content_model.add_product(new_product.unique_id, new_product.getProductDescribed())
+
                 logger.info(f"Product successfully created with id: {new_product.unique_id}.")
                 st.success("Product successfully created!")
             except Exception as e:
                 session.rollback()  # Revertir si algo falla
                 logger.error(f"An error occurred while creating the product: {str(e)}")
                 st.error(f"An error occurred: {str(e)}")
-            finally:
-                session.close()  # Cerrar la sesión
 
 def create_customer_form():
     st.title("Customer Form")
@@ -124,6 +238,7 @@ def create_customer_form():
         submitted = st.form_submit_button("Submit")
 
         if submitted:
+            session = get_session()
             try:
                 # Crear una instancia del repositorio de usuarios
                 customer_repository = CustomerRepository(session)
@@ -162,157 +277,127 @@ def create_customer_form():
                 session.rollback()  # Revertir si algo falla
                 logger.error(f"An error occurred while creating the customer: {str(e)}")
                 st.error(f"An error occurred: {str(e)}")
-            finally:
-                session.close()  # Cerrar la sesión
 
-def show_products(user_id, page=1, page_size=10):
+def render_product(product, user_id, score=None):
+    session = get_session()
+    interaction_repository = InteractionRepository(session)
+
+    # Mostrar información del producto como una tarjeta
+    with st.container():
+        st.subheader(product.product_name if product.product_name else "No Name Available")
+
+        try:
+            st.image(product.image or PLACEHOLDER_IMAGE, width=200)  # Imagen del producto (ajustar tamaño si es necesario)
+        except Exception:
+            st.image(PLACEHOLDER_IMAGE, width=200)  # Imagen de placeholder
+
+        st.write(product.about_product if product.about_product else "No description available.")
+        st.write(f"Product id: {product.unique_id}")
+        if score is not None:
+            st.write(f"Ranking score: {score}")
+        st.write(f"Price: ${product.selling_price if product.selling_price else 'N/A'}")
+        st.write(f"Stock: {product.stock if product.stock is not None else 'N/A'}")
+
+        # Botones de acción para cada producto
+        col1, col2, col3 = st.columns(3)
+
+        try:
+            with col1:
+                if st.button(f"Buy {product.product_name}", key=f"buy_{product.unique_id}"):
+                    # Acción para comprar
+                    logger.info("Buyed")
+                    interaction_repository.create_interaction(user_id, product.unique_id, 'purchase', 'User purchased the product')
+                    st.write(f"Purchased {product.product_name}!")
+
+            with col2:
+                if st.button(f"Like {product.product_name}", key=f"like_{product.unique_id}"):
+                    # Acción para dar like
+                    logger.info("Liked")
+                    interaction_repository.create_interaction(user_id, product.unique_id, 'like', 'User liked the product')
+                    st.write(f"Liked {product.product_name}!")
+
+            with col3:
+                if st.button(f"Details {product.product_name}", key=f"details_{product.unique_id}"):
+                    # Acción para ver más detalles
+                    logger.info("Viewed")
+                    interaction_repository.create_interaction(user_id, product.unique_id, 'view', 'User viewed the product')
+                    st.write(f"More details about {product.product_name}...")
+        except Exception as e:
+            session.rollback()  # Revertir si algo falla
+            logger.error(f"An error occurred while recording the interaction: {str(e)}")
+            st.error(f"An error occurred: {str(e)}")
+
+def show_products(user_id, page_size=10):
     st.title("Product Recommendations")
 
-    # Crear una instancia del repositorio de productos y el pipeline de filtros
+    session = get_session()
     product_repository = ProductRepository(session)
-    interaction_repository = InteractionRepository(session)
-    filter_pipe = FilterPipe([
-        ContentBaseFilter(session),
-        CollaborativeFilter(session)
-    ])
 
     try:
-    # Crear una barra de búsqueda para el ID del producto
+        # Crear una barra de búsqueda para el ID del producto
         search_id = st.text_input("Search for Product by ID")
 
         if search_id:
             # Buscar un producto específico por ID
-            try:
-                product_id = str(search_id)
-                st.write(f"Searching for product with ID: {product_id}")  # Línea de depuración
-                product = product_repository.get_by_id(product_id)
-                
-                if product:
-                    # Mostrar detalles del producto específico
-                    st.subheader(product.product_name if product.product_name else "No Name Available")
-                    
-                    if product.image:
-                        st.image(product.image, width=200)  # Imagen del producto (ajustar tamaño si es necesario)
-                    else:
-                        st.image("path/to/placeholder/image.png", width=200)  # Imagen de placeholder
-                    
-                    st.write(product.about_product if product.about_product else "No description available.")
-                    st.write(f"Price: ${product.selling_price if product.selling_price else 'N/A'}")
-                    st.write(f"Stock: {product.stock if product.stock is not None else 'N/A'}")
-
-                    # Botones de interacción
-                    col1, col2, col3 = st.columns(3)
-                    
-                    with col1:
-                        if st.button(f"Buy {product.product_name}", key=f"buy_{product.unique_id}"):
-                            # Acción para comprar
-                            logger.info("Buyed")
-                            interaction_repository.create_interaction(user_id, product_id, 'purchase', 'User purchased the product')
-                            session.commit()
-                            st.write(f"Purchased {product.product_name}!")
-                    
-                    with col2:
-                        if st.button(f"Like {product.product_name}", key=f"like_{product.unique_id}"):
-                            # Acción para dar like
-                            logger.info("Liked")
-                            interaction_repository.create_interaction(user_id, product_id, 'like', 'User liked the product')
-                            session.commit()
-                            st.write(f"Liked {product.product_name}!")
-                    
-                    with col3:
-                        if st.button(f"Details {product.product_name}", key=f"details_{product.unique_id}"):                            
-                            logger.info("Viewed")
-                            # Acción para ver más detalles
-                            interaction_repository.create_interaction(user_id, product_id, 'view', 'User viewed the product')
-                            session.commit()
-                            st.write(f"More details about {product.product_name}...")
-                
-                else:
-                    st.write("Product not found.")
-            except ValueError:
-                st.write("Please enter a valid ID.")
-            except Exception as e:
-                logger.error(f"An error occurred while fetching the product: {str(e)}")
-                st.error(f"An error occurred: {str(e)}")
-        else:
-            # Obtener todos los productos si no hay un ID de búsqueda
-            products = product_repository.get_all()
-            context = Context(products, user_id, page_size)
-
-            # Aplicar filtros de recomendación
-            filtered_products = filter_pipe.apply_filters(context)
-
-            if not filtered_products:
-                st.write("No products found.")
-                return
-
-            st.write(f"Showing product recommendations for user: {user_id}")
-            
-            first_10 = filtered_products.recommendations[:10]
-            for rec in first_10:
-                product = product_repository.get_by_id(rec.product_id)
-                # Mostrar información del producto como una tarjeta
-                with st.container():
-                    st.subheader(product.product_name if product.product_name else "No Name Available")
-                    
-                    if product.image:
-                        try: 
-                            st.image(product.image, width=200)  # Imagen del producto (ajustar tamaño si es necesario)
-                        except: 
-                            st.image("https://tse1.mm.bing.net/th?id=OIP.XXWKhZZeWjrUPx-ZSfP0GAHaDt&pid=Api", width=200)  # Imagen de placeholder
-                    else:
-                        st.image("https://tse1.mm.bing.net/th?id=OIP.XXWKhZZeWjrUPx-ZSfP0GAHaDt&pid=Api", width=200)  # Imagen de placeholder
-                    
-                    st.write(product.about_product if product.about_product else "No description available.")
-                    st.write(f"Product id: {rec.product_id}")
-                    st.write(f"Ranking score: {rec.similarity_score if rec.similarity_score is not None else 'N/A'}")
-                    st.write(f"Price: ${product.selling_price if product.selling_price else 'N/A'}")
-                    st.write(f"Stock: {product.stock if product.stock is not None else 'N/A'}")
-
-                    # Botones de acción para cada producto
-                    col1, col2, col3 = st.columns(3)
-                    
-                    with col1:
-                        if st.button(f"Buy {product.product_name}", key=f"buy_{product.unique_id}"):
-                            # Acción para comprar
-                            logger.info("Buyed")
-                            interaction_repository.create_interaction(user_id, product.unique_id, 'purchase', 'User purchased the product')
-                            session.commit()
-                            st.write(f"Purchased {product.product_name}!")
-                    
-                    with col2:
-                        if st.button(f"Like {product.product_name}", key=f"like_{product.unique_id}"):
-                            # Acción para dar like
-                            logger.info("Liked")
-                            interaction_repository.create_interaction(user_id, product.unique_id, 'like', 'User liked the product')
-                            session.commit()
-                            st.write(f"Liked {product.product_name}!")
-                    
-                    with col3:
-                        if st.button(f"Details {product.product_name}", key=f"details_{product.unique_id}"):
-                            # Acción para ver más detalles
-                            logger.info("Viwed")
-                            interaction_repository.create_interaction(user_id, product.unique_id, 'view', 'User viewed the product')
-                            session.commit()
-                            st.write(f"More details about {product.product_name}...")
-
-            # Agregar controles de paginación
-            col_prev, col_next = st.columns([1, 1])
-            
-            with col_prev:
-                if st.button("Previous Page") and page > 1:
-                    show_products(user_id, page - 1, page_size)
-            with col_next:
-                if st.button("Next Page"):
-                    show_products(user_id, page + 1, page_size)
+            product_id = str(search_id)
+            st.write(f"Searching for product with ID: {product_id}")  # Línea de depuración
+            product = product_repository.get_by_id(product_id)
+
+            if product:
+                # Mostrar detalles del producto específico
+                render_product(product, user_id)
+            else:
+                st.write("Product not found.")
+            return
+
+        # Avisar si los modelos aún se están cargando o si su carga falló
+        warm_up = get_warm_up()
+        if warm_up.failed:
+            st.error(f"Recommendation models could not be loaded: {warm_up.failed}")
+        elif not warm_up.ready:
+            st.info("Recommendation models are still loading; showing popular products meanwhile.")
+
+        # Aplicar filtros de recomendación una sola vez por usuario
+        recommendations = get_ranked_recommendations(user_id)
+
+        if not recommendations:
+            st.write("No products found.")
+            return
+
+        # Paginar sobre la lista ya ordenada
+        page_count = math.ceil(len(recommendations) / page_size)
+        page = min(st.session_state.get("page", 1), page_count)
+        offset = (page - 1) * page_size
+        page_recommendations = recommendations[offset:offset + page_size]
+
+        st.write(f"Showing product recommendations for user: {user_id} (page {page} of {page_count})")
+        st.button("Refresh recommendations", on_click=clear_ranked_recommendations)
+
+        # Cargar los productos de la página con una sola consulta
+        products = product_repository.get_by_ids([rec.product_id for rec in page_recommendations])
+        products_by_id = {product.unique_id: product for product in products}
+        for rec in page_recommendations:
+            product = products_by_id.get(rec.product_id)
+            if product is not None:
+                render_product(product, user_id, rec.similarity_score)
+
+        # Agregar controles de paginación
+        col_prev, col_next = st.columns([1, 1])
+
+        with col_prev:
+            st.button("Previous Page", on_click=change_page, args=(-1, page_count), disabled=page <= 1)
+        with col_next:
+            st.button("Next Page", on_click=change_page, args=(1, page_count), disabled=page >= page_count)
 
     except Exception as e:
+        session.rollback()
         logger.error(f"An error occurred while fetching products: {str(e)}")
         st.error(f"An error occurred: {str(e)}")
-    finally:
-        session.close()
 
 def main():
+    # Iniciar la carga de los modelos en cuanto arranca la aplicación, sea cual sea la vista
+    get_warm_up()
+
     st.sidebar.title("Navigation")
     user_id = st.sidebar.number_input("Enter User ID", min_value=1, step=1)
     options = st.sidebar.radio("Select a View", ("Create Product", "Create Customer", "Show Products"))
@@ -320,7 +405,7 @@ def main():
     if options == "Create Product":
         create_product_form()
     elif options == "Show Products":
-        show_products(user_id=user_id, page=1, page_size=10)
+        show_products(user_id=user_id, page_size=10)
     elif options == "Create Customer":
         create_customer_form()
 
@@ -62,6 +62,15 @@ CREATE TABLE IF NOT EXISTS interactions (
     FOREIGN KEY (product_id) REFERENCES products(unique_id)
 );
 
+CREATE TABLE IF NOT EXISTS product_features (
+    product_id TEXT PRIMARY KEY,
+    normalized_text TEXT,
+    tokens TEXT,
+    token_hashes JSON,
+    updated_at TIMESTAMP,
+    FOREIGN KEY (product_id) REFERENCES products(unique_id)
+);
+
 COPY customers (customer_id, age, gender, item_purchased, category, purchase_amount_usd, location, size, color, season, review_rating, subscription_status, shipping_type, discount_applied, promo_code_used, previous_purchases, payment_method, frequency_of_purchases)
 FROM '/docker-entrypoint-initdb.d/customer_details.csv'
 DELIMITER ','
@@ -77,6 +86,11 @@ FROM '/docker-entrypoint-initdb.d/interactions_details.csv'
 DELIMITER ','
 CSV HEADER;
 
+-- Índices de las interacciones: historial de un usuario por fecha, usuarios de un producto y cortes temporales
+CREATE INDEX IF NOT EXISTS interactions_user_time_idx ON interactions (user_id, time_stamp);
+CREATE INDEX IF NOT EXISTS interactions_product_user_idx ON interactions (product_id, user_id);
+CREATE INDEX IF NOT EXISTS interactions_time_idx ON interactions (time_stamp);
+
 -- Sincronizando la llave autoincremental de la tabla customer 
 DO $$ 
 DECLARE sequence_name text;
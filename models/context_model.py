@@ -1,8 +1,8 @@
-from typing import List
+from typing import List, Optional
 from data_access.db.models import Product
 
 class Context:
-    def __init__(self, products: List[Product], userId: int, limit=10):
+    def __init__(self, products: List[Product], userId: int, limit=10, profile: Optional[str] = None):
         """
         Initializes the Context with products, user ID, and a limit.
 
@@ -10,7 +10,10 @@ class Context:
             products (List[Product]): A list of Product instances that the filters will operate on.
             userId (int): The ID of the user for whom recommendations are being generated.
             limit (int, optional): The maximum number of recommendations to return. Defaults to 10.
+            profile (Optional[str]): Profiling mode for this request ("sampling" or "cprofile"); the
+                                     configured `PROFILE_MODE` when None.
         """
         self.products = products
         self.userId = userId
         self.limit = limit
+        self.profile = profile
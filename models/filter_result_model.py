@@ -1,18 +1,35 @@
-from typing import List
+from typing import List, Optional
 from models.recommendation_model import RecommendationModel
 from services.logger import Logger
 
+# How a pipeline result was produced: every stage completed, or the fallback used when one did not
+PATH_COMPLETE = "complete"
+PATH_PREVIOUS_STAGE = "previous_stage"
+PATH_COLD_START = "cold_start"
+PATH_UNRANKED = "unranked"
+# Served before the models finished loading at process start, without running the pipeline
+PATH_WARMING_UP = "warming_up"
+# Returned by a filter that has nothing to say about the user; the pipe skips it instead of failing
+PATH_ABSTAINED = "abstained"
+
 class FilterResultModel:
-    def __init__(self, user_id: str, recommendations: List[RecommendationModel]):
+    def __init__(self, user_id: str, recommendations: List[RecommendationModel], path: str = PATH_COMPLETE,
+                 reason: Optional[str] = None, profile: Optional[str] = None):
         """
         Initializes the FilterResultModel with user ID and a list of recommendations.
 
         Args:
             user_id (str): The ID of the user for whom the recommendations are generated.
             recommendations (List[RecommendationModel]): A list of RecommendationModel instances.
+            path (str): How the recommendations were produced, one of the `PATH_*` values.
+            reason (Optional[str]): Why a fallback path was taken, e.g. which filter timed out.
+            profile (Optional[str]): Summary file of the request's profile, when it was profiled and slow.
         """
         self.user_id = user_id
         self.recommendations = recommendations
+        self.path = path
+        self.reason = reason
+        self.profile = profile
         self.logger = Logger()
 
     def show_recommendations(self):
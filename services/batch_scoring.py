@@ -0,0 +1,402 @@
+import argparse
+import json
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from typing import Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from scipy import sparse
+from data_access.config import BATCH_SHARD_SIZE, BATCH_TOP_K, BATCH_WORKERS
+from data_access.db.db import SessionFactory
+from data_access.snapshot import Snapshot, resolve_snapshot
+from filters.interaction_matrix import squared_row_norms
+from services.logger import Logger
+from services.model_registry import ModelBundle, ModelRegistry
+
+# Specs of the shared arrays: name -> (segment name, shape, dtype)
+ArraySpecs = Dict[str, Tuple[str, Tuple[int, ...], str]]
+
+# Scores of one user: (matrix row, collaborative columns, collaborative scores, content rows, content scores)
+UserScores = Tuple[int, np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+# State of a scoring worker process, set by `_init_worker`
+_worker: Dict = {}
+
+
+class SharedArrays:
+    """
+    Read-only numpy arrays copied once into shared memory segments.
+
+    Workers attach to the segments by name with `attach_arrays`, so the matrices are neither pickled nor
+    copied per process.
+    """
+    def __init__(self, arrays: Dict[str, np.ndarray]) -> None:
+        self.segments: List[shared_memory.SharedMemory] = []
+        self.specs: ArraySpecs = {}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+            self.segments.append(segment)
+            self.specs[name] = (segment.name, array.shape, array.dtype.str)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(segment.size for segment in self.segments)
+
+    def close(self) -> None:
+        """
+        Releases and removes every segment; call once the workers are done.
+        """
+        for segment in self.segments:
+            segment.close()
+            segment.unlink()
+        self.segments = []
+
+
+def attach_arrays(specs: ArraySpecs) -> Tuple[Dict[str, np.ndarray], List[shared_memory.SharedMemory]]:
+    """
+    Maps the segments described by `specs` into this process.
+
+    Args:
+        specs (ArraySpecs): Specs from `SharedArrays.specs`.
+
+    Returns:
+        Tuple[Dict[str, np.ndarray], List[shared_memory.SharedMemory]]: Read-only views by name, and the segments,
+                                                                        which must stay referenced while the views are used.
+    """
+    arrays, segments = {}, []
+    for name, (segment_name, shape, dtype) in specs.items():
+        segment = shared_memory.SharedMemory(name=segment_name)
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf)
+        array.flags.writeable = False
+        arrays[name] = array
+        segments.append(segment)
+    return arrays, segments
+
+
+def _csr_arrays(prefix: str, matrix: sparse.csr_matrix) -> Dict[str, np.ndarray]:
+    matrix = sparse.csr_matrix(matrix)
+    matrix.sort_indices()
+    return {
+        f"{prefix}_data": matrix.data,
+        f"{prefix}_indices": matrix.indices,
+        f"{prefix}_indptr": matrix.indptr,
+        f"{prefix}_shape": np.asarray(matrix.shape, dtype=np.int64)
+    }
+
+
+def _csr_view(arrays: Dict[str, np.ndarray], prefix: str) -> sparse.csr_matrix:
+    shape = tuple(int(x) for x in arrays[f"{prefix}_shape"])
+    return sparse.csr_matrix((arrays[f"{prefix}_data"], arrays[f"{prefix}_indices"], arrays[f"{prefix}_indptr"]),
+                             shape=shape, copy=False)
+
+
+def share_bundle(bundle: ModelBundle) -> SharedArrays:
+    """
+    Copies the matrices needed to score every user of a bundle into shared memory.
+
+    Shared arrays: the interaction matrix and its transpose, the users' row norms, the number of users who
+    interacted with each product, the content profiles of the matrix users and their norms, the transposed
+    content matrix and its row norms, and the content row of every matrix column (-1 when the product has
+    no vector).
+
+    Args:
+        bundle (ModelBundle): Bundle to score with.
+
+    Returns:
+        SharedArrays: The shared copies; the caller closes them.
+    """
+    matrix = bundle.interaction_matrix.to_csr()
+    content = bundle.content_model.matrix
+    profiles = bundle.profiles.to_csr(bundle.interaction_matrix.user_ids)
+    content_index = bundle.content_model.product_index
+    content_rows = np.array([content_index.get(product_id, -1) for product_id in bundle.interaction_matrix.product_ids],
+                            dtype=np.int64)
+
+    arrays = {}
+    arrays.update(_csr_arrays("interactions", matrix))
+    arrays.update(_csr_arrays("interactions_t", matrix.T.tocsr()))
+    arrays.update(_csr_arrays("profiles", profiles))
+    arrays.update(_csr_arrays("content_t", content.T.tocsr()))
+    arrays["row_norms"] = np.sqrt(squared_row_norms(matrix))
+    arrays["product_counts"] = np.diff(matrix.tocsc().indptr).astype(np.int64)
+    arrays["profile_norms"] = np.sqrt(np.asarray(profiles.multiply(profiles).sum(axis=1), dtype=np.float64).ravel())
+    arrays["content_norms"] = np.sqrt(np.asarray(content.multiply(content).sum(axis=1), dtype=np.float64).ravel())
+    arrays["content_rows"] = content_rows
+    return SharedArrays(arrays)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Positions of the k highest scores, in the order a stable descending sort would give them.
+
+    Uses a partition instead of sorting every score; ties at the cut keep the lowest positions.
+
+    Args:
+        scores (np.ndarray): Scores to rank.
+        k (int): Number of positions to return.
+
+    Returns:
+        np.ndarray: Up to k positions, best first.
+    """
+    if scores.size <= k:
+        return np.argsort(-scores, kind="stable")
+    threshold = np.partition(scores, scores.size - k)[scores.size - k]
+    above = np.flatnonzero(scores > threshold)
+    ties = np.flatnonzero(scores == threshold)[:k - above.size]
+    chosen = np.sort(np.concatenate([above, ties]))
+    return chosen[np.argsort(-scores[chosen], kind="stable")]
+
+
+def sparse_top_k(columns: np.ndarray, values: np.ndarray, candidates: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Top k candidate columns of a sparse row, in the order `top_k` gives over the dense row.
+
+    Only the stored values are ranked; columns without one score zero and fill the ranking, lowest
+    columns first, between the positive and the negative stored values.
+
+    Args:
+        columns (np.ndarray): Sorted columns of the row's stored values.
+        values (np.ndarray): Stored values.
+        candidates (np.ndarray): Boolean mask of the columns that may be returned.
+        k (int): Number of columns to return.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Up to k columns, best first, and their scores.
+    """
+    keep = candidates[columns] & (values != 0)
+    columns, values = columns[keep], values[keep]
+    positive = values > 0
+    order = top_k(values[positive], k)
+    chosen, scores = [columns[positive][order]], [values[positive][order]]
+    missing = k - order.size
+    if missing > 0:
+        zeros = candidates.copy()
+        zeros[columns] = False
+        zeros = np.flatnonzero(zeros)[:missing]
+        chosen.append(zeros)
+        scores.append(np.zeros(zeros.size))
+        missing -= zeros.size
+    if missing > 0:
+        order = top_k(values[~positive], missing)
+        chosen.append(columns[~positive][order])
+        scores.append(values[~positive][order])
+    return np.concatenate(chosen).astype(np.int64), np.concatenate(scores).astype(np.float64)
+
+
+def _init_worker(specs: ArraySpecs, k: int, neighbours: Optional[int]) -> None:
+    arrays, segments = attach_arrays(specs)
+    _worker["segments"] = segments
+    _worker["arrays"] = arrays
+    _worker["interactions"] = _csr_view(arrays, "interactions")
+    _worker["interactions_t"] = _csr_view(arrays, "interactions_t")
+    _worker["profiles"] = _csr_view(arrays, "profiles")
+    _worker["content_t"] = _csr_view(arrays, "content_t")
+    _worker["k"] = k
+    _worker["neighbours"] = neighbours
+
+
+def _close_worker() -> None:
+    _worker.clear()
+
+
+def _collaborative_scores(rows: np.ndarray) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Scores a shard of users the way `CollaborativeFilter` does, with sparse products over the whole shard.
+
+    Similarities are cosine between interaction rows, without the user itself, restricted to the top
+    neighbours when set and divided by the user's largest one. Candidates are the products someone else
+    interacted with and the user did not; scores are divided by the largest candidate score.
+    """
+    matrix, matrix_t, arrays = _worker["interactions"], _worker["interactions_t"], _worker["arrays"]
+    row_norms, product_counts = arrays["row_norms"], arrays["product_counts"]
+    k, neighbours = _worker["k"], _worker["neighbours"]
+
+    # Cosine similarities of the shard against every user, kept sparse; the shared weights are small
+    # integers, so the shard is made float to keep the products from overflowing
+    shard = matrix[rows].astype(np.float64)
+    similarities = (shard @ matrix_t).tocoo()
+    norms = row_norms[rows][similarities.row] * row_norms[similarities.col]
+    values = np.zeros_like(similarities.data)
+    np.divide(similarities.data, norms, out=values, where=norms > 0)
+    # Drop each user's similarity with itself
+    values[similarities.col == rows[similarities.row]] = 0.0
+    similarities = sparse.csr_matrix((values, (similarities.row, similarities.col)), shape=similarities.shape)
+    similarities.eliminate_zeros()
+
+    # Keep the top neighbours and normalize each row by its largest similarity
+    for i in range(similarities.shape[0]):
+        start, end = similarities.indptr[i], similarities.indptr[i + 1]
+        row = similarities.data[start:end]
+        if neighbours is not None and row.size > neighbours:
+            row[np.argpartition(-row, neighbours)[neighbours:]] = 0.0
+        if row.size:
+            max_similarity = row.max()
+            if max_similarity > 0:
+                row /= max_similarity
+
+    # Scores stay sparse: the shard's rows are ranked on their stored values, never as a dense block
+    scores = (similarities @ matrix).tocsr()
+    scores.sort_indices()
+    results = []
+    for i, row in enumerate(rows):
+        start, end = shard.indptr[i], shard.indptr[i + 1]
+        own = shard.indices[start:end]
+        # Products someone interacted with, minus the user's own
+        unseen = product_counts > 0
+        unseen[own] = False
+        start, end = scores.indptr[i], scores.indptr[i + 1]
+        candidates, candidate_scores = sparse_top_k(scores.indices[start:end], scores.data[start:end], unseen, k)
+        if candidates.size == 0:
+            results.append((candidates, np.zeros(0)))
+            continue
+        # The best candidate holds the largest candidate score
+        max_score = candidate_scores[0]
+        normalized = candidate_scores / max_score if max_score != 0 else np.zeros(candidates.size)
+        results.append((candidates, normalized))
+    return results
+
+
+def _content_scores(rows: np.ndarray) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Scores a shard of users the way `ContentBaseFilter` does: cosine similarity between the stored profile
+    and every product vector, excluding the products the user interacted with.
+    """
+    matrix, profiles, content_t, arrays = _worker["interactions"], _worker["profiles"], _worker["content_t"], _worker["arrays"]
+    profile_norms, content_norms, content_rows = arrays["profile_norms"], arrays["content_norms"], arrays["content_rows"]
+    k = _worker["k"]
+
+    dots = (profiles[rows] @ content_t).tocsr()
+    dots.sort_indices()
+    results = []
+    for i, row in enumerate(rows):
+        if profile_norms[row] == 0:
+            results.append((np.zeros(0, dtype=np.int64), np.zeros(0)))
+            continue
+        # Similarities of the stored dot products only; every other product scores zero
+        start, end = dots.indptr[i], dots.indptr[i + 1]
+        columns = dots.indices[start:end]
+        norms = content_norms[columns] * profile_norms[row]
+        similarities = np.zeros(columns.size)
+        np.divide(dots.data[start:end], norms, out=similarities, where=norms > 0)
+
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        own = content_rows[matrix.indices[start:end]]
+        candidates = np.ones(content_norms.size, dtype=bool)
+        candidates[own[own >= 0]] = False
+        results.append(sparse_top_k(columns, similarities, candidates, k))
+    return results
+
+
+def _score_shard(rows: np.ndarray) -> List[UserScores]:
+    rows = np.asarray(rows, dtype=np.int64)
+    collaborative = _collaborative_scores(rows)
+    content = _content_scores(rows)
+    return [
+        (int(row), collaborative[i][0], collaborative[i][1], content[i][0], content[i][1])
+        for i, row in enumerate(rows)
+    ]
+
+
+def _shards(rows: np.ndarray, shard_size: int) -> Iterator[np.ndarray]:
+    for start in range(0, rows.size, shard_size):
+        yield rows[start:start + shard_size]
+
+
+def score_all(output: str, workers: int = BATCH_WORKERS, shard_size: int = BATCH_SHARD_SIZE, k: int = BATCH_TOP_K,
+              neighbours: Optional[int] = None, version: Optional[str] = None, snapshot: Optional[str] = None) -> int:
+    """
+    Scores every user with interactions and writes one JSON line per user.
+
+    The models come from the registry (the latest version by default) or are built from the database, or
+    from a snapshot, when nothing was published. Their matrices are placed in shared memory once; worker processes attach to
+    them and score shards of users, and this process is the single writer of the results, in completion
+    order. Users without interactions are left to the cold-start lists.
+
+    Args:
+        output (str): Path of the JSON lines file with `user_id`, `collaborative` and `content` lists of
+                      `[product_id, score]`.
+        workers (int): Number of worker processes; 1 scores in this process.
+        shard_size (int): Number of users scored at once by a worker.
+        k (int): Number of products kept per user and filter.
+        neighbours (Optional[int]): Number of most similar users that contribute to the collaborative scores.
+        version (Optional[str]): Registry version to score with.
+        snapshot (Optional[str]): Snapshot directory (or "latest") the models are built from instead of the live database.
+
+    Returns:
+        int: Number of users written.
+    """
+    logger = Logger()
+    bundle = ModelRegistry().load(version)
+    if bundle is None:
+        if version is not None:
+            raise ValueError(f"Version {version} is not in the registry or is incomplete.")
+        logger.warn("No published models; building them from the database.")
+        snapshot = resolve_snapshot(snapshot)
+        if snapshot is not None:
+            exported = Snapshot(snapshot)
+            with exported.replica()() as session:
+                bundle = ModelBundle.build(session, built_at=exported.exported_at, snapshot=exported)
+        else:
+            with SessionFactory() as session:
+                bundle = ModelBundle.build(session)
+
+    shared = share_bundle(bundle)
+    user_ids = bundle.interaction_matrix.user_ids
+    matrix_product_ids = bundle.interaction_matrix.product_ids
+    content_product_ids = bundle.content_model.product_ids
+    rows = np.flatnonzero(np.diff(bundle.interaction_matrix.to_csr().indptr) > 0)
+    # The bundle is no longer needed here; the workers read the shared copies
+    del bundle
+    logger.info(f"Scoring {rows.size} users in shards of {shard_size} with {workers} workers "
+                f"({shared.nbytes / 2 ** 20:.1f} MiB shared).")
+
+    written = 0
+    started = time.perf_counter()
+
+    def write(file, shard: List[UserScores]) -> None:
+        nonlocal written
+        for row, cf_cols, cf_scores, content_rows, content_scores in shard:
+            file.write(json.dumps({
+                "user_id": user_ids[row],
+                "collaborative": [[matrix_product_ids[c], round(float(s), 6)] for c, s in zip(cf_cols, cf_scores)],
+                "content": [[content_product_ids[c], round(float(s), 6)] for c, s in zip(content_rows, content_scores)]
+            }) + "\n")
+        written += len(shard)
+        logger.info(f"Scored {written}/{rows.size} users ({written / (time.perf_counter() - started):.0f} users/s).")
+
+    try:
+        with open(output, "w") as file:
+            if workers <= 1:
+                _init_worker(shared.specs, k, neighbours)
+                try:
+                    for shard in _shards(rows, shard_size):
+                        write(file, _score_shard(shard))
+                finally:
+                    _close_worker()
+            else:
+                with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                         initializer=_init_worker, initargs=(shared.specs, k, neighbours)) as executor:
+                    futures = {executor.submit(_score_shard, shard) for shard in _shards(rows, shard_size)}
+                    # Results are written as soon as any shard finishes; the futures are dropped once written
+                    for future in as_completed(futures):
+                        write(file, future.result())
+                        futures.discard(future)
+    finally:
+        shared.close()
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score every user with the registry models in parallel.")
+    parser.add_argument("--output", required=True, help="JSON lines file written with one line per user.")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="Worker processes (1 scores in-process).")
+    parser.add_argument("--shard-size", type=int, default=BATCH_SHARD_SIZE, help="Users scored at once by a worker.")
+    parser.add_argument("-k", type=int, default=BATCH_TOP_K, help="Products kept per user and filter.")
+    parser.add_argument("--neighbours", type=int, help="Most similar users used by the collaborative scores (all by default).")
+    parser.add_argument("--version", help="Registry version to score with (the latest by default).")
+    parser.add_argument("--snapshot", help="Snapshot directory, or \"latest\", to build from when nothing was published.")
+    args = parser.parse_args()
+    score_all(args.output, args.workers, args.shard_size, args.k, args.neighbours, args.version, args.snapshot)
@@ -0,0 +1,209 @@
+import threading
+from collections import defaultdict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from data_access.db.models import Customer
+from data_access.db.repositories import CustomerRepository, InteractionRepository
+from models.recommendation_model import RecommendationModel
+from services.logger import Logger
+
+# Weight of each interaction type when counting popularity
+POPULARITY_WEIGHTS = {
+    "view": 1,
+    "like": 2,
+    "purchase": 3
+}
+
+# Upper bounds (exclusive) of the age buckets; older customers fall in the last bucket
+AGE_BUCKETS = (25, 35, 45, 55, 65)
+
+# Segments tried for a customer, most specific first
+SEGMENTS = (
+    ("age_bucket", "gender", "location"),
+    ("age_bucket", "gender"),
+    ("location",),
+    ("category",),
+    ("age_bucket",),
+    ("gender",),
+)
+
+
+def age_bucket(age: Optional[int]) -> Optional[str]:
+    """
+    Maps an age to a bucket label such as "25-34".
+
+    Args:
+        age (Optional[int]): Age of the customer.
+
+    Returns:
+        Optional[str]: The bucket label, or None when the age is unknown.
+    """
+    if age is None:
+        return None
+    lower = 0
+    for upper in AGE_BUCKETS:
+        if age < upper:
+            return f"{lower}-{upper - 1}"
+        lower = upper
+    return f"{lower}+"
+
+
+class ColdStartService:
+    """
+    Serves precomputed popularity lists to users without interactions.
+
+    `refresh` computes weighted (and optionally time-decayed) popularity over all interactions and per
+    demographic segment, and swaps the new lists in atomically. Serving is a handful of dictionary
+    lookups: the most specific segment of the customer with enough supporting customers wins, and the
+    overall list is used otherwise.
+    """
+    def __init__(self, top_n: int = 200, min_support: int = 5, half_life_days: Optional[float] = 30) -> None:
+        """
+        Initializes the service with empty lists; call `refresh` or `start_periodic_refresh` to fill them.
+
+        Args:
+            top_n (int): Number of products kept per list.
+            min_support (int): Minimum number of interactions a segment needs to get its own list.
+            half_life_days (Optional[float]): Half-life of the time decay applied to interactions, or None to disable it.
+        """
+        self.logger = Logger()
+        self.top_n = top_n
+        self.min_support = min_support
+        self.half_life_days = half_life_days
+        self.overall: List[RecommendationModel] = []
+        self.segments: Dict[Tuple, List[RecommendationModel]] = {}
+        self.refreshed_at: Optional[datetime] = None
+        self._stop: Optional[threading.Event] = None
+
+    def refresh(self, session: Session) -> None:
+        """
+        Recomputes every popularity list from the database.
+
+        Args:
+            session (Session): The SQLAlchemy session used for database operations.
+        """
+        rows = InteractionRepository(session).get_interactions_with_customer_attributes()
+        now = datetime.now()
+
+        overall: Dict[str, float] = defaultdict(float)
+        segment_scores: Dict[Tuple, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        segment_support: Dict[Tuple, int] = defaultdict(int)
+
+        for product_id, interaction_type, time_stamp, age, gender, location, category in rows:
+            weight = POPULARITY_WEIGHTS.get(interaction_type, 0) * self._decay(time_stamp, now)
+            if not weight:
+                continue
+            overall[product_id] += weight
+
+            attributes = {"age_bucket": age_bucket(age), "gender": gender, "location": location, "category": category}
+            for dimensions in SEGMENTS:
+                key = self._segment_key(dimensions, attributes)
+                if key is not None:
+                    segment_scores[key][product_id] += weight
+                    segment_support[key] += 1
+
+        segments = {
+            key: self._rank(scores)
+            for key, scores in segment_scores.items()
+            if segment_support[key] >= self.min_support
+        }
+
+        # Swap both references at once so readers never see a half-built state
+        self.overall, self.segments = self._rank(overall), segments
+        self.refreshed_at = now
+        self.logger.info(f"Cold-start lists refreshed from {len(rows)} interactions ({len(segments)} segments).")
+
+    def recommend(self, customer: Optional[Customer], limit: int) -> List[RecommendationModel]:
+        """
+        Returns the popularity list that best matches the customer's segment.
+
+        Args:
+            customer (Optional[Customer]): The customer, or None when unknown.
+            limit (int): Maximum number of recommendations.
+
+        Returns:
+            List[RecommendationModel]: Recommendations with scores normalized to [0, 1]; empty before the first refresh.
+        """
+        segments = self.segments
+        if customer is not None:
+            attributes = {
+                "age_bucket": age_bucket(customer.age),
+                "gender": customer.gender,
+                "location": customer.location,
+                "category": customer.category
+            }
+            for dimensions in SEGMENTS:
+                key = self._segment_key(dimensions, attributes)
+                if key in segments:
+                    return segments[key][:limit]
+        return self.overall[:limit]
+
+    def recommend_for_user(self, session: Session, user_id: int, limit: int) -> List[RecommendationModel]:
+        """
+        Loads the customer and returns its cold-start recommendations.
+
+        Args:
+            session (Session): The SQLAlchemy session used to load the customer.
+            user_id (int): ID of the customer.
+            limit (int): Maximum number of recommendations.
+
+        Returns:
+            List[RecommendationModel]: Cold-start recommendations.
+        """
+        return self.recommend(CustomerRepository(session).get_by_id(user_id), limit)
+
+    def start_periodic_refresh(self, session_factory: Callable[[], Session], interval: float, refresh_now: bool = True) -> None:
+        """
+        Refreshes the lists now and then every `interval` seconds in a daemon thread.
+
+        Args:
+            session_factory (Callable[[], Session]): Factory returning a new session for each refresh.
+            interval (float): Seconds between refreshes.
+            refresh_now (bool): Whether the first refresh runs immediately; False when the caller just refreshed.
+        """
+        if self._stop is not None and not self._stop.is_set():
+            return
+        stop = threading.Event()
+        self._stop = stop
+
+        def run():
+            if not refresh_now and stop.wait(interval):
+                return
+            while True:
+                try:
+                    with session_factory() as session:
+                        self.refresh(session)
+                except Exception as e:
+                    self.logger.error(f"Cold-start refresh failed: {str(e)}")
+                if stop.wait(interval):
+                    break
+
+        threading.Thread(target=run, name="cold-start-refresh", daemon=True).start()
+
+    def stop(self) -> None:
+        """
+        Stops the periodic refresh thread.
+        """
+        if self._stop is not None:
+            self._stop.set()
+
+    def _decay(self, time_stamp: Optional[datetime], now: datetime) -> float:
+        if self.half_life_days is None or time_stamp is None:
+            return 1.0
+        age_days = max((now - time_stamp).total_seconds() / 86400, 0.0)
+        return 0.5 ** (age_days / self.half_life_days)
+
+    def _rank(self, scores: Dict[str, float]) -> List[RecommendationModel]:
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:self.top_n]
+        if not ranked:
+            return []
+        max_score = ranked[0][1]
+        return [RecommendationModel(product_id, score / max_score) for product_id, score in ranked]
+
+    @staticmethod
+    def _segment_key(dimensions: Tuple[str, ...], attributes: Dict[str, Optional[str]]) -> Optional[Tuple]:
+        values = tuple(attributes[dimension] for dimension in dimensions)
+        if any(value is None for value in values):
+            return None
+        return (dimensions, values)
@@ -0,0 +1,483 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional
+from sqlalchemy.orm import Session
+from data_access.config import COMPACTION_INTERVAL, CONTENT_FEATURIZER, HASHING_FEATURES, MODEL_POLL_INTERVAL, \
+    MODEL_REGISTRY_DIR, MODEL_VERSIONS_KEPT
+from data_access.db.db import SessionFactory
+from data_access.db.events import INTERACTION_CREATED, InteractionEvent, repository_events
+from data_access.db.repositories import InteractionRepository
+from data_access.snapshot import Snapshot, resolve_snapshot
+from filters.content_model import ContentModel, create_vectorizer
+from filters.interaction_matrix import InteractionMatrix
+from filters.item_neighbours import ItemNeighbours
+from filters.memory_budget import MemoryBudget
+from filters.user_profile_store import UserProfileStore
+from services.logger import Logger
+
+MANIFEST_FILE = "manifest.json"
+LATEST_FILE = "LATEST"
+
+
+class ModelBundle:
+    """
+    One version of every fitted model used by the pipeline.
+
+    Attributes:
+        version (Optional[str]): Registry version, None until published.
+        built_at (datetime): When the interactions the models were built from were read.
+        content_model (ContentModel): Catalog-wide content model.
+        profiles (UserProfileStore): Content profiles in the feature space of `content_model`.
+        interaction_matrix (InteractionMatrix): Collaborative interaction matrix.
+        item_neighbours (ItemNeighbours): Most similar products of each product, from `interaction_matrix`.
+        manifest (Dict): Manifest of the version, empty until published.
+    """
+    def __init__(self, content_model: ContentModel, profiles: UserProfileStore, interaction_matrix: InteractionMatrix,
+                 built_at: datetime, version: Optional[str] = None, manifest: Optional[Dict] = None,
+                 item_neighbours: Optional[ItemNeighbours] = None) -> None:
+        self.logger = Logger()
+        self.content_model = content_model
+        self.profiles = profiles
+        self.interaction_matrix = interaction_matrix
+        self.item_neighbours = item_neighbours if item_neighbours is not None else ItemNeighbours.from_matrix(interaction_matrix)
+        self.built_at = built_at
+        self.version = version
+        self.manifest = manifest or {}
+        self.refs = 0
+        self.retired = False
+        self._held: Optional[List[InteractionEvent]] = None
+        self._events_lock = threading.Lock()
+
+    @classmethod
+    def build(cls, session: Session, built_at: Optional[datetime] = None, budget: Optional[MemoryBudget] = None,
+              snapshot: Optional[Snapshot] = None) -> "ModelBundle":
+        """
+        Builds every model from the database, or from a snapshot.
+
+        Args:
+            session (Session): The SQLAlchemy session used for database operations.
+            built_at (Optional[datetime]): When the data in the session was read, e.g. the export time of a
+                                           snapshot; now by default. Only interactions up to this time are
+                                           built in, and activation catches up from it.
+            budget (Optional[MemoryBudget]): Memory budget of each build step; the configured one by default.
+            snapshot (Optional[Snapshot]): Snapshot the interactions, customer and product IDs are streamed
+                                           from, reading only the columns they need; the catalog is still
+                                           read through `session`, e.g. a replica of the same snapshot.
+
+        Returns:
+            ModelBundle: The unpublished bundle.
+        """
+        built_at = built_at or datetime.now()
+        budget = budget or MemoryBudget()
+        content_model = ContentModel.from_session(session, create_vectorizer(CONTENT_FEATURIZER, n_features=HASHING_FEATURES), budget)
+        if snapshot is not None:
+            interaction_matrix = InteractionMatrix.from_triples(snapshot.customer_ids(), snapshot.product_ids(),
+                                                                snapshot.interaction_triples(until=built_at), budget=budget)
+            triples = snapshot.interaction_triples(until=built_at)
+        else:
+            interaction_matrix = InteractionMatrix.from_session(session, budget=budget, until=built_at)
+            triples = budget.interaction_triples(session, built_at)
+        return cls(
+            content_model=content_model,
+            profiles=UserProfileStore(content_model).build(triples, budget),
+            interaction_matrix=interaction_matrix,
+            built_at=built_at,
+            item_neighbours=ItemNeighbours.from_matrix(interaction_matrix, budget=budget)
+        )
+
+    def activate(self, session: Session) -> "ModelBundle":
+        """
+        Subscribes the models to repository events and applies the interactions recorded since the build.
+
+        Events are subscribed to first so nothing recorded during the catch-up is missed, but held until
+        it finishes. Held events the catch-up already applied are dropped: the profiles add every
+        interaction to their sums, so applying one twice would count it twice.
+
+        Args:
+            session (Session): Session used to read the missed interactions.
+
+        Returns:
+            ModelBundle: The bundle itself, for chaining.
+        """
+        activated_at = datetime.now()
+        with self._events_lock:
+            self._held = []
+        repository_events.subscribe(INTERACTION_CREATED, self.on_interaction)
+        self.interaction_matrix.start_periodic_compaction(COMPACTION_INTERVAL)
+
+        applied: Counter = Counter()
+        for user_id, product_id, interaction_type, time_stamp in InteractionRepository(session).get_interaction_stream(
+                since=self.built_at, until=activated_at):
+            self._apply(user_id, product_id, interaction_type)
+            applied[(user_id, product_id, interaction_type, time_stamp)] += 1
+        caught_up = sum(applied.values())
+
+        with self._events_lock:
+            held, self._held = self._held, None
+        for event in held:
+            key = (event.user_id, event.product_id, event.interaction_type, event.time_stamp)
+            if applied[key] > 0:
+                applied[key] -= 1
+            else:
+                self._apply(event.user_id, event.product_id, event.interaction_type)
+                caught_up += 1
+        if caught_up:
+            self.logger.info(f"Model version {self.version} caught up with {caught_up} interactions.")
+        return self
+
+    def deactivate(self) -> None:
+        """
+        Stops updating the models; called once the bundle is retired and no request uses it.
+        """
+        repository_events.unsubscribe(INTERACTION_CREATED, self.on_interaction)
+        self.interaction_matrix.detach()
+
+    def on_interaction(self, event: InteractionEvent) -> None:
+        """
+        Repository event handler subscribed by `activate`: updates the models, or holds the event while the
+        catch-up runs.
+        """
+        with self._events_lock:
+            if self._held is not None:
+                self._held.append(event)
+                return
+        self._apply(event.user_id, event.product_id, event.interaction_type)
+
+    def _apply(self, user_id: int, product_id: str, interaction_type: str) -> None:
+        self.interaction_matrix.update(user_id, product_id, interaction_type)
+        self.profiles.add_interaction(user_id, product_id, interaction_type)
+
+
+class ModelRegistry:
+    """
+    Versioned store of model bundles on disk.
+
+    Every version is a directory under `versions/` holding the pickled models and a manifest with the
+    build timestamp and the SHA-256 of each file. Versions are written to a temporary directory and
+    renamed into place, and the `LATEST` pointer is replaced atomically, so readers never see a
+    partially written version.
+    """
+    def __init__(self, root: str = MODEL_REGISTRY_DIR) -> None:
+        """
+        Initializes the registry.
+
+        Args:
+            root (str): Directory of the registry, created if needed.
+        """
+        self.logger = Logger()
+        self.root = root
+        self.versions_dir = os.path.join(root, "versions")
+        os.makedirs(self.versions_dir, exist_ok=True)
+
+    def publish(self, bundle: ModelBundle, metadata: Optional[Dict] = None, promote: bool = True) -> str:
+        """
+        Stores a bundle as a new version.
+
+        Args:
+            bundle (ModelBundle): The bundle to store; its `version` and `manifest` are set.
+            metadata (Optional[Dict]): Extra information kept in the manifest.
+            promote (bool): Whether to point `LATEST` at the new version.
+
+        Returns:
+            str: The new version.
+        """
+        version = f"{bundle.built_at.strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+        staging = os.path.join(self.versions_dir, f".staging-{version}")
+        bundle.content_model.save(staging)
+        bundle.profiles.save(staging)
+        bundle.interaction_matrix.save(staging)
+        bundle.item_neighbours.save(staging)
+
+        manifest = {
+            "version": version,
+            "built_at": bundle.built_at.isoformat(),
+            "published_at": datetime.now().isoformat(),
+            "files": {
+                name: {"sha256": self._checksum(os.path.join(staging, name)), "bytes": os.path.getsize(os.path.join(staging, name))}
+                for name in sorted(os.listdir(staging))
+            },
+            "metadata": {
+                "featurizer": type(bundle.content_model.vectorizer).__name__,
+                "products": len(bundle.content_model.product_ids),
+                "users": bundle.interaction_matrix.shape[0],
+                "profiles": len(bundle.profiles),
+                **(metadata or {})
+            }
+        }
+        self._write_atomic(os.path.join(staging, MANIFEST_FILE), json.dumps(manifest, indent=2))
+        os.rename(staging, os.path.join(self.versions_dir, version))
+
+        bundle.version, bundle.manifest = version, manifest
+        if promote:
+            self.promote(version)
+        self.logger.info(f"Published model version {version}.")
+        return version
+
+    def promote(self, version: str) -> None:
+        """
+        Points `LATEST` at a version; running processes watching the registry swap to it.
+
+        Args:
+            version (str): A published version.
+
+        Raises:
+            ValueError: If the version does not exist.
+        """
+        if version not in self.versions():
+            raise ValueError(f"Unknown model version '{version}'")
+        self._write_atomic(os.path.join(self.root, LATEST_FILE), version)
+
+    def latest_version(self) -> Optional[str]:
+        """
+        Returns the version `LATEST` points at, or None if nothing was published.
+        """
+        path = os.path.join(self.root, LATEST_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path) as file:
+            return file.read().strip() or None
+
+    def versions(self) -> List[str]:
+        """
+        Lists the published versions, oldest first.
+        """
+        return sorted(
+            name for name in os.listdir(self.versions_dir)
+            if not name.startswith(".") and os.path.exists(os.path.join(self.versions_dir, name, MANIFEST_FILE))
+        )
+
+    def manifest(self, version: str) -> Dict:
+        with open(os.path.join(self.versions_dir, version, MANIFEST_FILE)) as file:
+            return json.load(file)
+
+    def verify(self, version: str) -> bool:
+        """
+        Checks every file of a version against the checksums of its manifest.
+
+        Args:
+            version (str): A published version.
+
+        Returns:
+            bool: Whether all files are intact.
+        """
+        directory = os.path.join(self.versions_dir, version)
+        for name, info in self.manifest(version)["files"].items():
+            path = os.path.join(directory, name)
+            if not os.path.exists(path) or self._checksum(path) != info["sha256"]:
+                self.logger.error(f"Model version {version}: checksum mismatch in {name}.")
+                return False
+        return True
+
+    def load(self, version: Optional[str] = None) -> Optional[ModelBundle]:
+        """
+        Loads and verifies a version.
+
+        Args:
+            version (Optional[str]): Version to load; the latest by default.
+
+        Returns:
+            Optional[ModelBundle]: The bundle, not yet activated, or None if there is no such intact version.
+        """
+        version = version or self.latest_version()
+        if version is None or version not in self.versions() or not self.verify(version):
+            return None
+        directory = os.path.join(self.versions_dir, version)
+        manifest = self.manifest(version)
+        content_model = ContentModel.load(directory)
+        profiles = UserProfileStore.load(directory, content_model) if content_model is not None else None
+        interaction_matrix = InteractionMatrix.load(directory)
+        item_neighbours = ItemNeighbours.load(directory)
+        if profiles is None or interaction_matrix is None or item_neighbours is None:
+            self.logger.error(f"Model version {version} is incomplete.")
+            return None
+        return ModelBundle(
+            content_model=content_model,
+            profiles=profiles,
+            interaction_matrix=interaction_matrix,
+            built_at=datetime.fromisoformat(manifest["built_at"]),
+            version=version,
+            manifest=manifest,
+            item_neighbours=item_neighbours
+        )
+
+    def prune(self, keep: int = MODEL_VERSIONS_KEPT) -> List[str]:
+        """
+        Deletes the oldest versions, never the latest one.
+
+        Args:
+            keep (int): Number of most recent versions to keep.
+
+        Returns:
+            List[str]: The deleted versions.
+        """
+        latest = self.latest_version()
+        versions = self.versions()
+        removed = [version for version in versions[:max(len(versions) - keep, 0)] if version != latest]
+        for version in removed:
+            shutil.rmtree(os.path.join(self.versions_dir, version), ignore_errors=True)
+        return removed
+
+    @staticmethod
+    def _checksum(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _write_atomic(path: str, content: str) -> None:
+        with open(path + ".tmp", "w") as file:
+            file.write(content)
+        os.replace(path + ".tmp", path)
+
+
+class ModelHandle:
+    """
+    Reference to the bundle currently serving requests, swappable while requests are in flight.
+
+    Requests hold the bundle they started with through `acquire`. `swap` flips the reference so new
+    requests use the new bundle immediately; the old one is deactivated once its last request releases it.
+    """
+    def __init__(self) -> None:
+        self.logger = Logger()
+        self._current: Optional[ModelBundle] = None
+        self._lock = threading.Lock()
+        self._watch_stop: Optional[threading.Event] = None
+
+    @property
+    def current(self) -> Optional[ModelBundle]:
+        return self._current
+
+    @contextmanager
+    def acquire(self) -> Iterator[ModelBundle]:
+        """
+        Yields the current bundle and keeps it alive until the block exits.
+
+        Raises:
+            RuntimeError: If no bundle has been loaded yet.
+        """
+        with self._lock:
+            bundle = self._current
+            if bundle is None:
+                raise RuntimeError("No model version loaded")
+            bundle.refs += 1
+        try:
+            yield bundle
+        finally:
+            with self._lock:
+                bundle.refs -= 1
+                drained = bundle.retired and bundle.refs == 0
+            if drained:
+                self._drain(bundle)
+
+    def swap(self, bundle: ModelBundle) -> None:
+        """
+        Makes an activated bundle the current one and retires the previous one.
+
+        Args:
+            bundle (ModelBundle): The new bundle.
+        """
+        with self._lock:
+            previous, self._current = self._current, bundle
+            drained = False
+            if previous is not None:
+                previous.retired = True
+                drained = previous.refs == 0
+        self.logger.info(f"Serving model version {bundle.version}.")
+        if drained:
+            self._drain(previous)
+
+    def watch(self, registry: ModelRegistry, session_factory: Callable[[], Session] = SessionFactory,
+              interval: float = MODEL_POLL_INTERVAL) -> None:
+        """
+        Swaps to the registry's latest version whenever it changes, checking every `interval` seconds in a
+        daemon thread. New versions are loaded and caught up in the background before the swap.
+
+        Args:
+            registry (ModelRegistry): Registry to watch.
+            session_factory (Callable[[], Session]): Factory returning a session for the catch-up.
+            interval (float): Seconds between checks.
+        """
+        if self._watch_stop is not None and not self._watch_stop.is_set():
+            return
+        stop = threading.Event()
+        self._watch_stop = stop
+
+        def run():
+            while not stop.wait(interval):
+                try:
+                    latest = registry.latest_version()
+                    current = self._current
+                    if latest is None or current is None or latest == current.version:
+                        continue
+                    bundle = registry.load(latest)
+                    if bundle is None:
+                        continue
+                    with session_factory() as session:
+                        bundle.activate(session)
+                    self.swap(bundle)
+                except Exception as e:
+                    self.logger.error(f"Model version swap failed: {str(e)}")
+
+        threading.Thread(target=run, name="model-registry-watch", daemon=True).start()
+
+    def close(self) -> None:
+        """
+        Stops watching the registry and deactivates the current bundle.
+        """
+        if self._watch_stop is not None:
+            self._watch_stop.set()
+        with self._lock:
+            bundle, self._current = self._current, None
+        if bundle is not None:
+            bundle.deactivate()
+
+    def _drain(self, bundle: ModelBundle) -> None:
+        bundle.deactivate()
+        self.logger.info(f"Model version {bundle.version} drained.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the versioned model registry.")
+    parser.add_argument("--root", default=MODEL_REGISTRY_DIR, help="Registry directory.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    publish = commands.add_parser("publish", help="Build every model from the database and publish a version.")
+    publish.add_argument("--no-promote", action="store_true", help="Publish without pointing LATEST at it.")
+    publish.add_argument("--snapshot", help="Build from this snapshot directory, or \"latest\", instead of the live database.")
+    commands.add_parser("list", help="List the published versions.")
+    promote = commands.add_parser("promote", help="Point LATEST at a version (also used to roll back).")
+    promote.add_argument("version")
+    prune = commands.add_parser("prune", help="Delete old versions.")
+    prune.add_argument("--keep", type=int, default=MODEL_VERSIONS_KEPT)
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.root)
+    if args.command == "publish":
+        if args.snapshot:
+            # Interactions recorded after the export are applied when the version is activated
+            snapshot = Snapshot(resolve_snapshot(args.snapshot))
+            with snapshot.replica()() as session:
+                bundle = ModelBundle.build(session, built_at=snapshot.exported_at, snapshot=snapshot)
+        else:
+            with SessionFactory() as session:
+                bundle = ModelBundle.build(session)
+        print(registry.publish(bundle, promote=not args.no_promote))
+    elif args.command == "list":
+        latest = registry.latest_version()
+        for version in registry.versions():
+            manifest = registry.manifest(version)
+            print(f"{'*' if version == latest else ' '} {version}  built {manifest['built_at']}  {json.dumps(manifest['metadata'])}")
+    elif args.command == "promote":
+        registry.promote(args.version)
+    elif args.command == "prune":
+        for version in registry.prune(args.keep):
+            print(f"Removed {version}")
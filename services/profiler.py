@@ -0,0 +1,270 @@
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, TypeVar
+from data_access.config import PROFILE_DIR, PROFILE_MODE, PROFILE_SAMPLE_INTERVAL, PROFILE_THRESHOLD
+from services.logger import Logger
+
+T = TypeVar("T")
+
+# Profiling modes: wall-clock stack sampling only, or sampling plus deterministic cProfile statistics
+PROFILE_SAMPLING = "sampling"
+PROFILE_CPROFILE = "cprofile"
+PROFILE_MODES = (PROFILE_SAMPLING, PROFILE_CPROFILE)
+
+# Number of profiled requests running; tracemalloc is traced only while there is one
+_tracing = 0
+_tracing_started = False
+_tracing_lock = threading.Lock()
+
+
+def resolve_mode(value: Optional[str]) -> Optional[str]:
+    """
+    Normalizes a profiling switch, e.g. the `RECOMMENDER_PROFILE` environment variable or a request parameter.
+
+    Args:
+        value (Optional[str]): "sampling", "cprofile", a true value ("1", "true", "yes") for sampling, or a
+                               false or empty value to disable profiling.
+
+    Returns:
+        Optional[str]: One of `PROFILE_MODES`, or None when profiling is off.
+
+    Raises:
+        ValueError: If the value is not recognized.
+    """
+    value = (value or "").strip().lower()
+    if value in ("", "0", "false", "no", "off"):
+        return None
+    if value in ("1", "true", "yes", "on"):
+        return PROFILE_SAMPLING
+    if value not in PROFILE_MODES:
+        raise ValueError(f"Unknown profiling mode {value}; expected one of {', '.join(PROFILE_MODES)}")
+    return value
+
+
+def profiled(profiler: Optional["RequestProfiler"], name: str, function: Callable[[], T]) -> Callable[[], T]:
+    """
+    Wraps a stage in `profiler.stage`, or returns it unchanged when the request is not profiled.
+    """
+    return profiler.stage(name, function) if profiler is not None else function
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class RequestProfiler:
+    """
+    Profiles one recommendation request and writes the profile when the request is slow.
+
+    A sampling thread reads the stack of every thread working on the request every `interval` seconds and
+    counts the collapsed stacks, prefixed with the stage the thread is running. That covers the stages run
+    in worker threads with a time budget as well as the inline ones. The `.collapsed` file feeds
+    flamegraph.pl or speedscope directly. In `cprofile` mode each thread is also traced with cProfile,
+    and the merged statistics are written as a `.prof` file for pstats or snakeviz. tracemalloc records
+    the allocation peak of each stage. Its peak is process-wide, so it is only indicative while other
+    requests run at the same time.
+
+    Use it as a context manager around the request and wrap each stage with `stage` (or `profiled`).
+    """
+    def __init__(self, mode: str, label: str, threshold: float = PROFILE_THRESHOLD, directory: str = PROFILE_DIR,
+                 interval: float = PROFILE_SAMPLE_INTERVAL) -> None:
+        """
+        Initializes the profiler.
+
+        Args:
+            mode (str): One of `PROFILE_MODES`.
+            label (str): Identifies the request in file names and logs, e.g. "user-42".
+            threshold (float): Seconds a request must take for its profile to be written.
+            directory (str): Directory the profiles are written to.
+            interval (float): Seconds between stack samples.
+        """
+        self.logger = Logger()
+        self.mode = mode
+        self.label = label
+        self.threshold = threshold
+        self.directory = directory
+        self.interval = interval
+        self.seconds: Optional[float] = None
+        self.alloc_peak = 0
+        self.stages: List[Dict] = []
+        self.samples: Counter = Counter()
+        self.dumped: Optional[str] = None
+        self._stage_names: Dict[int, List[str]] = {}
+        self._profiles: Dict[int, cProfile.Profile] = {}
+        self._finished_profiles: List[cProfile.Profile] = []
+        self._stopped = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._started = 0.0
+        self._alloc_base = 0
+
+    @classmethod
+    def for_request(cls, mode: Optional[str], label: str) -> Optional["RequestProfiler"]:
+        """
+        Profiler for a request, or None when neither the request nor `PROFILE_MODE` enables profiling.
+
+        Args:
+            mode (Optional[str]): Mode requested for this request; the configured mode when None.
+            label (str): Identifies the request.
+        """
+        mode = resolve_mode(mode or PROFILE_MODE)
+        return cls(mode, label) if mode is not None else None
+
+    def __enter__(self) -> "RequestProfiler":
+        global _tracing, _tracing_started
+        with _tracing_lock:
+            if _tracing == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _tracing_started = True
+            _tracing += 1
+        self._alloc_base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+
+        self._enter_thread("FilterPipe")
+        self._started = time.perf_counter()
+        self._sampler = threading.Thread(target=self._sample, name=f"profiler-{self.label}", daemon=True)
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        global _tracing, _tracing_started
+        self.seconds = time.perf_counter() - self._started
+        self._exit_thread()
+        self._stopped.set()
+        self._sampler.join()
+        self.alloc_peak = max([tracemalloc.get_traced_memory()[1] - self._alloc_base] + [stage["alloc_peak_bytes"] for stage in self.stages])
+        with _tracing_lock:
+            _tracing -= 1
+            if _tracing == 0 and _tracing_started:
+                tracemalloc.stop()
+                _tracing_started = False
+
+        if self.seconds >= self.threshold:
+            try:
+                self.dumped = self.dump()
+            except OSError as e:
+                self.logger.error(f"Could not write the profile of {self.label}: {str(e)}")
+
+    def stage(self, name: str, function: Callable[[], T]) -> Callable[[], T]:
+        """
+        Wraps a stage so its time, allocation peak and stacks are attributed to `name`, in whichever
+        thread it runs.
+
+        Args:
+            name (str): Name of the stage, e.g. the filter class.
+            function (Callable[[], T]): The stage.
+
+        Returns:
+            Callable[[], T]: The wrapped stage.
+        """
+        def run() -> T:
+            self._enter_thread(name)
+            started = time.perf_counter()
+            alloc_base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            try:
+                return function()
+            finally:
+                alloc_peak = max(tracemalloc.get_traced_memory()[1] - alloc_base, 0)
+                self._exit_thread()
+                with self._lock:
+                    self.stages.append({"name": name, "seconds": round(time.perf_counter() - started, 6), "alloc_peak_bytes": alloc_peak})
+        return run
+
+    def dump(self) -> str:
+        """
+        Writes the profile: a JSON summary, the collapsed stacks and, in `cprofile` mode, the statistics.
+
+        Returns:
+            str: Path of the JSON summary; the other files share its name.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, f"{datetime.now():%Y%m%dT%H%M%S}-{self.label}-{uuid.uuid4().hex[:8]}")
+        files = {"collapsed": base + ".collapsed"}
+        with open(files["collapsed"], "w") as file:
+            for stack, count in sorted(self.samples.items()):
+                file.write(f"{stack} {count}\n")
+
+        with self._lock:
+            profiles = list(self._finished_profiles)
+        if profiles:
+            files["stats"] = base + ".prof"
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(files["stats"])
+
+        summary = {
+            "label": self.label,
+            "mode": self.mode,
+            "seconds": round(self.seconds, 6),
+            "threshold": self.threshold,
+            "alloc_peak_bytes": self.alloc_peak,
+            "samples": sum(self.samples.values()),
+            "sample_interval": self.interval,
+            "stages": self.stages,
+            "files": files
+        }
+        with open(base + ".json", "w") as file:
+            json.dump(summary, file, indent=2)
+        self.logger.warn(f"Slow request {self.label} took {self.seconds * 1000:.0f} ms; profile written to {base}.json.")
+        return base + ".json"
+
+    def _enter_thread(self, name: str) -> None:
+        """
+        Marks the current thread as working on `name` for the sampler, starting its cProfile in that mode.
+        """
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._stage_names.setdefault(thread_id, []).append(name)
+            # A thread keeps one profiler for its outermost stage; nested inline stages are part of it
+            start_profile = self.mode == PROFILE_CPROFILE and thread_id not in self._profiles
+            if start_profile:
+                self._profiles[thread_id] = cProfile.Profile()
+        if start_profile:
+            try:
+                self._profiles[thread_id].enable()
+            except ValueError:
+                # Interpreters with a single process-wide profiler slot refuse a second concurrent one
+                with self._lock:
+                    del self._profiles[thread_id]
+
+    def _exit_thread(self) -> None:
+        thread_id = threading.get_ident()
+        with self._lock:
+            names = self._stage_names[thread_id]
+            names.pop()
+            if names:
+                return
+            del self._stage_names[thread_id]
+            profile = self._profiles.pop(thread_id, None)
+        if profile is not None:
+            profile.disable()
+            with self._lock:
+                self._finished_profiles.append(profile)
+
+    def _sample(self) -> None:
+        sampler_id = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                active = [(thread_id, names[-1]) for thread_id, names in self._stage_names.items() if names]
+            for thread_id, name in active:
+                frame = frames.get(thread_id)
+                if frame is None or thread_id == sampler_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                self.samples[";".join([name] + stack[::-1])] += 1
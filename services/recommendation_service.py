@@ -0,0 +1,501 @@
+import asyncio
+import json
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Callable, Dict, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlsplit
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from data_access.config import SERVICE_HOST, SERVICE_PORT, SERVICE_WORKERS, SERVICE_SHUTDOWN_TIMEOUT, \
+    COLD_START_REFRESH_INTERVAL, MODEL_DIR, CONTENT_FEATURIZER, HASHING_FEATURES, DIVERSITY_TRADE_OFF, DIVERSITY_WINDOW, \
+    DIVERSITY_MAX_PER_BRAND, DIVERSITY_MAX_PER_CATEGORY, SERVICE_REQUEST_BUDGET, SERVICE_FILTER_BUDGET, SESSION_FILTER_WEIGHT
+from data_access.db.db import SessionFactory, engine
+from data_access.db.repositories import InteractionRepository
+from filters.candidate_generator import CandidateGenerator
+from filters.co_interaction_counter import CoInteractionCounter
+from filters.collaborative_filter import CollaborativeFilter
+from filters.content_based_filter import ContentBaseFilter
+from filters.content_model import ContentModel, create_vectorizer
+from filters.diversity_reranker import DiversityReranker
+from filters.memory_budget import MemoryBudget
+from filters.filter_pipe import FilterPipe
+from filters.recent_interactions import RecentInteractions
+from filters.seen_items_index import SeenItemsIndex
+from filters.session_filter import SessionFilter
+from filters.user_profile_store import UserProfileStore
+from models.context_model import Context
+from models.filter_result_model import FilterResultModel, PATH_WARMING_UP
+from services.cold_start_service import ColdStartService
+from services.logger import Logger
+from services.model_registry import ModelBundle, ModelHandle, ModelRegistry
+from services.profiler import resolve_mode
+from services.warm_up import WarmUp
+
+INTERACTION_TYPES = ("view", "like", "purchase")
+MAX_LIMIT = 100
+MAX_BODY_SIZE = 64 * 1024
+
+
+def load_content_model(session: Session, directory: str = MODEL_DIR) -> Tuple[ContentModel, UserProfileStore]:
+    """
+    Loads the content model and its user profiles from a directory, fitting and saving whatever is missing.
+
+    Args:
+        session (Session): Session used when the model or the profiles have to be built.
+        directory (str): Directory holding the persisted model.
+
+    Returns:
+        Tuple[ContentModel, UserProfileStore]: The model and profiles, not yet attached to repository events.
+    """
+    logger = Logger()
+    model = ContentModel.load(directory)
+    profiles = UserProfileStore.load(directory, model) if model is not None else None
+    if model is None:
+        logger.info("Fitting content model.")
+        model = ContentModel.from_session(session, create_vectorizer(CONTENT_FEATURIZER, n_features=HASHING_FEATURES))
+        model.save(directory)
+    if profiles is None:
+        profiles = UserProfileStore(model).build(MemoryBudget().interaction_triples(session))
+        profiles.save(directory)
+    return model, profiles
+
+
+class HttpError(Exception):
+    """
+    Raised by request handlers to answer with a specific HTTP status.
+    """
+    def __init__(self, status: HTTPStatus, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class RecommendationService:
+    """
+    Headless asyncio HTTP service that exposes the recommendation pipeline.
+
+    Routes:
+        GET  /recommendations/{user_id}?limit=N  Ranked recommendations for a user; `&profile=sampling` or
+                                                 `&profile=cprofile` profiles the request (see `RequestProfiler`).
+        POST /interactions                       Records a view, like or purchase.
+        GET  /health                             Liveness: 200 while the process serves requests.
+        GET  /ready                              Readiness: 200 once warm-up finished, 503 before.
+
+    The event loop only parses requests and writes responses; database access and
+    pipeline work run in a thread pool, each request with its own session taken
+    from the engine's connection pool. The models are loaded from the model registry
+    (or built and published on first use) and then updated in place by every recorded
+    interaction; newly promoted registry versions are swapped in without a restart.
+    Cold-start popularity lists are refreshed in the background. The current session of every user is
+    kept in memory from the interactions recorded since start-up, so a click re-ranks the user's next
+    recommendations at once through the session filter.
+
+    `start` warms the process up in a background thread: the popularity lists first, then the models
+    and the reranker's product attributes, then the seen-items index and the co-interaction counts read by
+    the candidate generator. Until that finishes, recommendation requests get the
+    cold-start list (path `warming_up`), or 503 if not even that is available yet. If the warm-up
+    fails, requests load the models themselves, as without warm-up.
+    """
+
+    def __init__(self, host: str = SERVICE_HOST, port: int = SERVICE_PORT, workers: int = SERVICE_WORKERS,
+                 session_factory: Callable[[], Session] = SessionFactory, registry: Optional[ModelRegistry] = None) -> None:
+        """
+        Initializes the service.
+
+        Args:
+            host (str): Interface to bind.
+            port (int): Port to listen on.
+            workers (int): Number of threads running pipeline work.
+            session_factory (Callable[[], Session]): Factory returning a new session per request.
+            registry (Optional[ModelRegistry]): Registry the models are loaded from; the default registry when omitted.
+        """
+        self.logger = Logger()
+        self.host = host
+        self.port = port
+        self.session_factory = session_factory
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="recommendation-worker")
+        self.server: Optional[asyncio.AbstractServer] = None
+        self._connections: Set[asyncio.Task] = set()
+        self._stopping: Optional[asyncio.Event] = None
+        self.registry = registry or ModelRegistry()
+        self.models = ModelHandle()
+        self._model_lock = threading.Lock()
+        self.cold_start = ColdStartService()
+        self.seen_items: Optional[SeenItemsIndex] = None
+        self.co_interactions: Optional[CoInteractionCounter] = None
+        self.recent_interactions = RecentInteractions()
+        self.warm_up: Optional[WarmUp] = None
+
+    async def start(self) -> None:
+        """
+        Binds the listening socket and starts accepting connections.
+        """
+        self._stopping = asyncio.Event()
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.recent_interactions.attach()
+        self.warm_up = WarmUp([
+            ("cold_start", self._warm_cold_start),
+            ("models", self._warm_models),
+            ("seen_items", self._warm_seen_items),
+            ("co_interactions", self._warm_co_interactions)
+        ], name="recommendation-warm-up").start()
+        self.models.watch(self.registry, self.session_factory)
+        self.logger.info(f"Recommendation service listening on {self.host}:{self.port}.")
+
+    async def serve_forever(self) -> None:
+        """
+        Runs the service until SIGINT/SIGTERM is received, then shuts down gracefully.
+        """
+        await self.start()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self._stopping.set)
+            except NotImplementedError:
+                # Signal handlers are not available on every platform (e.g. Windows)
+                pass
+        await self._stopping.wait()
+        await self.shutdown()
+
+    async def shutdown(self, timeout: float = SERVICE_SHUTDOWN_TIMEOUT) -> None:
+        """
+        Stops accepting connections, lets in-flight requests finish and releases resources.
+
+        Args:
+            timeout (float): Seconds to wait for in-flight requests before cancelling them.
+        """
+        self.logger.info("Shutting down recommendation service.")
+        if self._stopping is not None:
+            self._stopping.set()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+        if self._connections:
+            done, pending = await asyncio.wait(self._connections, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                self.logger.warn(f"Cancelled {len(pending)} connections still open after {timeout}s.")
+
+        self.executor.shutdown(wait=True)
+        self.cold_start.stop()
+        if self.seen_items is not None:
+            self.seen_items.detach()
+        if self.co_interactions is not None:
+            self.co_interactions.detach()
+        self.recent_interactions.detach()
+        self.models.close()
+        engine.dispose()
+        self.logger.info("Recommendation service stopped.")
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Serves requests on a connection until the client closes it or the service stops.
+        """
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            keep_alive = True
+            while keep_alive and not self._stopping.is_set():
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+
+                try:
+                    status, payload = await self._dispatch(method, target, body)
+                except HttpError as e:
+                    status, payload = e.status, {"error": e.message}
+                except Exception as e:
+                    self.logger.error(f"Unhandled error serving {method} {target}: {str(e)}")
+                    status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "Internal server error"}
+
+                await self._write_response(writer, status, payload, keep_alive and not self._stopping.is_set())
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except HttpError as e:
+            await self._write_response(writer, e.status, {"error": e.message}, False)
+        finally:
+            self._connections.discard(task)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+        """
+        Reads a single HTTP/1.1 request.
+
+        Returns:
+            Optional[Tuple[str, str, Dict[str, str], bytes]]: Method, target, lower-cased headers and body,
+                                                              or None when the client closed the connection.
+        """
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Malformed request line")
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get("content-length", 0) or 0)
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length")
+        if length < 0:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length")
+        if length > MAX_BODY_SIZE:
+            raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target, headers, body
+
+    async def _write_response(self, writer: asyncio.StreamWriter, status: HTTPStatus, payload: dict, keep_alive: bool) -> None:
+        """
+        Serializes a JSON response and writes it to the client.
+        """
+        body = json.dumps(payload).encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+    async def _dispatch(self, method: str, target: str, body: bytes) -> Tuple[HTTPStatus, dict]:
+        """
+        Routes a request to its handler, running blocking work in the executor.
+        """
+        url = urlsplit(target)
+        parts = [part for part in url.path.split("/") if part]
+        loop = asyncio.get_running_loop()
+
+        if parts[:1] == ["recommendations"] and len(parts) == 2:
+            if method != "GET":
+                raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED, "Use GET")
+            user_id = self._parse_int(parts[1], "user_id")
+            query = parse_qs(url.query)
+            limit = self._parse_int(query.get("limit", ["10"])[0], "limit")
+            if not 1 <= limit <= MAX_LIMIT:
+                raise HttpError(HTTPStatus.BAD_REQUEST, f"limit must be between 1 and {MAX_LIMIT}")
+            try:
+                profile = resolve_mode(query.get("profile", [None])[0])
+            except ValueError as e:
+                raise HttpError(HTTPStatus.BAD_REQUEST, str(e))
+            payload = await loop.run_in_executor(self.executor, self._recommend, user_id, limit, profile)
+            return HTTPStatus.OK, payload
+
+        if parts in (["health"], ["ready"]):
+            if method != "GET":
+                raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED, "Use GET")
+            if parts == ["health"]:
+                return HTTPStatus.OK, {"status": "ok"}
+            status = self.warm_up.status() if self.warm_up is not None else {"ready": False, "error": None, "steps": []}
+            return (HTTPStatus.OK if status["ready"] else HTTPStatus.SERVICE_UNAVAILABLE), status
+
+        if parts == ["interactions"]:
+            if method != "POST":
+                raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED, "Use POST")
+            data = self._parse_interaction(body)
+            await loop.run_in_executor(self.executor, self._record_interaction, data)
+            return HTTPStatus.CREATED, data
+
+        raise HttpError(HTTPStatus.NOT_FOUND, f"No route for {url.path}")
+
+    def _recommend(self, user_id: int, limit: int, profile: Optional[str] = None) -> dict:
+        """
+        Runs the filter pipeline for a user inside a request-scoped session.
+
+        Args:
+            user_id (int): The ID of the user.
+            limit (int): Maximum number of recommendations.
+            profile (Optional[str]): Profiling mode requested for this request; the configured one when None.
+
+        Returns:
+            dict: JSON-serializable recommendations payload.
+        """
+        session = self.session_factory()
+        filter_pipe = None
+        try:
+            if self.warm_up is not None and not self.warm_up.done:
+                return self._response(self._warming_up(session, user_id, limit), limit)
+
+            self._ensure_models(session)
+            # Keep the bundle this request started with, even if a new version is swapped in meanwhile
+            with self.models.acquire() as models:
+                # The session filter adds the neighbours of the session to the candidates and runs first, so it
+                # scores every candidate before the other filters narrow them down
+                session_filter = SessionFilter(self.recent_interactions, models.item_neighbours)
+                filter_pipe = FilterPipe([
+                    session_filter,
+                    ContentBaseFilter(session, cold_start=self.cold_start, model=models.content_model, profiles=models.profiles,
+                                      seen=self.seen_items),
+                    CollaborativeFilter(session, model=models.interaction_matrix, cold_start=self.cold_start, seen=self.seen_items)
+                ], session=session, candidate_generator=CandidateGenerator.default(session, counter=self.co_interactions,
+                                                                                  session_filter=session_filter),
+                   cold_start=self.cold_start, weights=[SESSION_FILTER_WEIGHT, 1.0, 1.0],
+                   reranker=DiversityReranker(session, models.content_model, DIVERSITY_TRADE_OFF, DIVERSITY_WINDOW,
+                                              DIVERSITY_MAX_PER_BRAND, DIVERSITY_MAX_PER_CATEGORY),
+                   budget=SERVICE_REQUEST_BUDGET, filter_budgets=[SERVICE_FILTER_BUDGET, SERVICE_FILTER_BUDGET, SERVICE_FILTER_BUDGET])
+                # The candidate generator supplies the products to score
+                result = filter_pipe.apply_filters(Context([], user_id, limit, profile))
+        finally:
+            # A filter abandoned after its budget may still be using the session; close it once it finishes
+            if filter_pipe is not None:
+                filter_pipe.when_idle(session.close)
+            else:
+                session.close()
+
+        return self._response(result, limit)
+
+    def _warming_up(self, session: Session, user_id: int, limit: int) -> FilterResultModel:
+        """
+        Cold-start recommendations served while the models are still loading.
+
+        Raises:
+            HttpError: 503 if the popularity lists are not loaded yet either.
+        """
+        recommendations = self.cold_start.recommend_for_user(session, user_id, limit)
+        if not recommendations:
+            raise HttpError(HTTPStatus.SERVICE_UNAVAILABLE, "Service is warming up, retry shortly")
+        return FilterResultModel(user_id, recommendations, path=PATH_WARMING_UP, reason="models are loading")
+
+    @staticmethod
+    def _response(result: FilterResultModel, limit: int) -> dict:
+        payload = {
+            "user_id": result.user_id,
+            "path": result.path,
+            "recommendations": [
+                {"product_id": rec.product_id, "score": float(rec.similarity_score)}
+                for rec in result.recommendations[:limit]
+            ]
+        }
+        # Only slow profiled requests have one
+        if result.profile is not None:
+            payload["profile"] = result.profile
+        return payload
+
+    def _warm_cold_start(self) -> None:
+        """
+        Warm-up step: fills the popularity lists, then leaves them to the periodic refresh.
+        """
+        try:
+            with self.session_factory() as session:
+                self.cold_start.refresh(session)
+        finally:
+            # The periodic refresh retries at once if this refresh failed
+            self.cold_start.start_periodic_refresh(self.session_factory, COLD_START_REFRESH_INTERVAL,
+                                                   refresh_now=self.cold_start.refreshed_at is None)
+
+    def _warm_models(self) -> None:
+        """
+        Warm-up step: loads or builds the model bundle and the product attributes of the reranker.
+        """
+        with self.session_factory() as session:
+            self._ensure_models(session)
+            with self.models.acquire() as models:
+                DiversityReranker(session, models.content_model).preload()
+
+    def _warm_seen_items(self) -> None:
+        """
+        Warm-up step: builds the seen-items index; filters query the user's interactions until it is set.
+        """
+        with self.session_factory() as session:
+            self.seen_items = SeenItemsIndex().attach().build(session)
+
+    def _warm_co_interactions(self) -> None:
+        """
+        Warm-up step: replays the interactions into the co-interaction counts; candidates are queried from the
+        database until they are set.
+        """
+        with self.session_factory() as session:
+            # Subscribed after the replay, so no interaction is counted twice
+            counter = CoInteractionCounter().build(session)
+        self.co_interactions = counter.attach()
+
+    def _ensure_models(self, session: Session) -> None:
+        """
+        Loads the registry's latest version on first use, or builds and publishes one if the registry is empty.
+
+        Args:
+            session (Session): Session used for the catch-up or the initial build.
+        """
+        if self.models.current is not None:
+            return
+        with self._model_lock:
+            if self.models.current is None:
+                bundle = self.registry.load()
+                if bundle is None:
+                    self.logger.info("No model version in the registry; building one.")
+                    bundle = ModelBundle.build(session)
+                    self.registry.publish(bundle)
+                self.models.swap(bundle.activate(session))
+
+    def _record_interaction(self, data: dict) -> None:
+        """
+        Stores an interaction inside a request-scoped session.
+
+        Args:
+            data (dict): Validated interaction payload.
+        """
+        with self.session_factory() as session:
+            try:
+                InteractionRepository(session).create_interaction(
+                    data["user_id"], data["product_id"], data["interaction_type"], data.get("description")
+                )
+            except IntegrityError as e:
+                session.rollback()
+                raise HttpError(HTTPStatus.CONFLICT, f"Interaction rejected: {e.orig}")
+
+    def _parse_interaction(self, body: bytes) -> dict:
+        """
+        Validates the JSON body of `POST /interactions`.
+        """
+        try:
+            data = json.loads(body or b"{}")
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Body must be valid JSON")
+        if not isinstance(data, dict):
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Body must be a JSON object")
+
+        missing = [key for key in ("user_id", "product_id", "interaction_type") if key not in data]
+        if missing:
+            raise HttpError(HTTPStatus.BAD_REQUEST, f"Missing fields: {', '.join(missing)}")
+        if data["interaction_type"] not in INTERACTION_TYPES:
+            raise HttpError(HTTPStatus.BAD_REQUEST, f"interaction_type must be one of {', '.join(INTERACTION_TYPES)}")
+
+        return {
+            "user_id": self._parse_int(data["user_id"], "user_id"),
+            "product_id": str(data["product_id"]),
+            "interaction_type": data["interaction_type"],
+            "description": data.get("description")
+        }
+
+    @staticmethod
+    def _parse_int(value, name: str) -> int:
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise HttpError(HTTPStatus.BAD_REQUEST, f"{name} must be an integer")
+
+
+def main() -> None:
+    asyncio.run(RecommendationService().serve_forever())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import re
+from typing import List
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.utils import murmurhash3_32
+
+# Same preprocessing, token pattern and stop words as the content model's vectorizers
+_analyzer = TfidfVectorizer(stop_words='english').build_analyzer()
+_whitespace = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Lower-cases a description and collapses runs of whitespace.
+
+    Args:
+        text (str): Raw description.
+
+    Returns:
+        str: The normalized description.
+    """
+    return _whitespace.sub(" ", (text or "").lower()).strip()
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits a description into the tokens the TF-IDF vectorizer would extract (stop words removed).
+
+    Args:
+        text (str): Raw or normalized description.
+
+    Returns:
+        List[str]: The tokens, in order.
+    """
+    return _analyzer(text or "")
+
+
+def hash_tokens(tokens: List[str]) -> List[int]:
+    """
+    Hashes tokens with the signed 32-bit MurmurHash3 used by `HashingVectorizer`.
+
+    The column of a token in a hashing feature space of size `n` is `abs(hash) % n`.
+
+    Args:
+        tokens (List[str]): Tokens to hash.
+
+    Returns:
+        List[int]: One signed hash per token.
+    """
+    return [murmurhash3_32(token, seed=0) for token in tokens]
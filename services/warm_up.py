@@ -0,0 +1,156 @@
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from services.logger import Logger
+
+# States of a warm-up step
+STEP_PENDING = "pending"
+STEP_RUNNING = "running"
+STEP_DONE = "done"
+STEP_FAILED = "failed"
+
+
+class WarmUp:
+    """
+    Runs the start-up steps of a process (loading or building models, popularity lists, caches) in a
+    background thread, so the first requests do not pay for them.
+
+    Steps run in order; the value each returns is kept and can be read with `result` as soon as the step
+    finishes, before the whole warm-up is done. The process is ready once every step has finished. A
+    failed step stops the warm-up and is reported by `failed` and `status`; callers decide how to serve
+    requests in the meantime, and `retry` runs the failed and remaining steps again.
+    """
+    def __init__(self, steps: List[Tuple[str, Callable[[], Any]]], name: str = "warm-up") -> None:
+        """
+        Initializes the warm-up; call `start` to run it.
+
+        Args:
+            steps (List[Tuple[str, Callable[[], Any]]]): `(name, function)` pairs run in order.
+            name (str): Name of the background thread.
+        """
+        self.logger = Logger()
+        self.steps = steps
+        self.name = name
+        self.failed: Optional[str] = None
+        self._states: Dict[str, str] = {step: STEP_PENDING for step, _ in steps}
+        self._seconds: Dict[str, float] = {}
+        self._results: Dict[str, Any] = {}
+        self._ready = threading.Event()
+        self._finished = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    @property
+    def done(self) -> bool:
+        """
+        True once the warm-up has finished, whether every step succeeded or one failed.
+        """
+        return self._finished.is_set()
+
+    def start(self) -> "WarmUp":
+        """
+        Starts the steps in a daemon thread; further calls do nothing.
+
+        Returns:
+            WarmUp: The warm-up itself, for chaining.
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+        return self
+
+    def retry(self) -> "WarmUp":
+        """
+        Runs the failed step and the ones after it again in a new thread, keeping the results of the steps
+        that succeeded, so models already built and subscribed to events are not built twice. Does nothing
+        unless the warm-up has finished with a failure.
+
+        Returns:
+            WarmUp: The warm-up itself, for chaining.
+        """
+        with self._lock:
+            if not self._finished.is_set() or self.failed is None:
+                return self
+            self.logger.warn(f"Retrying warm-up after failure in {self.failed}.")
+            self.failed = None
+            for step, _ in self.steps:
+                if self._states[step] != STEP_DONE:
+                    self._states[step] = STEP_PENDING
+            self._finished.clear()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        return self
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until the warm-up has finished or `timeout` seconds have passed.
+
+        Returns:
+            bool: True if the process is ready.
+        """
+        self._finished.wait(timeout)
+        return self.ready
+
+    def has_result(self, step: str) -> bool:
+        return self._states.get(step) == STEP_DONE
+
+    def result(self, step: str) -> Any:
+        """
+        Returns the value produced by a finished step.
+
+        Raises:
+            KeyError: If the step is unknown or has not finished successfully.
+        """
+        with self._lock:
+            if self._states.get(step) != STEP_DONE:
+                raise KeyError(f"Warm-up step {step} is {self._states.get(step, 'unknown')}")
+            return self._results[step]
+
+    def status(self) -> dict:
+        """
+        JSON-serializable progress report, e.g. for a readiness endpoint.
+        """
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "error": self.failed,
+                "steps": [
+                    {"name": step, "state": self._states[step], "seconds": round(self._seconds[step], 3) if step in self._seconds else None}
+                    for step, _ in self.steps
+                ]
+            }
+
+    def _run(self) -> None:
+        started = time.perf_counter()
+        try:
+            for step, function in self.steps:
+                with self._lock:
+                    # Steps that succeeded before a retry keep their result
+                    if self._states[step] == STEP_DONE:
+                        continue
+                    self._states[step] = STEP_RUNNING
+                step_started = time.perf_counter()
+                try:
+                    value = function()
+                except Exception as e:
+                    with self._lock:
+                        self._states[step] = STEP_FAILED
+                        self._seconds[step] = time.perf_counter() - step_started
+                        self.failed = f"{step}: {str(e)}"
+                    self.logger.error(f"Warm-up step {step} failed: {str(e)}")
+                    return
+                with self._lock:
+                    self._results[step] = value
+                    self._states[step] = STEP_DONE
+                    self._seconds[step] = time.perf_counter() - step_started
+                self.logger.info(f"Warm-up step {step} finished in {self._seconds[step]:.2f}s.")
+
+            self._ready.set()
+            self.logger.info(f"Warm-up finished in {time.perf_counter() - started:.2f}s.")
+        finally:
+            self._finished.set()
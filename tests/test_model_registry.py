@@ -0,0 +1,126 @@
+import json
+import os
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from data_access.db.models import Base, Customer, Interaction, Product
+from data_access.db.repositories import InteractionRepository
+from services.model_registry import MANIFEST_FILE, ModelBundle, ModelHandle, ModelRegistry
+
+WORDS = ["red", "blue", "shoe", "shirt", "phone", "case", "cable", "lamp", "desk", "chair", "toy", "book"]
+INTERACTION_TYPES = ["view", "like", "purchase"]
+
+
+@pytest.fixture
+def session():
+    """
+    In-memory SQLite database with 6 customers, 12 products and a few interactions per customer.
+    """
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine, autoflush=False)()
+    for customer_id in range(1, 7):
+        session.add(Customer(customer_id=customer_id, age=30, gender="Female", location="NY", category="Home"))
+    for i in range(12):
+        session.add(Product(unique_id=f"p{i}", product_name=f"{WORDS[i]} {WORDS[(i + 3) % 12]}",
+                            about_product=f"{WORDS[(i + 5) % 12]} {WORDS[(i + 7) % 12]}", category="Home"))
+    start = datetime.now() - timedelta(days=1)
+    for customer_id in range(1, 7):
+        for j in range(4):
+            session.add(Interaction(user_id=customer_id, product_id=f"p{(customer_id * 2 + j) % 12}",
+                                    interaction_type=INTERACTION_TYPES[j % 3],
+                                    time_stamp=start + timedelta(minutes=customer_id * 10 + j)))
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return ModelRegistry(str(tmp_path / "registry"))
+
+
+def unseen_product(bundle: ModelBundle, user_id: int) -> str:
+    matrix = bundle.interaction_matrix
+    row = matrix.user_index[user_id]
+    return next(product_id for col, product_id in enumerate(matrix.product_ids) if matrix.get_weight(row, col) == 0)
+
+
+def weight(bundle: ModelBundle, user_id: int, product_id: str) -> float:
+    matrix = bundle.interaction_matrix
+    return matrix.get_weight(matrix.user_index[user_id], matrix.product_index[product_id])
+
+
+def test_publish_load_activate_swap_and_drain(session, registry):
+    built = ModelBundle.build(session)
+    first = registry.publish(built)
+    assert registry.latest_version() == first
+    assert registry.verify(first)
+
+    serving = registry.load()
+    assert serving.version == first
+    assert serving.content_model.product_ids == built.content_model.product_ids
+    assert serving.interaction_matrix.user_ids == built.interaction_matrix.user_ids
+    assert serving.interaction_matrix.product_ids == built.interaction_matrix.product_ids
+    assert (serving.item_neighbours.matrix != built.item_neighbours.matrix).nnz == 0
+
+    handle = ModelHandle()
+    handle.swap(serving.activate(session))
+    try:
+        # The serving bundle follows the interactions recorded through the repository
+        product_id = unseen_product(serving, 1)
+        InteractionRepository(session).create_interaction(1, product_id, "purchase")
+        assert weight(serving, 1, product_id) > 0
+
+        second = registry.publish(ModelBundle.build(session), promote=False)
+        assert registry.latest_version() == first
+        registry.promote(second)
+        assert registry.latest_version() == second
+        replacement = registry.load().activate(session)
+        assert weight(replacement, 1, product_id) > 0
+
+        # A request in flight keeps the version it started with until it releases it
+        with handle.acquire() as in_flight:
+            handle.swap(replacement)
+            assert in_flight is serving
+            assert handle.current is replacement
+            assert serving.retired and serving.refs == 1
+        assert serving.refs == 0
+
+        # Once drained, the old version no longer updates; the new one does
+        product_id = unseen_product(replacement, 2)
+        InteractionRepository(session).create_interaction(2, product_id, "view")
+        assert weight(replacement, 2, product_id) > 0
+        assert weight(serving, 2, product_id) == 0
+    finally:
+        handle.close()
+
+
+def test_load_rejects_unknown_and_corrupted_versions(session, registry):
+    version = registry.publish(ModelBundle.build(session))
+    assert registry.load("unknown") is None
+    with pytest.raises(ValueError):
+        registry.promote("unknown")
+
+    name = sorted(registry.manifest(version)["files"])[0]
+    with open(os.path.join(registry.versions_dir, version, name), "ab") as file:
+        file.write(b"\0")
+    assert not registry.verify(version)
+    assert registry.load(version) is None
+
+
+def test_load_rejects_a_version_without_item_neighbours(session, registry):
+    version = registry.publish(ModelBundle.build(session))
+    directory = os.path.join(registry.versions_dir, version)
+    manifest = registry.manifest(version)
+    name = next(name for name in manifest["files"] if name.startswith("item_neighbours"))
+    # Drop the table from the manifest too, so the version still verifies
+    del manifest["files"][name]
+    os.remove(os.path.join(directory, name))
+    with open(os.path.join(directory, MANIFEST_FILE), "w") as file:
+        json.dump(manifest, file)
+    assert registry.verify(version)
+    assert registry.load(version) is None